@@ -0,0 +1,186 @@
+"""Micro-benchmark of the extractors against the original BeautifulSoup path.
+
+Replays the coach files cached under `data/<site>/coaches` through both the
+current `Extractor` and a reference implementation of the BeautifulSoup tree
+walks it replaced. Language detection is stubbed out on both sides so only
+parsing and field lookups are measured. Run via:
+```bash
+$ poetry run python3 -m bench.extract --site chesscom --site lichess
+```
+"""
+import argparse
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List
+
+from bs4 import BeautifulSoup, SoupStrainer, Tag
+
+from coach_scraper.chesscom import Extractor as ChesscomExtractor
+from coach_scraper.language import Detector
+from coach_scraper.lichess import Extractor as LichessExtractor
+from coach_scraper.types import Site
+
+
+class _NullDetector(Detector):
+    def detect(self, text: str):
+        return None
+
+
+def _text(tag: Any) -> str | None:
+    return tag.get_text().strip() if isinstance(tag, Tag) else None
+
+
+def _chesscom_filter(elem: Tag | str | None, attrs={}) -> bool:
+    for className in ["profile-header-info", "profile-card-info", "profile-about"]:
+        if className in attrs.get("class", ""):
+            return True
+    return False
+
+
+def _chesscom_reference(username: str, files: Dict[str, str]) -> Dict[str, Any]:
+    with open(files["profile"], "r") as f:
+        soup = BeautifulSoup(
+            f.read(), "lxml", parse_only=SoupStrainer(_chesscom_filter)
+        )
+    stats = {}
+    with open(files["stats"], "r") as f:
+        for s in json.load(f).get("stats", []):
+            if "key" in s and "stats" in s:
+                stats[s["key"]] = s["stats"]
+    avatar = soup.find("div", class_="profile-header-avatar")
+    img = avatar.find("img") if isinstance(avatar, Tag) else None
+    about = soup.find("div", class_="profile-about")
+    return {
+        "name": _text(soup.find("div", class_="profile-card-name")),
+        "image_url": img.get("src") if isinstance(img, Tag) else None,
+        "title": _text(soup.find("a", class_="profile-card-chesstitle")),
+        "about": about.text if isinstance(about, Tag) else None,
+        "rapid": stats.get("rapid", {}).get("rating"),
+        "blitz": stats.get("lightning", {}).get("rating"),
+        "bullet": stats.get("bullet", {}).get("rating"),
+    }
+
+
+def _lichess_profile_filter(elem: Tag | str | None, attrs={}) -> bool:
+    return "coach-widget" in attrs.get("class", "")
+
+
+def _lichess_stats_filter(elem: Tag | str | None, attrs={}) -> bool:
+    for className in ["user-link", "profile-side", "sub-ratings"]:
+        if className in attrs.get("class", ""):
+            return True
+    return False
+
+
+def _lichess_reference(username: str, files: Dict[str, str]) -> Dict[str, Any]:
+    with open(files["profile"], "r") as f:
+        profile = BeautifulSoup(
+            f.read(), "lxml", parse_only=SoupStrainer(_lichess_profile_filter)
+        )
+    with open(files["stats"], "r") as f:
+        stats = BeautifulSoup(
+            f.read(), "lxml", parse_only=SoupStrainer(_lichess_stats_filter)
+        )
+
+    def rating(name: str) -> str | None:
+        a = stats.find("a", href=f"/@/{username}/perf/{name}")
+        r = a.find("rating") if isinstance(a, Tag) else None
+        return _text(r.find("strong")) if isinstance(r, Tag) else None
+
+    side = stats.find("div", class_="profile-side")
+    infos = side.find("div", class_="user-infos") if isinstance(side, Tag) else None
+    picture = profile.find("img", class_="picture")
+    languages = profile.find("tr", class_="languages")
+    return {
+        "name": _text(infos.find("strong", class_="name"))
+        if isinstance(infos, Tag)
+        else None,
+        "image_url": picture.get("src") if isinstance(picture, Tag) else None,
+        "title": _text(stats.find("span", class_="utitle")),
+        "languages": _text(languages.find("td"))
+        if isinstance(languages, Tag)
+        else None,
+        "rapid": rating("rapid"),
+        "blitz": rating("blitz"),
+        "bullet": rating("bullet"),
+    }
+
+
+def _current(extractor_cls: Callable) -> Callable:
+    def run(username: str, files: Dict[str, str]):
+        contents = {}
+        for key, filename in files.items():
+            with open(filename, "rb") as f:
+                contents[key] = f.read()
+        return extractor_cls(username, contents, _NullDetector()).extract()
+
+    return run
+
+
+# Pairs of (reference, current) extraction functions, along with the files
+# each coach has cached.
+_SITES = {
+    Site.CHESSCOM: (
+        _chesscom_reference,
+        _current(ChesscomExtractor),
+        lambda u: {"profile": f"{u}.html", "stats": "stats.json"},
+    ),
+    Site.LICHESS: (
+        _lichess_reference,
+        _current(LichessExtractor),
+        lambda u: {"profile": f"{u}.html", "stats": "stats.html"},
+    ),
+}
+
+
+def _time(fn: Callable, coaches: List[tuple], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for username, files in coaches:
+            fn(username, files)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.extract")
+    parser.add_argument("--data", default="data")
+    parser.add_argument("--limit", type=int, default=500)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--site",
+        required=True,
+        action="append",
+        choices=[Site.CHESSCOM.value, Site.LICHESS.value],
+    )
+    args = parser.parse_args()
+
+    for site in map(Site, args.site):
+        reference, current, filenames = _SITES[site]
+        coaches_dir = os.path.join(args.data, site.value, "coaches")
+        coaches = []
+        for username in sorted(os.listdir(coaches_dir))[: args.limit]:
+            files = {
+                k: os.path.join(coaches_dir, username, v)
+                for k, v in filenames(username).items()
+            }
+            if all(os.path.isfile(f) for f in files.values()):
+                coaches.append((username, files))
+        if not coaches:
+            print(f"{site.value}: No cached coaches found in {coaches_dir}.")
+            continue
+
+        before = _time(reference, coaches, args.repeat)
+        after = _time(current, coaches, args.repeat)
+        print(
+            f"{site.value}: {len(coaches)} profiles, "
+            f"beautifulsoup {len(coaches) / before:.1f}/s, "
+            f"lxml {len(coaches) / after:.1f}/s "
+            f"({before / after:.1f}x)"
+        )
+
+
+if __name__ == "__main__":
+    main()
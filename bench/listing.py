@@ -0,0 +1,132 @@
+"""Benchmark of the streaming listing page parsers against BeautifulSoup.
+
+Parses a directory of saved listing pages (raw `*.html` responses, e.g. of
+https://lichess.org/coach/all/all/alphabetical?page=1) with both the current
+`Fetcher.parse_usernames` and a reference implementation of the BeautifulSoup
+parse it replaced. Each parser runs in a fresh process so that its peak
+resident memory can be reported alongside its throughput. Run via:
+```bash
+$ poetry run python3 -m bench.listing --site lichess --dir listings/lichess
+```
+"""
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+from typing import Callable, Dict, List, Tuple
+
+from bs4 import BeautifulSoup
+
+from coach_scraper.chesscom import Fetcher as ChesscomFetcher
+from coach_scraper.lichess import Fetcher as LichessFetcher
+from coach_scraper.pipeline import Fetcher
+from coach_scraper.types import Site
+
+
+def _chesscom_reference(response: bytes) -> List[str]:
+    usernames = []
+    soup = BeautifulSoup(response, "lxml")
+    members = soup.find_all("a", class_="members-categories-username")
+    for member in members:
+        href = member.get("href")
+        username = href[len("https://www.chess.com/member/") :]
+        usernames.append(username)
+    return usernames
+
+
+def _lichess_reference(response: bytes) -> List[str]:
+    usernames = []
+    soup = BeautifulSoup(response, "lxml")
+    members = soup.find_all("article", class_="coach-widget")
+    for member in members:
+        a = member.find("a", class_="overlay")
+        if a:
+            href = a.get("href")
+            username = href[len("/coach/") :]
+            usernames.append(username)
+    return usernames
+
+
+def _current(fetcher_cls: type[Fetcher]) -> Callable[[bytes], List[str]]:
+    # `parse_usernames` does not depend on any state of the fetcher.
+    fetcher = fetcher_cls.__new__(fetcher_cls)
+    return fetcher.parse_usernames
+
+
+_REFERENCES: Dict[Site, Callable[[bytes], List[str]]] = {
+    Site.CHESSCOM: _chesscom_reference,
+    Site.LICHESS: _lichess_reference,
+}
+
+_FETCHERS: Dict[Site, type[Fetcher]] = {
+    Site.CHESSCOM: ChesscomFetcher,
+    Site.LICHESS: LichessFetcher,
+}
+
+
+def _run(
+    site: Site, reference: bool, pages: List[bytes], repeat: int
+) -> Tuple[float, int, List[List[str]]]:
+    """Time parsing all `pages` within a freshly spawned process.
+
+    @return
+        The best time over `repeat` runs, the increase in peak resident memory
+        (in KiB) past that of holding the pages, and the parsed usernames.
+    """
+    parse = _REFERENCES[site] if reference else _current(_FETCHERS[site])
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    best = float("inf")
+    usernames: List[List[str]] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        usernames = [parse(page) for page in pages]
+        best = min(best, time.perf_counter() - start)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return best, peak - baseline, usernames
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.listing")
+    parser.add_argument(
+        "--site",
+        required=True,
+        choices=[Site.CHESSCOM.value, Site.LICHESS.value],
+    )
+    parser.add_argument(
+        "--dir",
+        required=True,
+        help="directory of saved listing pages (`*.html`)",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    site = Site(args.site)
+    pages: List[bytes] = []
+    for filename in sorted(os.listdir(args.dir)):
+        if filename.endswith(".html"):
+            with open(os.path.join(args.dir, filename), "rb") as f:
+                pages.append(f.read())
+    if not pages:
+        print(f"{site.value}: No listing pages found in {args.dir}.")
+        return
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        before, before_rss, expected = pool.apply(
+            _run, (site, True, pages, args.repeat)
+        )
+        after, after_rss, actual = pool.apply(_run, (site, False, pages, args.repeat))
+
+    mismatches = sum(e != a for e, a in zip(expected, actual))
+    size = sum(map(len, pages)) / 2**20
+    print(
+        f"{site.value}: {len(pages)} pages ({size:.1f} MiB), "
+        f"beautifulsoup {len(pages) / before:.1f}/s (+{before_rss} KiB peak), "
+        f"streaming {len(pages) / after:.1f}/s (+{after_rss} KiB peak), "
+        f"{before / after:.1f}x, {mismatches} mismatched pages"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,365 @@
+"""End-to-end benchmark replaying a recorded corpus through the real pipeline.
+
+Serves the files of a store previously populated by a run (the corpus) from a
+local HTTP server per site, and runs each site's `Pipeline` against it with a
+fresh store, so every listing page and coach file goes through the `Fetcher`,
+the extraction processes, and the `Writer` as it would in production. Listing
+pages are only cached as the usernames they list, so the server renders them
+back into the markup of the site.
+
+Rows are upserted into the database at `--host`, ignoring the fingerprints of
+any rows already there. Point it at a scratch database initialized with
+`sql/init.sql`. Run via:
+```bash
+$ poetry run python3 -m bench.replay --host @scraper --site lichess
+```
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import resource
+import statistics
+import tempfile
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Any, Callable, Dict, List
+
+import aiohttp
+import psycopg2
+from aiohttp import web
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+from coach_scraper.chesscom import SOURCES as CHESSCOM_SOURCES
+from coach_scraper.chesscom import Pipeline as ChesscomPipeline
+from coach_scraper.database import AsyncWriter, Row, finish_run, start_run
+from coach_scraper.language import Detector
+from coach_scraper.lichess import Pipeline as LichessPipeline
+from coach_scraper.pipeline import Fetcher, Pipeline, init_extraction_process
+from coach_scraper.session import SessionOptions, create_session
+from coach_scraper.store import STORE_KINDS, DirectoryStore, Store, open_store
+from coach_scraper.types import Site
+
+
+class _Replay:
+    """Points the fetcher of a pipeline at the replay server."""
+
+    origin: str | None = None
+
+    def get_fetcher(self, session: aiohttp.ClientSession) -> Fetcher:
+        fetcher = super().get_fetcher(session)  # type: ignore
+        fetcher.origin = self.origin
+        return fetcher
+
+
+# Defined at the top level so that they can be pickled into the extraction
+# processes.
+class _ChesscomReplay(_Replay, ChesscomPipeline):
+    pass
+
+
+class _LichessReplay(_Replay, LichessPipeline):
+    pass
+
+
+_PIPELINES: Dict[Site, type] = {
+    Site.CHESSCOM: _ChesscomReplay,
+    Site.LICHESS: _LichessReplay,
+}
+
+
+def _chesscom_listing(usernames: List[str]) -> str:
+    members = "".join(
+        "<div class='members-categories-member'>"
+        f"<a class='members-categories-username' "
+        f"href='https://www.chess.com/member/{u}'>{u}</a></div>"
+        for u in usernames
+    )
+    return f"<html><body><div class='members-categories'>{members}</div></body></html>"
+
+
+def _lichess_listing(usernames: List[str]) -> str:
+    widgets = "".join(
+        f"<article class='coach-widget'><a class='overlay' href='/coach/{u}'></a>"
+        f"<div class='overview'><h1>{u}</h1></div></article>"
+        for u in usernames
+    )
+    return f"<html><body><div class='list'>{widgets}</div></body></html>"
+
+
+_LISTINGS: Dict[Site, Callable[[List[str]], str]] = {
+    Site.CHESSCOM: _chesscom_listing,
+    Site.LICHESS: _lichess_listing,
+}
+
+
+class _Server:
+    """Serves the recorded files of a single site.
+
+    Requests for the URL of a recorded coach file are answered with its
+    contents. Any other request is answered with the listing page given by its
+    `page` query parameter, which is empty past the last recorded page.
+    """
+
+    def __init__(self, site: Site, corpus: Store, routes: Dict[str, str], delay: float):
+        self.site = site
+        self.corpus = corpus
+        self.routes = routes
+        self.delay = delay
+        # Times at which each listing page was served.
+        self.pages: List[float] = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        key = self.routes.get(request.path)
+        if key is not None:
+            contents = self.corpus.read(key)
+            if contents is None:
+                raise web.HTTPNotFound()
+            return web.Response(body=contents)
+        page_no = int(request.query.get("page", "1"))
+        contents = self.corpus.read(f"{self.site.value}/pages/{page_no}.txt")
+        usernames = contents.decode().split() if contents else []
+        self.pages.append(time.perf_counter())
+        return web.Response(
+            text=_LISTINGS[self.site](usernames), content_type="text/html"
+        )
+
+
+class _TimedExecutor(Executor):
+    """Records the latency of each task submitted to the wrapped executor."""
+
+    def __init__(self, executor: Executor):
+        self.executor = executor
+        self.latencies: List[float] = []
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        start = time.perf_counter()
+        future = self.executor.submit(fn, *args, **kwargs)
+        future.add_done_callback(
+            lambda _: self.latencies.append(time.perf_counter() - start)
+        )
+        return future
+
+    def shutdown(self, wait=True, **kwargs):
+        self.executor.shutdown(wait=wait, **kwargs)
+
+
+class _Writer(AsyncWriter):
+    """Records the latency of each upsert, and never skips unchanged rows."""
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.written = 0
+        self.latencies: List[float] = []
+
+    async def upsert(self, rows: List[Row]):
+        start = time.perf_counter()
+        await super().upsert(rows)
+        self.latencies.append(time.perf_counter() - start)
+        self.written += len(rows)
+
+    async def fingerprints(self, site: Site) -> Dict[str, str]:
+        return {}
+
+
+def _percentiles(name: str, latencies: List[float]) -> str:
+    if not latencies:
+        return f"{name} n/a"
+    if len(latencies) == 1:
+        q = latencies * 99
+    else:
+        q = statistics.quantiles(latencies, n=100, method="inclusive")
+    return (
+        f"{name} p50 {q[49] * 1000:.1f}ms, p90 {q[89] * 1000:.1f}ms, "
+        f"p99 {q[98] * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms"
+    )
+
+
+def _rate(count: int, elapsed: float) -> str:
+    return f"{count / elapsed:.1f}/s" if elapsed > 0 else "n/a"
+
+
+async def _replay(
+    site: Site,
+    args: argparse.Namespace,
+    corpus: Store,
+    store: Store,
+    executor: ProcessPoolExecutor,
+    pool: AsyncConnectionPool,
+    run_id: int,
+):
+    pipeline: Pipeline = _PIPELINES[site](
+        store=store,
+        worker_count=args.workers,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        burst=args.concurrency,
+        **({"source": args.chesscom_source} if site == Site.CHESSCOM else {}),
+    )
+
+    request_latencies: List[float] = []
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        request_latencies.append(time.perf_counter() - context.start)
+
+    trace = aiohttp.TraceConfig()
+    trace.on_request_start.append(on_request_start)
+    trace.on_request_end.append(on_request_end)
+
+    session_options = SessionOptions(
+        user_agent="bench.replay",
+        connections_per_host=args.concurrency,
+        keepalive=30.0,
+        dns_ttl=300,
+        timeout=300.0,
+        connect_timeout=30.0,
+        read_timeout=60.0,
+    )
+    async with create_session(session_options, [trace]) as session:
+        # Route the URL of every recorded coach file to its key in the corpus.
+        fetcher = pipeline.get_fetcher(session)
+        routes: Dict[str, str] = {}
+        for key in corpus.keys(fetcher.path_pages_dir() + "/"):
+            for username in (corpus.read(key) or b"").decode().split():
+                urls = fetcher.user_urls(username)
+                files = fetcher.user_files(username)
+                for resource_name, url in urls.items():
+                    path = url[url.index("/", len("https://")) :]
+                    routes[path] = files[resource_name]
+
+        server = _Server(site, corpus, routes, args.latency_ms / 1000)
+        app = web.Application()
+        app.router.add_route("GET", "/{tail:.*}", server.handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        try:
+            http = web.TCPSite(runner, "127.0.0.1", 0)
+            await http.start()
+            host, port = runner.addresses[0][:2]
+            pipeline.origin = f"http://{host}:{port}"  # type: ignore
+
+            writer = _Writer(pool, run_id, batch_size=args.batch_size)
+            timed = _TimedExecutor(executor)
+            started_at = time.perf_counter()
+            await pipeline.process(writer, timed, session)
+            elapsed = time.perf_counter() - started_at
+        finally:
+            await runner.cleanup()
+
+    pages = server.pages
+    discovery = pages[-1] - started_at if pages else 0.0
+    print(
+        f"{site.value}: {len(pages)} pages ({_rate(len(pages), discovery)}), "
+        f"{len(timed.latencies)} profiles parsed "
+        f"({_rate(len(timed.latencies), elapsed)}), "
+        f"{writer.written} rows written ({_rate(writer.written, elapsed)}) "
+        f"in {elapsed:.1f}s"
+    )
+    print(f"{site.value}: {_percentiles('request', request_latencies)}")
+    print(f"{site.value}: {_percentiles('extraction', timed.latencies)}")
+    print(f"{site.value}: {_percentiles('upsert', writer.latencies)}")
+
+
+async def _run(
+    args: argparse.Namespace,
+    corpus: Store,
+    store: Store,
+    executor: ProcessPoolExecutor,
+    run_id: int,
+):
+    conninfo = make_conninfo(
+        dbname=args.dbname,
+        user=args.user,
+        host=args.host,
+        password=args.password,
+        port=args.port,
+    )
+    async with AsyncConnectionPool(conninfo, min_size=1, open=False) as pool:
+        # Sites are replayed one after another so their stages can be told
+        # apart.
+        for site in map(Site, dict.fromkeys(args.site)):
+            await _replay(site, args, corpus, store, executor, pool, run_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.replay")
+    parser.add_argument(
+        "--site",
+        required=True,
+        action="append",
+        choices=[Site.CHESSCOM.value, Site.LICHESS.value],
+    )
+    parser.add_argument(
+        "--corpus",
+        default="directory",
+        help="store to replay, as `kind[:path]` (one of " f"{', '.join(STORE_KINDS)})",
+    )
+    parser.add_argument("--host", required=True)
+    parser.add_argument("--dbname", default="postgres")
+    parser.add_argument("--user", default="postgres")
+    parser.add_argument("--password", default="password")
+    parser.add_argument("--port", default=5432)
+    parser.add_argument("--workers", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=1000.0)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument(
+        "--chesscom-source",
+        default="html",
+        choices=CHESSCOM_SOURCES,
+        help="where chess.com profiles are sourced from",
+    )
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0.0,
+        help="delay added to every response of the replay server",
+    )
+    args = parser.parse_args()
+
+    kind, _, path = args.corpus.partition(":")
+    corpus = open_store(kind, os.path.abspath(path) if path else None)
+    conn = psycopg2.connect(
+        dbname=args.dbname,
+        user=args.user,
+        host=args.host,
+        password=args.password,
+        port=args.port,
+    )
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            # Checkpoints are kept alongside the store, apart from those of any
+            # real run.
+            store = DirectoryStore(os.path.join(tmp, "data"))
+            executor = ProcessPoolExecutor(
+                max_workers=args.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_extraction_process,
+                initargs=(Detector(), store),
+            )
+            run_id = start_run(conn)
+            try:
+                asyncio.run(_run(args, corpus, store, executor, run_id))
+                finish_run(conn, run_id)
+            finally:
+                executor.shutdown()
+    finally:
+        conn.close()
+        corpus.close()
+
+    self_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    child_rss = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    print(
+        f"Peak RSS: {self_rss:.1f} MiB (event loop), "
+        f"{child_rss:.1f} MiB (largest extraction process)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""Benchmark of cold and warm lookups against each store backend.
+
+Looks up (metadata and contents of) every file cached for the given sites, the
+same way a run that finds everything cached does. Cold lookups are made after
+asking the kernel to evict the store's files from the page cache, so they read
+from disk. Directory entries and inodes may remain cached regardless. Warm
+lookups repeat the same reads immediately after. Populate a packed store via
+the `migrate` command first, then run via:
+```bash
+$ poetry run python3 -m bench.store --store directory --store sqlite
+```
+"""
+import argparse
+import os
+import random
+import time
+from typing import List
+
+from coach_scraper.store import (
+    STORE_KINDS,
+    DirectoryStore,
+    SqliteStore,
+    Store,
+    open_store,
+)
+from coach_scraper.types import Site
+
+
+def _store_files(store: Store, prefixes: List[str]) -> List[str]:
+    """All files on disk backing the `prefixes` of `store`."""
+    if isinstance(store, DirectoryStore):
+        return [
+            os.path.join(dirpath, filename)
+            for prefix in prefixes
+            for dirpath, _, filenames in os.walk(store.path(prefix))
+            for filename in filenames
+        ]
+    assert isinstance(store, SqliteStore), f"Encountered unknown store: {store}."
+    path = store.path
+    return [p for p in [path, f"{path}-wal", f"{path}-shm"] if os.path.isfile(p)]
+
+
+def _evict(files: List[str]):
+    for filename in files:
+        fd = os.open(filename, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        finally:
+            os.close(fd)
+
+
+def _lookup(store: Store, keys: List[str]) -> float:
+    start = time.perf_counter()
+    for key in keys:
+        store.read_metadata(key)
+        store.read(key)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="bench.store")
+    parser.add_argument(
+        "--store",
+        required=True,
+        action="append",
+        help="one of {%s}, optionally followed by `:<path>`" % ",".join(STORE_KINDS),
+    )
+    parser.add_argument("--limit", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--site",
+        action="append",
+        choices=[Site.CHESSCOM.value, Site.LICHESS.value],
+    )
+    args = parser.parse_args()
+    prefixes = [f"{site}/" for site in (args.site or [s.value for s in Site])]
+
+    # Every store is benchmarked against the same randomly ordered keys, as
+    # found in the first store.
+    keys: List[str] = []
+    first = open_store(*args.store[0].split(":", 1))
+    for prefix in prefixes:
+        keys.extend(first.keys(prefix))
+    first.close()
+    random.seed(0)
+    random.shuffle(keys)
+    keys = keys[: args.limit]
+    if not keys:
+        print(f"No cached files found in {args.store[0]}.")
+        return
+
+    for spec in args.store:
+        store = open_store(*spec.split(":", 1))
+        files = _store_files(store, prefixes)
+        size = sum(os.path.getsize(f) for f in files)
+
+        cold = float("inf")
+        warm = float("inf")
+        for _ in range(args.repeat):
+            store.close()
+            _evict(files)
+            cold = min(cold, _lookup(store, keys))
+            warm = min(warm, _lookup(store, keys))
+        store.close()
+
+        print(
+            f"{spec}: {len(keys)} lookups, "
+            f"{len(files)} files, {size / 2**20:.1f} MiB on disk, "
+            f"cold {len(keys) / cold:.0f}/s, warm {len(keys) / warm:.0f}/s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,108 +1,877 @@
 import argparse
 import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass
-from typing import List
+from typing import Any, Dict, List
 
 import aiohttp
 import psycopg2
-from lingua import LanguageDetector, LanguageDetectorBuilder
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
 
+from coach_scraper import metrics
+from coach_scraper.chesscom import SOURCES as CHESSCOM_SOURCES
 from coach_scraper.chesscom import Pipeline as ChesscomPipeline
-from coach_scraper.database import backup_database, load_languages
+from coach_scraper.database import (
+    AsyncWriter,
+    Row,
+    SyncWriter,
+    Writer,
+    diff_runs,
+    finish_run,
+    list_runs,
+    load_languages,
+    prune_runs,
+    restore_run,
+    start_run,
+    upsert_rows,
+)
+from coach_scraper.distributed import (
+    WorkQueue,
+    current_run,
+    process_queue,
+    publish_run,
+    share_rate_limit,
+)
+from coach_scraper.language import DetectionCache, Detector
 from coach_scraper.lichess import Pipeline as LichessPipeline
+from coach_scraper.pipeline import Pipeline, init_extraction_process
+from coach_scraper.profiling import (
+    PROFILE_FORMATS,
+    ExtractProfiler,
+    print_extract_timings,
+)
+from coach_scraper.retry import RetryPolicy
+from coach_scraper.session import SessionOptions, create_session
+from coach_scraper.store import STORE_KINDS, Store, migrate_store, open_store
 from coach_scraper.types import Site
 
 
 @dataclass
 class Context:
     conn: psycopg2._psycopg.connection
-    detector: LanguageDetector
+    # The run that changes to the export table are recorded under.
+    run_id: int
+    store: Store
+    # Connection string used to open the pool of the asynchronous backend.
+    # Unset if writes should go through `conn` instead.
+    conninfo: str | None
+    pool_size: int
+    executor: ProcessPoolExecutor
+    batch_size: int
+    flush_secs: float
     worker_count: int
-    user_agent: str
+    concurrency: int
+    rate: float | None
+    burst: int | None
+    max_age: Dict[str, float]
+    queue_size: int
+    retry: RetryPolicy
+    resume: bool
+    session: SessionOptions
+    # Where chess.com profiles are sourced from. Refer to `chesscom.SOURCES`.
+    chesscom_source: str
+    # Port metrics are served on while the pipelines run, if any.
+    metrics_port: int | None
 
 
 async def _process(
     site: Site,
     context: Context,
-    session: aiohttp.ClientSession,
+    pool: AsyncConnectionPool | None,
 ):
-    if site == Site.CHESSCOM:
-        await ChesscomPipeline(worker_count=context.worker_count).process(
-            context.conn, context.detector, session
+    # Each site gets its own session and so its own pool of connections.
+    async with create_session(context.session) as session:
+        await _process_site(site, context, session, pool)
+
+
+def _writer(context: Context, pool: AsyncConnectionPool | None) -> Writer:
+    if pool is None:
+        return SyncWriter(
+            context.conn,
+            context.run_id,
+            batch_size=context.batch_size,
+            flush_secs=context.flush_secs,
         )
+    return AsyncWriter(
+        pool,
+        context.run_id,
+        batch_size=context.batch_size,
+        flush_secs=context.flush_secs,
+    )
+
+
+def _pipeline_cls(site: Site) -> type[Pipeline]:
+    if site == Site.CHESSCOM:
+        return ChesscomPipeline
     elif site == Site.LICHESS:
-        await LichessPipeline(worker_count=context.worker_count).process(
-            context.conn, context.detector, session
-        )
-    else:
-        assert False, f"Encountered unknown site: {site}."
+        return LichessPipeline
+    assert False, f"Encountered unknown site: {site}."
+
+
+def _site_kwargs(site: Site, chesscom_source: str) -> Dict[str, Any]:
+    """Arguments of the pipeline of `site` that only that site accepts."""
+    if site == Site.CHESSCOM:
+        return {"source": chesscom_source}
+    return {}
+
+
+def _pipeline(site: Site, context: Context) -> Pipeline:
+    return _pipeline_cls(site)(
+        store=context.store,
+        worker_count=context.worker_count,
+        concurrency=context.concurrency,
+        rate=context.rate,
+        burst=context.burst,
+        max_age=context.max_age,
+        queue_size=context.queue_size,
+        retry=context.retry,
+        resume=context.resume,
+        **_site_kwargs(site, context.chesscom_source),
+    )
+
+
+async def _process_site(
+    site: Site,
+    context: Context,
+    session: aiohttp.ClientSession,
+    pool: AsyncConnectionPool | None,
+):
+    await _pipeline(site, context).process(
+        _writer(context, pool), context.executor, session
+    )
 
 
 async def _entrypoint(context: Context, sites: List[Site]):
     """Top-level entrypoint that dispatches a pipeline per requested site."""
-    async with aiohttp.ClientSession(
-        headers={"User-Agent": f"BoardWise coach-scraper ({context.user_agent})"}
-    ) as session:
-        await asyncio.gather(*[_process(site, context, session) for site in sites])
+    async with metrics.serve(context.metrics_port):
+        if context.conninfo is None:
+            await asyncio.gather(*[_process(site, context, None) for site in sites])
+            return
+        async with AsyncConnectionPool(
+            context.conninfo,
+            min_size=1,
+            max_size=context.pool_size,
+            open=False,
+        ) as pool:
+            await asyncio.gather(*[_process(site, context, pool) for site in sites])
 
 
-def main():
-    parser = argparse.ArgumentParser(
-        prog="coach-scraper",
-        description="Scraping/exporting of chess coaches.",
+async def _work_site(
+    site: Site,
+    context: Context,
+    pool: AsyncConnectionPool,
+    queue: WorkQueue,
+    name: str,
+):
+    started_at = time.monotonic()
+    async with create_session(context.session) as session:
+        pipeline = _pipeline(site, context)
+        fetcher = pipeline.get_fetcher(session)
+        await share_rate_limit(pool, fetcher)
+        await process_queue(
+            f"{name}-{site.value}",
+            pipeline,
+            fetcher,
+            _writer(context, pool),
+            context.executor,
+            queue,
+        )
+        pipeline.report(fetcher, time.monotonic() - started_at)
+
+
+async def _work_entrypoint(
+    context: Context,
+    sites: List[Site],
+    name: str,
+    claim_timeout: float,
+):
+    """Top-level entrypoint of a worker of a distributed run."""
+    assert context.conninfo is not None, "Workers require the async backend."
+    async with metrics.serve(context.metrics_port), AsyncConnectionPool(
+        context.conninfo,
+        min_size=1,
+        max_size=context.pool_size,
+        open=False,
+    ) as pool:
+        queue = WorkQueue(pool, context.run_id, claim_timeout=claim_timeout)
+        await asyncio.gather(
+            *[_work_site(site, context, pool, queue, name) for site in sites]
+        )
+
+
+async def _reextract_entrypoint(
+    sites: List[Site],
+    store: Store,
+    executor: ProcessPoolExecutor,
+    workers: int,
+    chesscom_source: str,
+) -> List[Row]:
+    """Top-level entrypoint that re-extracts the cached coaches of each site."""
+    rows: List[Row] = []
+    # Fetchers are only used to locate the files of each coach in the store.
+    # No requests are made.
+    async with aiohttp.ClientSession() as session:
+        for site in sites:
+            started_at = time.monotonic()
+            pipeline = _pipeline_cls(site)(
+                store=store,
+                worker_count=workers,
+                concurrency=1,
+                **_site_kwargs(site, chesscom_source),
+            )
+            site_rows = await pipeline.reextract(executor, session)
+            elapsed = time.monotonic() - started_at
+            print(
+                f"{site.value}: Re-extracted {len(site_rows)} coaches in "
+                f"{elapsed:.1f}s ({len(site_rows) / elapsed:.2f}/s)"
+            )
+            rows.extend(site_rows)
+    return rows
+
+
+def _add_store_arguments(parser: argparse.ArgumentParser, prefix: str, kind: str):
+    parser.add_argument(
+        f"--{prefix}",
+        default=kind,
+        choices=STORE_KINDS,
+        help="backend downloaded files are cached in",
+    )
+    parser.add_argument(
+        f"--{prefix}-path",
+        help="location of the store (defaults to within the data directory)",
     )
 
-    # Database-related arguments.
+
+def _add_database_arguments(parser: argparse.ArgumentParser):
     parser.add_argument("--host", required=True)
     parser.add_argument("--dbname", default="postgres")
     parser.add_argument("--user", default="postgres")
     parser.add_argument("--password", default="password")
     parser.add_argument("--port", default=5432)
 
-    # Client session-related arguments.
-    parser.add_argument("--user-agent", required=True)
-    parser.add_argument(
-        "--site",
-        required=True,
-        action="append",
-        choices=[
-            Site.CHESSCOM.value,
-            Site.LICHESS.value,
-        ],
+
+def _connect(args: argparse.Namespace) -> psycopg2._psycopg.connection:
+    return psycopg2.connect(
+        dbname=args.dbname,
+        user=args.user,
+        host=args.host,
+        password=args.password,
+        port=args.port,
     )
 
-    # Other.
-    parser.add_argument("--workers", type=int, default=5)
 
-    args = parser.parse_args()
+def _profiler(args: argparse.Namespace) -> ExtractProfiler | None:
+    if args.profile_extract_output is None:
+        return None
+    return ExtractProfiler(args.profile_extract_output, args.profile_extract_format)
 
-    detector = LanguageDetectorBuilder.from_all_languages().build()
+
+def _executor(
+    args: argparse.Namespace,
+    sites: List[Site],
+    store: Store,
+    profiler: ExtractProfiler | None,
+) -> ProcessPoolExecutor:
+    # Processes are spawned rather than forked since they are started lazily
+    # from within the (multi-threaded) event loop.
+    return ProcessPoolExecutor(
+        max_workers=args.workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_extraction_process,
+        initargs=(
+            Detector(
+                low_accuracy=args.detector_low_accuracy,
+                # Only chess.com coaches require language detection.
+                preload=args.detector_preload and Site.CHESSCOM in sites,
+                cache=(
+                    DetectionCache(
+                        store.path_state("detections.sqlite"),
+                        max_entries=args.detector_cache_size,
+                    )
+                    if args.detector_cache_size > 0
+                    else None
+                ),
+            ),
+            store,
+            profiler,
+        ),
+    )
+
+
+def _context(
+    args: argparse.Namespace,
+    conn: psycopg2._psycopg.connection,
+    run_id: int,
+    store: Store,
+    executor: ProcessPoolExecutor,
+) -> Context:
+    return Context(
+        conn=conn,
+        run_id=run_id,
+        store=store,
+        conninfo=(
+            make_conninfo(
+                dbname=args.dbname,
+                user=args.user,
+                host=args.host,
+                password=args.password,
+                port=args.port,
+            )
+            if args.db_backend == "async"
+            else None
+        ),
+        pool_size=args.pool_size,
+        executor=executor,
+        batch_size=args.batch_size,
+        flush_secs=args.flush_secs,
+        session=SessionOptions(
+            user_agent=args.user_agent,
+            connections_per_host=(args.connections_per_host or args.concurrency),
+            keepalive=args.keepalive,
+            dns_ttl=args.dns_ttl,
+            timeout=args.timeout,
+            connect_timeout=args.connect_timeout,
+            read_timeout=args.read_timeout,
+        ),
+        worker_count=args.workers,
+        concurrency=args.concurrency,
+        rate=args.rate,
+        burst=args.burst,
+        queue_size=args.queue_size,
+        retry=RetryPolicy(max_retries=args.max_retries),
+        resume=args.resume,
+        chesscom_source=args.chesscom_source,
+        metrics_port=args.metrics_port,
+        max_age={
+            resource: hours * 60 * 60
+            for resource, hours in [
+                ("pages", args.max_age_pages),
+                ("profile", args.max_age_profile),
+                ("player", args.max_age_profile),
+                ("stats", args.max_age_stats),
+            ]
+            if hours is not None
+        },
+    )
+
+
+def _scrape(args: argparse.Namespace):
+    sites = list(map(Site, set(args.site)))
 
     conn = None
+    executor = None
+    profiler = _profiler(args)
+    store = open_store(args.store, args.store_path)
     try:
-        conn = psycopg2.connect(
-            dbname=args.dbname,
-            user=args.user,
-            host=args.host,
-            password=args.password,
-            port=args.port,
-        )
-        backup_database(conn)
+        executor = _executor(args, sites, store, profiler)
+        conn = _connect(args)
+        run_id = start_run(conn, resume=args.resume)
         load_languages(conn)
         asyncio.run(
             _entrypoint(
-                Context(
-                    conn=conn,
-                    detector=detector,
-                    user_agent=args.user_agent,
-                    worker_count=args.workers,
-                ),
-                sites=list(map(Site, set(args.site))),
+                _context(args, conn, run_id, store, executor),
+                sites=sites,
             )
         )
+        finish_run(conn, run_id)
+        pruned = prune_runs(conn, args.keep_runs)
+        if pruned:
+            print(f"Pruned history of {pruned} runs")
     finally:
+        if executor:
+            executor.shutdown()
+            # Extraction processes only write their profiles once they exit.
+            if profiler:
+                profiler.merge()
         if conn:
             conn.close()
+        store.close()
+        if args.profile_extract:
+            print_extract_timings()
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+
+
+def _coordinate(args: argparse.Namespace):
+    sites = list(map(Site, set(args.site)))
+    conn = _connect(args)
+    try:
+        load_languages(conn)
+        run_id = publish_run(conn, sites, args.concurrency, args.keep_runs)
+        print(f"Published run {run_id}")
+    finally:
+        conn.close()
+
+
+def _work(args: argparse.Namespace):
+    conn = None
+    executor = None
+    profiler = _profiler(args)
+    store = open_store(args.store, args.store_path)
+    try:
+        conn = _connect(args)
+        current = current_run(conn)
+        if current is None:
+            print("No run was published by a coordinator.", file=sys.stderr)
+            sys.exit(1)
+        run_id, sites = current
+        executor = _executor(args, sites, store, profiler)
+        asyncio.run(
+            _work_entrypoint(
+                _context(args, conn, run_id, store, executor),
+                sites=sites,
+                name=args.name,
+                claim_timeout=args.claim_timeout,
+            )
+        )
+        # Any worker may be the last to finish.
+        finish_run(conn, run_id)
+    finally:
+        if executor:
+            executor.shutdown()
+            # Extraction processes only write their profiles once they exit.
+            if profiler:
+                profiler.merge()
+        if conn:
+            conn.close()
+        store.close()
+        if args.profile_extract:
+            print_extract_timings()
+        if args.metrics_json:
+            metrics.write_json(args.metrics_json)
+
+
+def _reextract(args: argparse.Namespace):
+    sites = list(map(Site, set(args.site)))
+
+    conn = None
+    executor = None
+    profiler = _profiler(args)
+    store = open_store(args.store, args.store_path)
+    try:
+        executor = _executor(args, sites, store, profiler)
+        conn = _connect(args)
+        rows = asyncio.run(
+            _reextract_entrypoint(
+                sites, store, executor, args.workers, args.chesscom_source
+            )
+        )
+        run_id = start_run(conn)
+        started_at = time.monotonic()
+        upsert_rows(conn, run_id, rows)
+        print(f"Loaded {len(rows)} rows in {time.monotonic() - started_at:.1f}s")
+        finish_run(conn, run_id)
+        pruned = prune_runs(conn, args.keep_runs)
+        if pruned:
+            print(f"Pruned history of {pruned} runs")
+    finally:
+        if executor:
+            executor.shutdown()
+            # Extraction processes only write their profiles once they exit.
+            if profiler:
+                profiler.merge()
+        if conn:
+            conn.close()
+        store.close()
+        if args.profile_extract:
+            print_extract_timings()
+
+
+def _runs(args: argparse.Namespace):
+    conn = _connect(args)
+    try:
+        for run_id, started_at, finished_at, changes in list_runs(conn):
+            finished = f"{finished_at:%Y-%m-%d %H:%M:%S}" if finished_at else "-"
+            print(
+                f"{run_id}\t{started_at:%Y-%m-%d %H:%M:%S}\t{finished}\t"
+                f"{changes} changes"
+            )
+    finally:
+        conn.close()
+
+
+def _restore(args: argparse.Namespace):
+    conn = _connect(args)
+    try:
+        restore_id, count = restore_run(conn, args.run)
+        print(f"Restored {count} rows as of run {args.run} in run {restore_id}")
+    finally:
+        conn.close()
+
+
+def _diff(args: argparse.Namespace):
+    conn = _connect(args)
+    try:
+        to = args.to
+        if to is None:
+            runs = list_runs(conn)
+            if not runs:
+                print("No runs recorded.", file=sys.stderr)
+                sys.exit(1)
+            to = runs[-1][0]
+        for site, username, changes in diff_runs(conn, args.run, to):
+            print(f"{site}/{username}")
+            for column, (old, new) in changes.items():
+                print(f"  {column}: {old!r} -> {new!r}")
+    finally:
+        conn.close()
+
+
+def _migrate(args: argparse.Namespace):
+    if (args.source, args.source_path) == (args.target, args.target_path):
+        print("Source and target stores must differ.", file=sys.stderr)
+        sys.exit(1)
+    sites = list(map(Site, set(args.site))) if args.site else list(Site)
+    source = open_store(args.source, args.source_path)
+    target = open_store(args.target, args.target_path)
+    try:
+        count = migrate_store(source, target, [f"{site.value}/" for site in sites])
+        print(f"Migrated {count} files in total")
+    finally:
+        source.close()
+        target.close()
+
+
+def _add_site_arguments(parser: argparse.ArgumentParser, **kwargs):
+    parser.add_argument(
+        "--site",
+        action="append",
+        choices=[
+            Site.CHESSCOM.value,
+            Site.LICHESS.value,
+        ],
+        **kwargs,
+    )
+
+
+def _add_pipeline_arguments(parser: argparse.ArgumentParser):
+    """Arguments shared by all commands that run the site pipelines."""
+    # Database-related arguments.
+    _add_database_arguments(parser)
+    parser.add_argument(
+        "--pool-size",
+        type=int,
+        default=4,
+        help="maximum number of connections of the async backend",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=500,
+        help="number of rows upserted into the export table at once",
+    )
+    parser.add_argument(
+        "--flush-secs",
+        type=float,
+        default=5.0,
+        help="maximum number of seconds rows are buffered before an upsert",
+    )
+
+    # Client session-related arguments.
+    parser.add_argument("--user-agent", required=True)
+
+    # Download-related arguments. The rate limit defaults to a site-specific
+    # value if not specified.
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="maximum number of in-flight requests per site",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        help="maximum sustained number of requests per second made to each site",
+    )
+    parser.add_argument(
+        "--burst",
+        type=int,
+        help="number of requests that can be made back-to-back to each site",
+    )
+    parser.add_argument(
+        "--max-retries",
+        type=int,
+        default=4,
+        help="number of times a failed request is retried with backoff",
+    )
+
+    # Connection-related arguments. Each site gets its own connection pool.
+    parser.add_argument(
+        "--connections-per-host",
+        type=int,
+        help="maximum number of pooled connections per host (defaults to "
+        "--concurrency)",
+    )
+    parser.add_argument(
+        "--keepalive",
+        type=float,
+        default=30.0,
+        help="seconds an idle connection is kept open for reuse",
+    )
+    parser.add_argument(
+        "--dns-ttl",
+        type=int,
+        default=300,
+        help="seconds resolved host names are cached for",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=300.0,
+        help="seconds a single request may take in total",
+    )
+    parser.add_argument(
+        "--connect-timeout",
+        type=float,
+        default=30.0,
+        help="seconds establishing a connection may take",
+    )
+    parser.add_argument(
+        "--read-timeout",
+        type=float,
+        default=60.0,
+        help="seconds to wait for the next chunk of a response",
+    )
+
+    # Cache-related arguments. Cached files are kept indefinitely by default.
+    parser.add_argument(
+        "--max-age-pages",
+        type=float,
+        help="hours until cached coach listing pages are revalidated",
+    )
+    parser.add_argument(
+        "--max-age-profile",
+        type=float,
+        help="hours until cached coach profiles are revalidated",
+    )
+    parser.add_argument(
+        "--max-age-stats",
+        type=float,
+        help="hours until cached coach stats are revalidated",
+    )
+
+    # Extraction-related arguments.
+    _add_extraction_arguments(parser)
+
+    # Metrics-related arguments.
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="serve metrics in the Prometheus text format on this local port",
+    )
+    parser.add_argument(
+        "--metrics-json",
+        help="file a JSON summary of all metrics is written to on exit",
+    )
+
+
+def _add_extraction_arguments(parser: argparse.ArgumentParser):
+    """Arguments shared by all commands that extract downloaded files."""
+    # Language detection-related arguments.
+    parser.add_argument(
+        "--detector-low-accuracy",
+        action="store_true",
+        help="detect languages faster at the cost of accuracy on short text",
+    )
+    parser.add_argument(
+        "--detector-preload",
+        action="store_true",
+        help="load all language models upfront in each extraction process",
+    )
+    parser.add_argument(
+        "--detector-cache-size",
+        type=int,
+        default=100000,
+        help="maximum number of cached detections, or 0 to disable the cache",
+    )
+
+    # Store-related arguments.
+    _add_store_arguments(parser, "store", "directory")
+
+    # Site-related arguments.
+    parser.add_argument(
+        "--chesscom-source",
+        default="html",
+        choices=CHESSCOM_SOURCES,
+        help="source chess.com profiles from member pages or the public API, "
+        "which is much smaller but lacks languages",
+    )
+
+    # Profiling-related arguments.
+    parser.add_argument(
+        "--profile-extract",
+        action="store_true",
+        help="print the time spent on each field extracted per site on exit",
+    )
+    parser.add_argument(
+        "--profile-extract-output",
+        help="profile the extraction processes, writing the merged profile here",
+    )
+    parser.add_argument(
+        "--profile-extract-format",
+        default="pstats",
+        choices=PROFILE_FORMATS,
+        help="`pstats` statistics or flame graph compatible `collapsed` stacks",
+    )
+
+    # Other.
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=5,
+        help="number of processes used to extract data from downloaded files",
+    )
+
+
+def _add_history_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument(
+        "--keep-runs",
+        type=int,
+        default=30,
+        help="number of runs whose history is kept, or 0 to keep all",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="coach-scraper",
+        description="Scraping/exporting of chess coaches.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    scrape = subparsers.add_parser(
+        "scrape",
+        help="download coaches and export them to the database (default)",
+    )
+    _add_pipeline_arguments(scrape)
+    _add_site_arguments(scrape, required=True)
+    _add_history_arguments(scrape)
+    scrape.add_argument(
+        "--db-backend",
+        default="async",
+        choices=["async", "sync"],
+        help="write through a pool of async connections or a single blocking one",
+    )
+    scrape.add_argument(
+        "--queue-size",
+        type=int,
+        default=64,
+        help="maximum number of coaches queued between download and extraction",
+    )
+    scrape.add_argument(
+        "--resume",
+        action="store_true",
+        help="continue an interrupted run from its checkpoint",
+    )
+
+    coordinate = subparsers.add_parser(
+        "coordinate",
+        help="publish a distributed run to be processed by `work` commands",
+    )
+    _add_database_arguments(coordinate)
+    _add_site_arguments(coordinate, required=True)
+    _add_history_arguments(coordinate)
+    coordinate.add_argument(
+        "--concurrency",
+        type=int,
+        default=2,
+        help="number of listing pages per site scraped at once across workers",
+    )
+
+    work = subparsers.add_parser(
+        "work",
+        help="process the distributed run published by `coordinate`",
+    )
+    _add_pipeline_arguments(work)
+    work.add_argument(
+        "--name",
+        default=f"{socket.gethostname()}-{os.getpid()}",
+        help="identifies the worker in the work queue",
+    )
+    work.add_argument(
+        "--claim-timeout",
+        type=float,
+        default=600.0,
+        help="seconds until work claimed by an unresponsive worker is reclaimed",
+    )
+    # Workers always share the async backend's pool with the work queue, and
+    # the work queue takes the place of checkpoints.
+    work.set_defaults(db_backend="async", queue_size=64, resume=False)
+
+    migrate = subparsers.add_parser(
+        "migrate",
+        help="copy cached files from one store into another",
+    )
+    _add_store_arguments(migrate, "source", "directory")
+    _add_store_arguments(migrate, "target", "sqlite")
+    _add_site_arguments(
+        migrate, help="sites to migrate files of (defaults to all sites)"
+    )
+
+    reextract = subparsers.add_parser(
+        "reextract",
+        help="re-extract all cached coaches into the database without scraping",
+    )
+    _add_database_arguments(reextract)
+    _add_site_arguments(reextract, required=True)
+    _add_history_arguments(reextract)
+    _add_extraction_arguments(reextract)
+    # Extraction is all there is to do, so use every core by default.
+    reextract.set_defaults(workers=os.cpu_count() or 1)
+
+    runs = subparsers.add_parser(
+        "runs",
+        help="list runs whose history of the export table is kept",
+    )
+    _add_database_arguments(runs)
+
+    restore = subparsers.add_parser(
+        "restore",
+        help="restore the export table to its state as of a past run",
+    )
+    _add_database_arguments(restore)
+    restore.add_argument("--run", type=int, required=True)
+
+    diff = subparsers.add_parser(
+        "diff",
+        help="list the rows of the export table that changed between two runs",
+    )
+    _add_database_arguments(diff)
+    diff.add_argument("--run", type=int, required=True)
+    diff.add_argument(
+        "--to",
+        type=int,
+        help="run to compare against (defaults to the most recent run)",
+    )
+
+    # Scraping is the default command, e.g. `coach-scraper --host ...`.
+    argv = sys.argv[1:]
+    if argv and argv[0] not in subparsers.choices and argv[0] not in ["-h", "--help"]:
+        argv = ["scrape", *argv]
+    args = parser.parse_args(argv)
+
+    if args.command == "scrape":
+        _scrape(args)
+    elif args.command == "coordinate":
+        _coordinate(args)
+    elif args.command == "work":
+        _work(args)
+    elif args.command == "migrate":
+        _migrate(args)
+    elif args.command == "reextract":
+        _reextract(args)
+    elif args.command == "runs":
+        _runs(args)
+    elif args.command == "restore":
+        _restore(args)
+    elif args.command == "diff":
+        _diff(args)
 
 
 if __name__ == "__main__":
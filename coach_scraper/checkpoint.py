@@ -0,0 +1,94 @@
+import json
+import os
+from typing import IO, Any, Dict, Iterable, List, Set
+
+
+class Checkpoint:
+    """Progress of a site's run, persisted so that an interrupted run can resume.
+
+    Records which listing pages were scraped (and the usernames found on each),
+    which coaches had all their files downloaded, and which coaches were
+    committed to the export table. Progress is appended to a JSON lines file as
+    it is made, so recording it stays cheap no matter how far along a run is.
+    A truncated final line, e.g. from a crash mid-write, is ignored on load.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.pages: Dict[int, List[str]] = {}
+        self.downloaded: Set[str] = set()
+        self.committed: Set[str] = set()
+        self.file: IO[str] | None = None
+
+    def load(self):
+        """Restore progress recorded by a previous run, if any."""
+        try:
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    if "page" in entry:
+                        self.pages[entry["page"]] = entry["usernames"]
+                    elif "downloaded" in entry:
+                        self.downloaded.add(entry["downloaded"])
+                    elif "committed" in entry:
+                        self.committed.update(entry["committed"])
+        except FileNotFoundError:
+            pass
+
+    def clear(self):
+        """Discard all recorded progress."""
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+        self.pages = {}
+        self.downloaded = set()
+        self.committed = set()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def _append(self, entry: Dict[str, Any]):
+        if self.file is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.file = open(self.path, "a")
+        self.file.write(json.dumps(entry) + "\n")
+        self.file.flush()
+
+    def complete_page(self, page_no: int, usernames: List[str]):
+        self.pages[page_no] = usernames
+        self._append({"page": page_no, "usernames": usernames})
+
+    def complete_download(self, username: str):
+        self.downloaded.add(username)
+        self._append({"downloaded": username})
+
+    def commit(self, usernames: Iterable[str]):
+        usernames = list(usernames)
+        if usernames:
+            self.committed.update(usernames)
+            self._append({"committed": usernames})
+
+    def last_page(self) -> int:
+        """The last page such that it and every page before it were scraped."""
+        page_no = 0
+        while page_no + 1 in self.pages:
+            page_no += 1
+        return page_no
+
+    def pending(self) -> List[str]:
+        """Usernames discovered on scraped pages but not committed yet."""
+        pending: List[str] = []
+        seen: Set[str] = set()
+        for page_no in sorted(self.pages):
+            for username in self.pages[page_no]:
+                if username not in seen and username not in self.committed:
+                    pending.append(username)
+                seen.add(username)
+        return pending
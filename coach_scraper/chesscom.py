@@ -1,184 +1,200 @@
-import asyncio
+import functools
 import json
-import os
-import os.path
-from typing import List
+from typing import Any, Dict, List
 
 import aiohttp
-from bs4 import BeautifulSoup, SoupStrainer, Tag
-from lingua import LanguageDetector
+import lxml.html
+from lxml import etree
 
-from coach_scraper.locale import Locale, lang_to_locale
+from coach_scraper.language import Detector
+from coach_scraper.locale import Locale
 from coach_scraper.pipeline import Extractor as BaseExtractor
 from coach_scraper.pipeline import Fetcher as BaseFetcher
 from coach_scraper.pipeline import Pipeline as BasePipeline
+from coach_scraper.pipeline import (
+    compile_regions,
+    find_first,
+    has_class,
+    has_class_name,
+    iter_elements,
+    parse_html,
+)
+from coach_scraper.ratelimit import TokenBucket
+from coach_scraper.retry import RetryPolicy
+from coach_scraper.store import Store
 from coach_scraper.types import Site, Title
 
-# The number of coach listing pages we will at most iterate through. This number
-# was determined by going to chess.com/coaches?sortBy=alphabetical&page=1 and
-# traversing to the last page.
-MAX_PAGES = 64
+# The sustained number of requests per second made to chess.com, along with how
+# many requests can be made back-to-back. Equivalent to a batch of two requests
+# every three seconds.
+REQUESTS_PER_SEC = 2 / 3
+BURST = 2
 
-# How long to wait between a batch of network requests.
-SLEEP_SECS = 3
+# Where the profile of each coach is sourced from. Either the HTML page of the
+# member, or the JSON player endpoint of the public API. The latter is a small
+# fraction of the size but lacks the about section languages are detected from.
+SOURCES = ["html", "api"]
 
 
 class Fetcher(BaseFetcher):
-    def __init__(self, session: aiohttp.ClientSession):
-        super().__init__(site=Site.CHESSCOM, session=session)
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        store: Store,
+        limiter: TokenBucket,
+        concurrency: int,
+        max_age: Dict[str, float] | None = None,
+        retry: RetryPolicy | None = None,
+        source: str = "html",
+    ):
+        if source not in SOURCES:
+            raise ValueError(f"Unknown chess.com source: {source}.")
+        self.source = source
+        # The member page stands in for the player endpoint if the latter
+        # cannot be downloaded.
+        self.fallbacks = {"player": "profile"} if source == "api" else {}
+        super().__init__(
+            site=Site.CHESSCOM,
+            session=session,
+            store=store,
+            limiter=limiter,
+            concurrency=concurrency,
+            max_age=max_age,
+            retry=retry,
+        )
 
     async def scrape_usernames(self, page_no: int) -> List[str] | None:
-        if page_no > MAX_PAGES:
-            return []
-
-        print(f"{self.site.value}: Scraping page {page_no}/{MAX_PAGES}")
-
-        filepath = self.path_page_file(page_no)
-        try:
-            with open(filepath, "r") as f:
-                return [line.strip() for line in f.readlines()]
-        except FileNotFoundError:
-            pass
+        print(f"{self.site.value}: Scraping page {page_no}")
 
-        if self.has_made_request:
-            await asyncio.sleep(SLEEP_SECS)
-
-        url = f"https://www.chess.com/coaches?sortBy=alphabetical&page={page_no}"
-        response, status_code = await self.fetch(url)
-        if response is None:
-            return None  # Skips this page.
+        return await self.scrape_page(
+            page_no,
+            f"https://www.chess.com/coaches?sortBy=alphabetical&page={page_no}",
+        )
 
+    def parse_usernames(self, response: bytes) -> List[str]:
         usernames = []
-        soup = BeautifulSoup(response, "lxml")
-        members = soup.find_all("a", class_="members-categories-username")
-        for member in members:
-            href = member.get("href")
-            username = href[len("https://www.chess.com/member/") :]
-            usernames.append(username)
-
-        # Cache results.
-        with open(filepath, "w") as f:
-            for username in usernames:
-                f.write(f"{username}\n")
-
-        return usernames
-
-    async def download_user_files(self, username: str) -> None:
-        maybe_download = [
-            (
-                f"https://www.chess.com/member/{username}",
-                self.path_coach_file(username, f"{username}.html"),
-            ),
-            (
-                f"https://www.chess.com/callback/member/stats/{username}",
-                self.path_coach_file(username, "stats.json"),
-            ),
-        ]
-
-        to_download = []
-        for d_url, d_filename in maybe_download:
-            if os.path.isfile(d_filename):
+        for a in iter_elements(response, "a"):
+            if not has_class_name(a, "members-categories-username"):
                 continue
-            to_download.append((d_url, d_filename))
+            href = a.get("href")
+            if href:
+                username = href[len("https://www.chess.com/member/") :]
+                usernames.append(username)
+        return usernames
 
-        if not to_download:
-            return
+    def user_files(self, username: str) -> Dict[str, str]:
+        files = {
+            "profile": self.path_coach_file(username, f"{username}.html"),
+            "stats": self.path_coach_file(username, "stats.json"),
+        }
+        if self.source == "api":
+            files["player"] = self.path_coach_file(username, "player.json")
+        return files
+
+    def user_urls(self, username: str) -> Dict[str, str]:
+        urls = {
+            "profile": f"https://www.chess.com/member/{username}",
+            "stats": f"https://www.chess.com/callback/member/stats/{username}",
+        }
+        if self.source == "api":
+            urls["player"] = f"https://api.chess.com/pub/player/{username.lower()}"
+        return urls
+
+
+# The regions of the profile page any information is extracted from.
+_PROFILE = compile_regions(
+    ["profile-header-info", "profile-card-info", "profile-about"]
+)
+
+_NAME = etree.XPath(f"descendant-or-self::div[{has_class('profile-card-name')}]")
+_IMAGE_URL = etree.XPath(
+    f"descendant-or-self::div[{has_class('profile-header-avatar')}][1]"
+    "/descendant::img[1]/@src"
+)
+_TITLE = etree.XPath(f"descendant-or-self::a[{has_class('profile-card-chesstitle')}]")
+_ABOUT = etree.XPath(f"descendant-or-self::div[{has_class('profile-about')}]")
 
-        if self.has_made_request:
-            await asyncio.sleep(SLEEP_SECS)
 
-        await asyncio.gather(
-            *[self._download_file(url=d[0], filename=d[1]) for d in to_download]
+class Extractor(BaseExtractor):
+    def __init__(
+        self, username: str, files: Dict[str, bytes | None], detector: Detector
+    ):
+        super().__init__(
+            site=Site.CHESSCOM,
+            username=username,
+            files=files,
+            detector=detector,
         )
 
-    async def _download_file(self, url: str, filename: str) -> None:
-        response, _unused_status = await self.fetch(url)
-        if response is not None:
-            with open(filename, "w") as f:
-                f.write(response)
+    # Files are only parsed once a getter first needs them. Fields found in the
+    # player endpoint (if downloaded) are taken from it over the member page.
 
-
-def _profile_filter(elem: Tag | str | None, attrs={}) -> bool:
-    for className in [
-        "profile-header-info",
-        "profile-card-info",
-        "profile-about",
-    ]:
-        if className in attrs.get("class", ""):
-            return True
-    return False
-
-
-class Extractor(BaseExtractor):
-    def __init__(self, fetcher: BaseFetcher, detector: LanguageDetector, username: str):
-        super().__init__(fetcher, detector, username)
-
-        self.profile_soup = None
-        try:
-            filename = self.fetcher.path_coach_file(username, f"{username}.html")
-            with open(filename, "r") as f:
-                self.profile_soup = BeautifulSoup(
-                    f.read(), "lxml", parse_only=SoupStrainer(_profile_filter)
-                )
-        except FileNotFoundError:
-            pass
-
-        self.stats_json = {}
+    @functools.cached_property
+    def player(self) -> Dict[str, Any] | None:
+        player = self.files.get("player")
+        if player is None:
+            return None
         try:
-            filename = self.fetcher.path_coach_file(username, "stats.json")
-            with open(filename, "r") as f:
-                for s in json.load(f).get("stats", []):
-                    if "key" in s and "stats" in s:
-                        self.stats_json[s["key"]] = s["stats"]
-        except FileNotFoundError:
-            pass
+            player_json = json.loads(player)
+        except ValueError:
+            return None
+        return player_json if isinstance(player_json, dict) else None
+
+    @functools.cached_property
+    def profile(self) -> List[lxml.html.HtmlElement]:
+        profile = parse_html(self.files["profile"])
+        return [] if profile is None else _PROFILE(profile)
+
+    @functools.cached_property
+    def stats_json(self) -> Dict[str, Any]:
+        stats_json = {}
+        stats = self.files["stats"]
+        if stats is not None:
+            for s in json.loads(stats).get("stats", []):
+                if "key" in s and "stats" in s:
+                    stats_json[s["key"]] = s["stats"]
+        return stats_json
 
     def get_name(self) -> str | None:
-        if self.profile_soup is None:
-            return None
-        name = self.profile_soup.find("div", class_="profile-card-name")
-        if not isinstance(name, Tag):
+        if self.player is not None:
+            return (self.player.get("name") or "").strip() or None
+        name = find_first(self.profile, _NAME)
+        if name is None:
             return None
-        return name.get_text().strip()
+        return name.text_content().strip()
 
     def get_image_url(self) -> str | None:
-        if self.profile_soup is None:
-            return None
-        div = self.profile_soup.find("div", class_="profile-header-avatar")
-        if not isinstance(div, Tag):
-            return None
-        img = div.find("img")
-        if not isinstance(img, Tag):
-            return None
-        src = img.get("src", "")
-        if not isinstance(src, str):
+        if self.player is not None:
+            src = self.player.get("avatar")
+        else:
+            src = find_first(self.profile, _IMAGE_URL)
+        if src is None:
             return None
         if "images.chesscomfiles.com" not in src:
             return None
-        return src
+        return str(src)
 
     def get_title(self) -> Title | None:
-        if self.profile_soup is None:
-            return None
-        a = self.profile_soup.find("a", class_="profile-card-chesstitle")
-        if not isinstance(a, Tag):
-            return None
-        title = a.get_text().strip()
+        if self.player is not None:
+            title = self.player.get("title") or ""
+        else:
+            a = find_first(self.profile, _TITLE)
+            if a is None:
+                return None
+            title = a.text_content().strip()
         try:
             return Title(title)
         except ValueError:
             return None
 
     def get_languages(self) -> List[Locale] | None:
-        if self.profile_soup is None:
-            return None
-        about = self.profile_soup.find("div", class_="profile-about")
-        if not isinstance(about, Tag):
+        # Only the member page has an about section. Languages are therefore
+        # left unset when sourcing from the player endpoint, unless the member
+        # page was downloaded as a fallback or by an earlier run.
+        about = find_first(self.profile, _ABOUT)
+        if about is None:
             return None
-        detected = self.detector.detect_language_of(about.text)
-        if detected is None:
-            return None
-        code = lang_to_locale.get(detected)
+        code = self.detector.detect(about.text_content())
         if code is None:
             return None
         return [code]
@@ -194,10 +210,27 @@ class Extractor(BaseExtractor):
 
 
 class Pipeline(BasePipeline):
+    def __init__(self, *args: Any, source: str = "html", **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        # One of `SOURCES`. Refer to `Fetcher`.
+        self.source = source
+
     def get_fetcher(self, session: aiohttp.ClientSession):
-        return Fetcher(session)
+        limiter = TokenBucket(
+            rate=self.rate or REQUESTS_PER_SEC,
+            burst=self.burst or BURST,
+        )
+        return Fetcher(
+            session,
+            store=self.store,
+            limiter=limiter,
+            concurrency=self.concurrency,
+            max_age=self.max_age,
+            retry=self.retry,
+            source=self.source,
+        )
 
     def get_extractor(
-        self, fetcher: BaseFetcher, detector: LanguageDetector, username: str
+        self, username: str, files: Dict[str, bytes | None], detector: Detector
     ):
-        return Extractor(fetcher, detector, username)
+        return Extractor(username, files, detector)
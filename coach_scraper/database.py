@@ -1,17 +1,48 @@
+import asyncio
+import io
 import random
 import sys
+import time
 from datetime import datetime
-from typing import List, Literal
+from typing import Any, Dict, List, Literal, Tuple
 
 import psycopg2
+from psycopg_pool import AsyncConnectionPool
 from typing_extensions import TypedDict
 
+from coach_scraper import metrics
 from coach_scraper.locale import Locale, locale_to_str, native_to_locale
 from coach_scraper.types import Site, Title
 
 SCHEMA_NAME = "coach_scraper"
 MAIN_TABLE_NAME = "export"
 LANG_TABLE_NAME = "languages"
+STAGING_TABLE_NAME = "export_staging"
+RUNS_TABLE_NAME = "runs"
+HISTORY_TABLE_NAME = "export_history"
+
+# Columns of the export table written on each upsert.
+EXPORT_COLUMNS = [
+    "site",
+    "username",
+    "name",
+    "image_url",
+    "title",
+    "languages",
+    "rapid",
+    "blitz",
+    "bullet",
+    "classical",
+    "correspondence",
+    "puzzle",
+    "position",
+    "fingerprint",
+]
+
+# Columns of the export table recorded in its history. The position is
+# reshuffled on every upsert and the fingerprint only identifies the files a row
+# was extracted from, so neither is considered a change.
+HISTORY_COLUMNS = [c for c in EXPORT_COLUMNS if c not in ["position", "fingerprint"]]
 
 
 RowKey = (
@@ -24,6 +55,10 @@ RowKey = (
     | Literal["rapid"]
     | Literal["blitz"]
     | Literal["bullet"]
+    | Literal["classical"]
+    | Literal["correspondence"]
+    | Literal["puzzle"]
+    | Literal["fingerprint"]
 )
 
 
@@ -51,6 +86,14 @@ class Row(TypedDict, total=False):
     blitz: int
     # Bullet rating relative to the site they were sourced from.
     bullet: int
+    # Classical rating relative to the site they were sourced from.
+    classical: int
+    # Correspondence rating relative to the site they were sourced from.
+    correspondence: int
+    # Puzzle rating relative to the site they were sourced from.
+    puzzle: int
+    # SHA-256 digest of the downloaded files the row was extracted from.
+    fingerprint: str
 
 
 def load_languages(conn: psycopg2._psycopg.connection):
@@ -78,99 +121,685 @@ def load_languages(conn: psycopg2._psycopg.connection):
             cursor.close()
 
 
-def backup_database(conn: psycopg2._psycopg.connection):
-    """Creates a backup of the export table.
+def _check_tables(cursor: psycopg2._psycopg.cursor):
+    """Exit if any table created by `sql/init.sql` is missing."""
+    for table_name in [
+        MAIN_TABLE_NAME,
+        LANG_TABLE_NAME,
+        RUNS_TABLE_NAME,
+        HISTORY_TABLE_NAME,
+    ]:
+        cursor.execute(
+            f"""
+            SELECT 1
+            FROM information_schema.tables
+            WHERE table_schema = '{SCHEMA_NAME}'
+            AND table_name = '{table_name}';
+            """
+        )
+
+        result = cursor.fetchone()
+        if result is None:
+            print(f"Missing `{SCHEMA_NAME}.{table_name}` table.", file=sys.stderr)
+            sys.exit(1)
+
+
+def _check_run(cursor: psycopg2._psycopg.cursor, run_id: int):
+    """Exit if the specified run does not exist (anymore)."""
+    cursor.execute(
+        f"SELECT 1 FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} WHERE id = %s;",
+        [run_id],
+    )
+    if cursor.fetchone() is None:
+        print(f"Unknown or pruned run {run_id}.", file=sys.stderr)
+        sys.exit(1)
+
+
+def start_run(conn: psycopg2._psycopg.connection, resume: bool = False) -> int:
+    """Record the start of a run, returning its ID.
+
+    Every row of the export table changed by a run is recorded in the history
+    table under the run's ID. Rows without any history yet (e.g. exported
+    before the history table existed) are recorded as part of the new run, so
+    that the history alone suffices to reconstruct the export table as of any
+    run.
 
-    Simply copies the table at time of invocation into another table with a
-    `_%t` suffix, where %t denotes the number of seconds since the Unix epoch.
+    @param resume
+        Continue the most recent run if it never finished rather than starting
+        a new one.
     """
     cursor = None
     try:
         cursor = conn.cursor()
-        timestamp = int((datetime.now() - datetime(1970, 1, 1)).total_seconds())
-        for table_name in [MAIN_TABLE_NAME, LANG_TABLE_NAME]:
+        _check_tables(cursor)
+
+        if resume:
             cursor.execute(
                 f"""
-                SELECT 1
-                FROM information_schema.tables
-                WHERE table_schema = '{SCHEMA_NAME}'
-                AND table_name = '{table_name}';
+                SELECT id
+                FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}
+                WHERE finished_at IS NULL
+                ORDER BY id DESC
+                LIMIT 1;
                 """
             )
-
             result = cursor.fetchone()
-            if result is None:
-                print(f"Missing `{SCHEMA_NAME}.{table_name}` table.", file=sys.stderr)
-                sys.exit(1)
+            if result is not None:
+                conn.commit()
+                print(f"Resuming run {result[0]}")
+                return result[0]
 
-            cursor.execute(
-                f"""
-                CREATE TABLE {SCHEMA_NAME}.{table_name}_{timestamp}
-                AS TABLE {SCHEMA_NAME}.{table_name}
-                """
-            )
+        cursor.execute(
+            f"""
+            INSERT INTO {SCHEMA_NAME}.{RUNS_TABLE_NAME}
+            DEFAULT VALUES
+            RETURNING id;
+            """
+        )
+        result = cursor.fetchone()
+        assert result is not None, "Could not record run."
+        run_id = result[0]
+        columns = ", ".join(HISTORY_COLUMNS)
+        cursor.execute(
+            f"""
+            INSERT INTO {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+              (run_id, {columns})
+            SELECT %s, {columns}
+            FROM {SCHEMA_NAME}.{MAIN_TABLE_NAME} e
+            WHERE NOT EXISTS (
+              SELECT 1
+              FROM {SCHEMA_NAME}.{HISTORY_TABLE_NAME} h
+              WHERE h.site = e.site AND h.username = e.username
+            );
+            """,
+            [run_id],
+        )
+        conn.commit()
+        print(f"Starting run {run_id}")
+        return run_id
     finally:
         if cursor:
             cursor.close()
 
 
-def upsert_row(conn: psycopg2._psycopg.connection, row: Row):
-    """Upsert the specified `Row` into the database table."""
+def finish_run(conn: psycopg2._psycopg.connection, run_id: int):
+    """Record that the specified run completed."""
     cursor = None
     try:
         cursor = conn.cursor()
         cursor.execute(
             f"""
-            INSERT INTO {SCHEMA_NAME}.{MAIN_TABLE_NAME}
-              ( site
-              , username
-              , name
-              , image_url
-              , title
-              , languages
-              , rapid
-              , blitz
-              , bullet
-              , position
-              )
+            UPDATE {SCHEMA_NAME}.{RUNS_TABLE_NAME}
+            SET finished_at = now()
+            WHERE id = %s;
+            """,
+            [run_id],
+        )
+        conn.commit()
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def prune_runs(conn: psycopg2._psycopg.connection, keep: int) -> int:
+    """Forget all but the `keep` most recent runs.
+
+    History superseded as of the oldest kept run is deleted. The version of
+    each row current as of that run is retained, so every kept run can still
+    be restored.
+
+    @return
+        The number of runs forgotten.
+    """
+    if keep < 1:
+        return 0
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT id
+            FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME}
+            ORDER BY id DESC
+            OFFSET %s
+            LIMIT 1;
+            """,
+            [keep - 1],
+        )
+        result = cursor.fetchone()
+        if result is None:
+            return 0
+        oldest = result[0]
+        cursor.execute(
+            f"""
+            DELETE FROM {SCHEMA_NAME}.{HISTORY_TABLE_NAME} h
+            WHERE h.run_id < %(oldest)s
+            AND EXISTS (
+              SELECT 1
+              FROM {SCHEMA_NAME}.{HISTORY_TABLE_NAME} n
+              WHERE n.site = h.site
+              AND n.username = h.username
+              AND n.run_id > h.run_id
+              AND n.run_id <= %(oldest)s
+            );
+            """,
+            {"oldest": oldest},
+        )
+        # Deletion markers are only needed to hide earlier versions, and none
+        # remain for those recorded as of the oldest kept run.
+        cursor.execute(
+            f"""
+            DELETE FROM {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+            WHERE deleted AND run_id <= %s;
+            """,
+            [oldest],
+        )
+        cursor.execute(
+            f"DELETE FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} WHERE id < %s;",
+            [oldest],
+        )
+        pruned = cursor.rowcount
+        conn.commit()
+        return pruned
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def list_runs(
+    conn: psycopg2._psycopg.connection,
+) -> List[Tuple[int, datetime, datetime | None, int]]:
+    """The ID, start, end, and number of changed rows of each kept run."""
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT r.id, r.started_at, r.finished_at, count(h.run_id)
+            FROM {SCHEMA_NAME}.{RUNS_TABLE_NAME} r
+            LEFT JOIN {SCHEMA_NAME}.{HISTORY_TABLE_NAME} h
+            ON h.run_id = r.id
+            GROUP BY r.id
+            ORDER BY r.id;
+            """
+        )
+        result = cursor.fetchall()
+        conn.commit()
+        return result
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def _select_snapshot(changed_between: bool = False) -> str:
+    """Select each row of the export table as of run `%(run_id)s`.
+
+    @param changed_between
+        Only select rows changed by a run after `%(lo)s` up to `%(hi)s`.
+    """
+    columns = ", ".join(HISTORY_COLUMNS)
+    where = ""
+    if changed_between:
+        where = f"""
+            AND (site, username) IN (
+              SELECT site, username
+              FROM {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+              WHERE run_id > %(lo)s AND run_id <= %(hi)s
+            )
+        """
+    # Rows whose latest version is a deletion marker did not exist as of the
+    # run.
+    return f"""
+        SELECT {columns}
+        FROM (
+          SELECT DISTINCT ON (site, username) {columns}, deleted
+          FROM {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+          WHERE run_id <= %(run_id)s
+          {where}
+          ORDER BY site, username, run_id DESC
+        ) h
+        WHERE NOT h.deleted
+    """
+
+
+def restore_run(conn: psycopg2._psycopg.connection, run_id: int) -> Tuple[int, int]:
+    """Restore the export table to its state as of the end of the given run.
+
+    The restore is recorded as a run of its own. Every row it changes is
+    recorded in the history table under the new run's ID, and every row it
+    deletes (i.e. rows first exported after the given run) is recorded as a
+    deleted version, so later runs see the restored export table. Fingerprints
+    of restored rows are cleared so that the next run extracts every coach
+    again rather than keeping the restored rows around indefinitely.
+
+    @return
+        The ID of the run recording the restore and the number of rows in the
+        restored export table.
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        _check_run(cursor, run_id)
+        cursor.execute(
+            f"""
+            INSERT INTO {SCHEMA_NAME}.{RUNS_TABLE_NAME}
+              (finished_at)
             VALUES
-              ( %s
-              , %s
-              , %s
-              , %s
-              , %s
-              , %s
-              , %s
-              , %s
-              , %s
-              , %s
+              (now())
+            RETURNING id;
+            """
+        )
+        result = cursor.fetchone()
+        assert result is not None, "Could not record run."
+        restore_id = result[0]
+        columns = ", ".join(HISTORY_COLUMNS)
+        updates = ",\n".join(
+            f"{c} = EXCLUDED.{c}"
+            for c in HISTORY_COLUMNS
+            if c not in ["site", "username"]
+        )
+        # All parts of the statement see the export table as it was before the
+        # restore, so `changed` compares against the current version of each
+        # row.
+        cursor.execute(
+            f"""
+            WITH snapshot AS ({_select_snapshot()}),
+            changed AS (
+              SELECT {", ".join(f"s.{c}" for c in HISTORY_COLUMNS)}
+              FROM snapshot s
+              LEFT JOIN {SCHEMA_NAME}.{MAIN_TABLE_NAME} e
+              ON e.site = s.site AND e.username = s.username
+              WHERE e.id IS NULL
+              OR ({", ".join(f"e.{c}" for c in HISTORY_COLUMNS)})
+                IS DISTINCT FROM ({", ".join(f"s.{c}" for c in HISTORY_COLUMNS)})
+            ),
+            removed AS (
+              DELETE FROM {SCHEMA_NAME}.{MAIN_TABLE_NAME} e
+              WHERE NOT EXISTS (
+                SELECT 1
+                FROM snapshot s
+                WHERE s.site = e.site AND s.username = e.username
               )
-            ON CONFLICT
-              (site, username)
-            DO UPDATE SET
-              name = EXCLUDED.name,
-              image_url = EXCLUDED.image_url,
-              title = EXCLUDED.title,
-              languages = EXCLUDED.languages,
-              rapid = EXCLUDED.rapid,
-              blitz = EXCLUDED.blitz,
-              bullet = EXCLUDED.bullet,
-              position = EXCLUDED.position;
+              RETURNING e.site, e.username
+            ),
+            restored AS (
+              INSERT INTO {SCHEMA_NAME}.{MAIN_TABLE_NAME}
+                ({columns}, position)
+              SELECT {columns}, floor(random() * 1000001)::INT
+              FROM snapshot
+              ON CONFLICT
+                (site, username)
+              DO UPDATE SET
+                {updates},
+                fingerprint = NULL
+              RETURNING 1
+            ),
+            recorded AS (
+              INSERT INTO {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+                (run_id, {columns})
+              SELECT %(restore_id)s, {columns}
+              FROM changed
+            ),
+            marked AS (
+              INSERT INTO {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+                (run_id, site, username, deleted)
+              SELECT %(restore_id)s, site, username, TRUE
+              FROM removed
+            )
+            SELECT count(*) FROM restored;
             """,
-            [
-                row["site"].value,
-                row["username"],
-                row.get("name"),
-                row.get("image_url"),
-                row["title"].value if "title" in row else None,
-                list(map(locale_to_str, row.get("languages", []))),
-                row.get("rapid"),
-                row.get("blitz"),
-                row.get("bullet"),
-                random.randint(0, 1000000),
-            ],
+            {"run_id": run_id, "restore_id": restore_id},
+        )
+        result = cursor.fetchone()
+        assert result is not None, "Could not restore run."
+        restored = result[0]
+        conn.commit()
+        return restore_id, restored
+    finally:
+        if cursor:
+            cursor.close()
+
+
+def diff_runs(
+    conn: psycopg2._psycopg.connection, old: int, new: int
+) -> List[Tuple[str, str, Dict[str, Tuple[Any, Any]]]]:
+    """The rows of the export table that differ between the two runs.
+
+    @return
+        The site, username, and changed columns (mapped to their value as of
+        `old` and `new`) of each differing row. Rows missing as of either run
+        have all of their columns reported with a value of `None`.
+    """
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        _check_run(cursor, old)
+        _check_run(cursor, new)
+        params = {"lo": min(old, new), "hi": max(old, new)}
+        snapshots: List[Dict[Tuple[str, str], Dict[str, Any]]] = []
+        for run_id in [old, new]:
+            cursor.execute(
+                _select_snapshot(changed_between=True),
+                {**params, "run_id": run_id},
+            )
+            snapshots.append(
+                {(r[0], r[1]): dict(zip(HISTORY_COLUMNS, r)) for r in cursor.fetchall()}
+            )
+        conn.commit()
+    finally:
+        if cursor:
+            cursor.close()
+
+    before, after = snapshots
+    diff = []
+    for site, username in sorted(before.keys() | after.keys()):
+        a = before.get((site, username), {})
+        b = after.get((site, username), {})
+        changes = {
+            c: (a.get(c), b.get(c))
+            for c in HISTORY_COLUMNS
+            if c not in ["site", "username"]
+            and (not a or not b or a.get(c) != b.get(c))
+        }
+        if changes:
+            diff.append((site, username, changes))
+    return diff
+
+
+def _row_values(row: Row) -> List[Any]:
+    """The values of `row` in the order of `EXPORT_COLUMNS`."""
+    return [
+        row["site"].value,
+        row["username"],
+        row.get("name"),
+        row.get("image_url"),
+        row["title"].value if "title" in row else None,
+        list(map(locale_to_str, row.get("languages", []))),
+        row.get("rapid"),
+        row.get("blitz"),
+        row.get("bullet"),
+        row.get("classical"),
+        row.get("correspondence"),
+        row.get("puzzle"),
+        random.randint(0, 1000000),
+        row.get("fingerprint"),
+    ]
+
+
+def _upsert_clause() -> str:
+    """The `ON CONFLICT` clause shared by all upserts into the export table."""
+    return """
+        ON CONFLICT
+          (site, username)
+        DO UPDATE SET
+          name = EXCLUDED.name,
+          image_url = EXCLUDED.image_url,
+          title = EXCLUDED.title,
+          languages = EXCLUDED.languages,
+          rapid = EXCLUDED.rapid,
+          blitz = EXCLUDED.blitz,
+          bullet = EXCLUDED.bullet,
+          classical = EXCLUDED.classical,
+          correspondence = EXCLUDED.correspondence,
+          puzzle = EXCLUDED.puzzle,
+          position = EXCLUDED.position,
+          fingerprint = EXCLUDED.fingerprint
+    """
+
+
+def _copy_value(value: Any) -> str:
+    """Format `value` as a field of `COPY`'s text format."""
+    if value is None:
+        return "\\N"
+    if isinstance(value, list):
+        value = "{" + ",".join(f'"{v}"' for v in value) + "}"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+class Writer:
+    """Buffers `Row`s and upserts them into the export table in batches.
+
+    A batch is flushed once `batch_size` rows are buffered or once rows have
+    been buffered `flush_secs` seconds after the previous flush, whichever
+    comes first. Full batches are flushed by `write`. Stale batches are flushed
+    by `write` too, or by a task waiting on `wait_due` if no more rows are
+    written in the meantime. Each flush copies the batch into a temporary
+    staging table and upserts the staging table into the export table in a
+    single transaction. Call `flush` once done writing to persist any remaining
+    rows.
+
+    Rows that differ from their previous version are additionally recorded in
+    the history table under the ID of the run doing the writing (refer to
+    `start_run`).
+    """
+
+    def __init__(self, run_id: int, batch_size: int = 500, flush_secs: float = 5.0):
+        self.run_id = run_id
+        self.batch_size = batch_size
+        self.flush_secs = flush_secs
+        self.rows: Dict[Tuple[str, str], Row] = {}
+        self.flushed_at = time.monotonic()
+
+    async def write(self, row: Row) -> List[Row]:
+        """Buffer `row`, flushing the batch if it is full or stale.
+
+        @return
+            The rows committed by this write, if it flushed the batch.
+        """
+        # Later rows of the same coach replace earlier ones. A single upsert
+        # cannot affect the same row twice.
+        self.rows[(row["site"].value, row["username"])] = row
+        if len(self.rows) >= self.batch_size or self.stale():
+            return await self.flush()
+        return []
+
+    def stale(self) -> bool:
+        """Whether `flush_secs` seconds have passed since the previous flush."""
+        return time.monotonic() - self.flushed_at >= self.flush_secs
+
+    async def wait_due(self, done: asyncio.Event) -> bool:
+        """Wait until the buffered rows are stale or until `done` is set.
+
+        Keeps rows from being buffered indefinitely while none are written,
+        e.g. while a site is being backed off from. Call `flush` whenever this
+        returns `True`.
+
+        @return
+            Whether the buffered rows are due to be flushed, i.e. `False` once
+            `done` is set.
+        """
+        while not done.is_set():
+            if self.rows and self.stale():
+                return True
+            timeout = self.flush_secs
+            if self.rows:
+                timeout = self.flushed_at + self.flush_secs - time.monotonic()
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return False
+
+    async def flush(self) -> List[Row]:
+        """Upsert all buffered rows into the export table.
+
+        @return
+            The rows committed.
+        """
+        # Batches may be upserted concurrently. Sorting keeps locks on the
+        # export table acquired in a consistent order.
+        rows = [self.rows[k] for k in sorted(self.rows)]
+        self.rows = {}
+        self.flushed_at = time.monotonic()
+        if rows:
+            with metrics.UPSERT_SECONDS.time():
+                await self.upsert(rows)
+            metrics.UPSERTED_ROWS.inc(len(rows))
+        return rows
+
+    async def upsert(self, rows: List[Row]):
+        raise NotImplementedError()
+
+    async def fingerprints(self, site: Site) -> Dict[str, str]:
+        """The fingerprint of each coach of `site` already in the export table."""
+        raise NotImplementedError()
+
+
+def _select_fingerprints() -> str:
+    return f"""
+        SELECT username, fingerprint
+        FROM {SCHEMA_NAME}.{MAIN_TABLE_NAME}
+        WHERE site = %s AND fingerprint IS NOT NULL;
+    """
+
+
+def _create_staging_table() -> str:
+    return f"""
+        CREATE TEMPORARY TABLE {STAGING_TABLE_NAME}
+        ON COMMIT DROP
+        AS SELECT {", ".join(EXPORT_COLUMNS)}
+        FROM {SCHEMA_NAME}.{MAIN_TABLE_NAME}
+        WITH NO DATA;
+    """
+
+
+def _copy_to_staging_table() -> str:
+    return f"COPY {STAGING_TABLE_NAME} ({', '.join(EXPORT_COLUMNS)}) FROM STDIN"
+
+
+def _upsert_staging_table() -> str:
+    """Upsert the staging table, recording changed rows under run `%s`."""
+    columns = ", ".join(EXPORT_COLUMNS)
+    history = ", ".join(HISTORY_COLUMNS)
+    updates = ",\n".join(
+        f"{c} = EXCLUDED.{c}" for c in HISTORY_COLUMNS if c not in ["site", "username"]
+    )
+    # All parts of the statement see the export table as it was before the
+    # upsert, so `changed` compares against the previous version of each row.
+    return f"""
+        WITH changed AS (
+          SELECT {", ".join(f"s.{c}" for c in HISTORY_COLUMNS)}
+          FROM {STAGING_TABLE_NAME} s
+          LEFT JOIN {SCHEMA_NAME}.{MAIN_TABLE_NAME} e
+          ON e.site = s.site AND e.username = s.username
+          WHERE e.id IS NULL
+          OR ({", ".join(f"e.{c}" for c in HISTORY_COLUMNS)})
+            IS DISTINCT FROM ({", ".join(f"s.{c}" for c in HISTORY_COLUMNS)})
+        ),
+        upserted AS (
+          INSERT INTO {SCHEMA_NAME}.{MAIN_TABLE_NAME}
+            ({columns})
+          SELECT {columns}
+          FROM {STAGING_TABLE_NAME}
+          {_upsert_clause()}
         )
+        INSERT INTO {SCHEMA_NAME}.{HISTORY_TABLE_NAME}
+          (run_id, {history})
+        SELECT %s, {history}
+        FROM changed
+        ON CONFLICT
+          (site, username, run_id)
+        DO UPDATE SET
+          {updates},
+          deleted = FALSE;
+    """
+
+
+def upsert_rows(conn: psycopg2._psycopg.connection, run_id: int, rows: List[Row]):
+    """Upsert `rows` into the export table in a single transaction.
+
+    Rows are copied into a staging table first, so this is suited to loading
+    many rows at once. Changed rows are recorded in the history table under
+    `run_id`. No two rows may share the same site and username.
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(map(_copy_value, _row_values(row))) + "\n")
+    buffer.seek(0)
+
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(_create_staging_table())
+        cursor.copy_expert(_copy_to_staging_table(), buffer)
+        cursor.execute(_upsert_staging_table(), [run_id])
         conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
     finally:
         if cursor:
             cursor.close()
+
+
+class SyncWriter(Writer):
+    """A `Writer` backed by a single `psycopg2` connection.
+
+    Upserts block the event loop. Prefer `AsyncWriter` unless the `psycopg`
+    driver is unavailable.
+    """
+
+    def __init__(
+        self,
+        conn: psycopg2._psycopg.connection,
+        run_id: int,
+        batch_size: int = 500,
+        flush_secs: float = 5.0,
+    ):
+        super().__init__(run_id, batch_size=batch_size, flush_secs=flush_secs)
+        self.conn = conn
+
+    async def upsert(self, rows: List[Row]):
+        upsert_rows(self.conn, self.run_id, rows)
+
+    async def fingerprints(self, site: Site) -> Dict[str, str]:
+        cursor = None
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(_select_fingerprints(), [site.value])
+            result = dict(cursor.fetchall())
+            self.conn.commit()
+            return result
+        finally:
+            if cursor:
+                cursor.close()
+
+
+class AsyncWriter(Writer):
+    """A `Writer` backed by a pool of asynchronous `psycopg` connections.
+
+    Each upsert checks out its own connection, so writers sharing a pool can
+    upsert concurrently without blocking the event loop.
+    """
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        run_id: int,
+        batch_size: int = 500,
+        flush_secs: float = 5.0,
+    ):
+        super().__init__(run_id, batch_size=batch_size, flush_secs=flush_secs)
+        self.pool = pool
+
+    async def upsert(self, rows: List[Row]):
+        async with self.pool.connection() as conn:
+            async with conn.transaction():
+                async with conn.cursor() as cursor:
+                    await cursor.execute(_create_staging_table())
+                    async with cursor.copy(_copy_to_staging_table()) as copy:
+                        for row in rows:
+                            await copy.write_row(_row_values(row))
+                    await cursor.execute(_upsert_staging_table(), [self.run_id])
+
+    async def fingerprints(self, site: Site) -> Dict[str, str]:
+        async with self.pool.connection() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(_select_fingerprints(), [site.value])
+                return dict(await cursor.fetchall())
@@ -0,0 +1,545 @@
+import asyncio
+import logging
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Set, Tuple
+
+import psycopg2
+from psycopg import AsyncConnection
+from psycopg_pool import AsyncConnectionPool
+
+from coach_scraper.database import SCHEMA_NAME, Writer, prune_runs, start_run
+from coach_scraper.pipeline import Fetcher, Pipeline, extract_row, record_extraction
+from coach_scraper.ratelimit import TokenBucket
+from coach_scraper.retry import CircuitOpenError
+from coach_scraper.types import Site
+
+WORK_TABLE_NAME = "work"
+RATE_TABLE_NAME = "rate_limits"
+
+
+@dataclass
+class WorkItem:
+    """A listing page or coach claimed from the `WorkQueue`.
+
+    Exactly one of `page` and `username` is set.
+    """
+
+    id: int
+    site: Site
+    page: int | None
+    username: str | None
+    attempts: int
+
+
+def publish_run(
+    conn: psycopg2._psycopg.connection,
+    sites: List[Site],
+    concurrency: int,
+    keep_runs: int,
+) -> int:
+    """Start a distributed run, publishing its first listing pages.
+
+    Work items of previous runs are discarded, as are the shared rate limits
+    of `sites` so that workers of the new run configure them afresh.
+
+    @param concurrency
+        Number of listing pages of each site published upfront. Every page
+        listing new coaches publishes one more page, so this many pages of each
+        site are scraped concurrently across all workers.
+    @return
+        The ID of the new run.
+    """
+    run_id = start_run(conn)
+    pruned = prune_runs(conn, keep_runs)
+    if pruned:
+        print(f"Pruned history of {pruned} runs")
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"DELETE FROM {SCHEMA_NAME}.{WORK_TABLE_NAME} WHERE run_id <> %s;",
+            [run_id],
+        )
+        for site in sites:
+            cursor.execute(
+                f"DELETE FROM {SCHEMA_NAME}.{RATE_TABLE_NAME} WHERE site = %s;",
+                [site.value],
+            )
+            for page_no in range(1, concurrency + 1):
+                cursor.execute(
+                    f"""
+                    INSERT INTO {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                      (run_id, site, page)
+                    VALUES
+                      (%s, %s, %s);
+                    """,
+                    [run_id, site.value, page_no],
+                )
+        conn.commit()
+    finally:
+        if cursor:
+            cursor.close()
+    return run_id
+
+
+def current_run(conn: psycopg2._psycopg.connection) -> Tuple[int, List[Site]] | None:
+    """The ID and sites of the run most recently published by `publish_run`."""
+    cursor = None
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            f"""
+            SELECT run_id, array_agg(DISTINCT site)
+            FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+            WHERE run_id = (
+              SELECT max(run_id) FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+            )
+            GROUP BY run_id;
+            """
+        )
+        result = cursor.fetchone()
+        conn.commit()
+        if result is None:
+            return None
+        return result[0], list(map(Site, result[1]))
+    finally:
+        if cursor:
+            cursor.close()
+
+
+class WorkQueue:
+    """Work items of a distributed run, shared by all workers through Postgres.
+
+    Items are claimed with `SELECT ... FOR UPDATE SKIP LOCKED`, so concurrent
+    workers never claim the same item. An item is claimed until marked as
+    complete or failed. Items claimed for longer than `claim_timeout` seconds,
+    e.g. by a worker that crashed, are handed out again. Items failing
+    `MAX_ATTEMPTS` times are given up on.
+    """
+
+    MAX_ATTEMPTS = 3
+
+    def __init__(
+        self,
+        pool: AsyncConnectionPool,
+        run_id: int,
+        claim_timeout: float = 600.0,
+    ):
+        self.pool = pool
+        self.run_id = run_id
+        self.claim_timeout = claim_timeout
+
+    async def claim(self, site: Site, worker: str) -> WorkItem | None:
+        """Claim the next item of `site`, if any.
+
+        Listing pages are handed out before coaches so that discovery keeps
+        ahead of the coaches it publishes.
+        """
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                f"""
+                UPDATE {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                SET
+                  state = 'claimed',
+                  claimed_by = %(worker)s,
+                  claimed_at = clock_timestamp(),
+                  attempts = attempts + 1
+                WHERE id = (
+                  SELECT id
+                  FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                  WHERE run_id = %(run_id)s
+                  AND site = %(site)s
+                  AND (
+                    state = 'pending'
+                    OR (
+                      state = 'claimed'
+                      AND claimed_at < clock_timestamp()
+                        - make_interval(secs => %(timeout)s)
+                    )
+                  )
+                  ORDER BY page IS NULL, id
+                  LIMIT 1
+                  FOR UPDATE SKIP LOCKED
+                )
+                RETURNING id, page, username, attempts;
+                """,
+                {
+                    "worker": worker,
+                    "run_id": self.run_id,
+                    "site": site.value,
+                    "timeout": self.claim_timeout,
+                },
+            )
+            result = await cursor.fetchone()
+        if result is None:
+            return None
+        return WorkItem(
+            id=result[0],
+            site=site,
+            page=result[1],
+            username=result[2],
+            attempts=result[3],
+        )
+
+    async def complete(self, ids: Iterable[int]):
+        ids = list(ids)
+        if not ids:
+            return
+        async with self.pool.connection() as conn:
+            await conn.execute(
+                f"""
+                UPDATE {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                SET state = 'done'
+                WHERE id = ANY(%s);
+                """,
+                [ids],
+            )
+
+    async def fail(self, item: WorkItem):
+        """Release `item` to be retried, unless out of attempts.
+
+        As in `Pipeline.discover`, giving up on a listing page skips it: the
+        page after the last one published is published in its place, unless
+        `Pipeline.MAX_FAILED_PAGES` pages past the last completed one have
+        been given up on.
+        """
+        state = "failed" if item.attempts >= self.MAX_ATTEMPTS else "pending"
+        async with self.pool.connection() as conn:
+            await conn.execute(
+                f"""
+                UPDATE {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                SET state = %s
+                WHERE id = %s;
+                """,
+                [state, item.id],
+            )
+            if state == "pending" or item.page is None:
+                return
+            cursor = await conn.execute(
+                f"""
+                SELECT count(*)
+                FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                WHERE run_id = %(run_id)s
+                AND site = %(site)s
+                AND state = 'failed'
+                AND page > (
+                  SELECT coalesce(max(page), 0)
+                  FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                  WHERE run_id = %(run_id)s
+                  AND site = %(site)s
+                  AND state = 'done'
+                  AND page IS NOT NULL
+                );
+                """,
+                {"run_id": self.run_id, "site": item.site.value},
+            )
+            result = await cursor.fetchone()
+            assert result is not None, "Could not count failed pages."
+            if result[0] < Pipeline.MAX_FAILED_PAGES:
+                await self._publish_next_page(conn, item.site)
+            else:
+                logging.error(
+                    f"{item.site.value}: Gave up on {result[0]} listing pages "
+                    "past the last one scraped. Ending discovery."
+                )
+
+    async def _publish_next_page(self, conn: AsyncConnection, site: Site):
+        """Publish the page after the last one published."""
+        # Another worker may publish the same page concurrently, in which case
+        # we try again with the page after.
+        published = False
+        while not published:
+            cursor = await conn.execute(
+                f"""
+                INSERT INTO {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                  (run_id, site, page)
+                SELECT %(run_id)s::INT, %(site)s::VARCHAR, max(page) + 1
+                FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                WHERE run_id = %(run_id)s::INT AND site = %(site)s::VARCHAR
+                ON CONFLICT
+                  (run_id, site, page)
+                DO NOTHING;
+                """,
+                {"run_id": self.run_id, "site": site.value},
+            )
+            published = cursor.rowcount > 0
+
+    async def complete_page(self, item: WorkItem, usernames: List[str]):
+        """Complete a listing page, publishing the coaches it lists.
+
+        As in `Pipeline.discover`, a page listing no new coaches marks the end
+        of the listing. Any other page publishes the page after the last one
+        published, keeping the number of pages in flight constant. Publishing
+        and completing happen atomically, so a page is never half-processed.
+        """
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                f"""
+                INSERT INTO {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                  (run_id, site, username)
+                SELECT %s, %s, unnest(%s::TEXT[])
+                ON CONFLICT
+                  (run_id, site, username)
+                DO NOTHING;
+                """,
+                [self.run_id, item.site.value, usernames],
+            )
+            if cursor.rowcount > 0:
+                await self._publish_next_page(conn, item.site)
+            await conn.execute(
+                f"""
+                UPDATE {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                SET state = 'done'
+                WHERE id = %s;
+                """,
+                [item.id],
+            )
+
+    async def drained(self, site: Site) -> bool:
+        """Whether every item of `site` was completed or given up on."""
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                f"""
+                SELECT 1
+                FROM {SCHEMA_NAME}.{WORK_TABLE_NAME}
+                WHERE run_id = %s
+                AND site = %s
+                AND state IN ('pending', 'claimed')
+                LIMIT 1;
+                """,
+                [self.run_id, site.value],
+            )
+            return await cursor.fetchone() is None
+
+
+class SharedTokenBucket:
+    """A `TokenBucket` shared by all workers of a site through Postgres.
+
+    The bucket is a row of the rate limits table, refilled and drawn from in a
+    single atomic update per request. Tokens may be drawn ahead of time, in
+    which case the bucket goes into debt and the caller waits until its token
+    would have accumulated. Requests across all workers are therefore spaced
+    out as if made by a single `TokenBucket`, including the adaptation to the
+    site's responses (refer to `throttle` and `recover`).
+    """
+
+    def __init__(self, pool: AsyncConnectionPool, site: Site, rate: float, burst: int):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive. Found {rate}.")
+        if burst < 1:
+            raise ValueError(f"Burst must be at least 1. Found {burst}.")
+        self.pool = pool
+        self.site = site
+        self.max_rate = rate
+        self.burst = burst
+        # The rate as of the last token acquired. Saves a round trip to the
+        # database on every success if the bucket is not being throttled.
+        self.rate = rate
+        # Updates made in the background. Refer to `throttle`.
+        self.updates: Set[asyncio.Task] = set()
+
+    async def register(self):
+        """Create the shared bucket, unless another worker already did."""
+        async with self.pool.connection() as conn:
+            await conn.execute(
+                f"""
+                INSERT INTO {SCHEMA_NAME}.{RATE_TABLE_NAME}
+                  (site, rate, max_rate, burst, tokens, updated_at)
+                VALUES
+                  (%s, %s, %s, %s, %s, clock_timestamp())
+                ON CONFLICT
+                  (site)
+                DO NOTHING;
+                """,
+                [self.site.value, self.rate, self.max_rate, self.burst, self.burst],
+            )
+
+    async def acquire(self):
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                f"""
+                UPDATE {SCHEMA_NAME}.{RATE_TABLE_NAME}
+                SET
+                  tokens = least(
+                    burst,
+                    tokens + rate * greatest(
+                      0, extract(EPOCH FROM clock_timestamp() - updated_at)
+                    )
+                  ) - 1,
+                  updated_at = greatest(updated_at, clock_timestamp())
+                WHERE site = %s
+                RETURNING
+                  rate,
+                  (
+                    greatest(0, extract(EPOCH FROM updated_at - clock_timestamp()))
+                    + greatest(0, -tokens) / rate
+                  )::FLOAT8;
+                """,
+                [self.site.value],
+            )
+            result = await cursor.fetchone()
+        assert result is not None, "Shared token bucket was not registered."
+        self.rate, delay = result
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def _update(self, assignments: str, params: Dict[str, float | None]):
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                f"""
+                UPDATE {SCHEMA_NAME}.{RATE_TABLE_NAME}
+                SET {assignments}
+                WHERE site = %(site)s
+                RETURNING rate;
+                """,
+                {"site": self.site.value, **params},
+            )
+            result = await cursor.fetchone()
+        if result is not None:
+            self.rate = result[0]
+
+    def _update_later(self, assignments: str, params: Dict[str, float | None]):
+        # The fetcher throttles and recovers synchronously, so the update is
+        # applied in the background.
+        task = asyncio.create_task(self._update(assignments, params))
+        self.updates.add(task)
+        task.add_done_callback(self.updates.discard)
+
+    def throttle(self, pause: float | None = None):
+        """Refer to `TokenBucket.throttle`."""
+        assignments = "rate = greatest(max_rate * %(min)s, rate / 2)"
+        if pause:
+            assignments += """,
+                tokens = least(tokens, 0),
+                updated_at = greatest(
+                  updated_at, clock_timestamp() + make_interval(secs => %(pause)s)
+                )
+            """
+        self._update_later(assignments, {"min": 1 / 16, "pause": pause})
+
+    def recover(self):
+        """Refer to `TokenBucket.recover`."""
+        if self.rate < self.max_rate:
+            self.rate = min(
+                self.max_rate, self.rate + self.max_rate * TokenBucket.RECOVERY_STEP
+            )
+            self._update_later(
+                "rate = least(max_rate, rate + max_rate * %(step)s)",
+                {"step": TokenBucket.RECOVERY_STEP},
+            )
+
+
+async def share_rate_limit(pool: AsyncConnectionPool, fetcher: Fetcher):
+    """Replace the fetcher's rate limiter with one shared by all workers.
+
+    The shared bucket is configured with the rate and burst of the fetcher's
+    own limiter by whichever worker registers it first.
+    """
+    limiter = fetcher.limiter
+    assert isinstance(limiter, TokenBucket), "Rate limit is already shared."
+    shared = SharedTokenBucket(
+        pool, fetcher.site, rate=limiter.max_rate, burst=limiter.burst
+    )
+    await shared.register()
+    fetcher.limiter = shared
+
+
+async def process_queue(
+    name: str,
+    pipeline: Pipeline,
+    fetcher: Fetcher,
+    writer: Writer,
+    executor: Executor,
+    queue: WorkQueue,
+    poll_secs: float = 5.0,
+):
+    """Process items of a single site claimed from `queue` until it is drained.
+
+    Up to `concurrency + worker_count` items of the pipeline are processed at
+    once, so that extraction overlaps with the requests of other items. A
+    coach is only marked complete once its row was committed. Items whose rows
+    are still buffered by `writer` are flushed once stale, or whenever the
+    queue runs dry.
+    """
+    site = fetcher.site
+    loop = asyncio.get_running_loop()
+    fingerprints = await writer.fingerprints(site)
+    # Items of coaches whose rows are buffered by the writer.
+    uncommitted: Dict[str, int] = {}
+
+    async def commit(rows):
+        await queue.complete(
+            uncommitted.pop(r["username"]) for r in rows if r["username"] in uncommitted
+        )
+
+    async def process_page(item: WorkItem):
+        assert item.page is not None
+        usernames = await fetcher.scrape_usernames(item.page)
+        if usernames is None:
+            await queue.fail(item)
+            return
+        await queue.complete_page(item, usernames)
+
+    async def process_coach(item: WorkItem):
+        assert item.username is not None
+        username = item.username
+        await fetcher.download_user_files(username)
+        row, timings = await loop.run_in_executor(
+            executor,
+            extract_row,
+            pipeline,
+            username,
+            fetcher.user_files(username),
+            fingerprints.get(username),
+        )
+        record_extraction(site, timings)
+        if row is None:
+            pipeline.unchanged += 1
+            await queue.complete([item.id])
+        else:
+            uncommitted[username] = item.id
+            pipeline.exported += 1
+            await commit(await writer.write(row))
+
+    async def worker():
+        while True:
+            item = await queue.claim(site, name)
+            if item is None:
+                await commit(await writer.flush())
+                if await queue.drained(site):
+                    return
+                await asyncio.sleep(poll_secs)
+                continue
+            try:
+                if item.page is not None:
+                    await process_page(item)
+                else:
+                    await process_coach(item)
+            except CircuitOpenError as e:
+                logging.error(f"{name}: Could not process {item}. {e}")
+                await queue.fail(item)
+            except Exception:
+                logging.exception(f"{name}: Could not process {item}.")
+                await queue.fail(item)
+
+    # Rows are otherwise only flushed on writing another row or once the queue
+    # runs dry, neither of which may happen for a while if downloads stall.
+    done = asyncio.Event()
+
+    async def flusher():
+        while await writer.wait_due(done):
+            try:
+                await commit(await writer.flush())
+            except Exception:
+                logging.exception(f"{name}: Could not flush buffered rows.")
+
+    async def workers():
+        try:
+            await asyncio.gather(
+                *[worker() for _ in range(pipeline.concurrency + pipeline.worker_count)]
+            )
+        finally:
+            done.set()
+
+    await asyncio.gather(workers(), flusher())
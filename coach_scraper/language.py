@@ -0,0 +1,162 @@
+import hashlib
+import os
+import sqlite3
+import time
+
+from lingua import LanguageDetector, LanguageDetectorBuilder
+
+from coach_scraper.locale import Locale, lang_to_locale
+
+# Sentinel distinguishing a cache miss from a cached failure to detect a locale.
+_MISSING = object()
+
+
+class DetectionCache:
+    """Persistent cache of detected locales, keyed by a hash of the text.
+
+    Backed by a SQLite database so that it can be shared between extraction
+    processes and across runs. Once the cache holds more than `max_entries`
+    entries, the least recently used entries are evicted.
+    """
+
+    # How many insertions to make before checking whether to evict entries.
+    EVICT_INTERVAL = 256
+
+    # Seconds before the last use of an entry is recorded again on a hit.
+    # Eviction only needs a rough order of use, and recording every hit would
+    # cost a write per lookup.
+    USE_INTERVAL = 60 * 60
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.conn: sqlite3.Connection | None = None
+        self.inserts = 0
+
+    def __getstate__(self):
+        # Connections cannot be shared across processes. Each process reopens
+        # the database on first use.
+        return {**self.__dict__, "conn": None}
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            # Under WAL, skips syncing on every commit. A crash may lose the
+            # latest entries, but never corrupts the cache.
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS detections
+                  ( key TEXT PRIMARY KEY
+                  , locale TEXT
+                  , used_at REAL NOT NULL
+                  )
+                """
+            )
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS used_at_idx ON detections (used_at)"
+            )
+        return self.conn
+
+    def get(self, key: str):
+        """The cached locale of `key`, or `_MISSING` if not cached."""
+        conn = self.connect()
+        result = conn.execute(
+            "SELECT locale, used_at FROM detections WHERE key = ?", (key,)
+        ).fetchone()
+        if result is None:
+            return _MISSING
+        locale, used_at = result
+        now = time.time()
+        if now - used_at >= self.USE_INTERVAL:
+            conn.execute("UPDATE detections SET used_at = ? WHERE key = ?", (now, key))
+        return None if locale is None else Locale[locale]
+
+    def put(self, key: str, locale: Locale | None):
+        conn = self.connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO detections (key, locale, used_at) VALUES (?, ?, ?)",
+            (key, None if locale is None else locale.name, time.time()),
+        )
+        self.inserts += 1
+        if self.inserts % self.EVICT_INTERVAL == 0:
+            self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries in excess of `max_entries`."""
+        self.connect().execute(
+            """
+            DELETE FROM detections
+            WHERE key IN (
+              SELECT key FROM detections
+              ORDER BY used_at DESC
+              LIMIT -1 OFFSET ?
+            )
+            """,
+            (self.max_entries,),
+        )
+
+
+class Detector:
+    """Detects the `Locale` of a piece of text.
+
+    Wraps a lingua `LanguageDetector` restricted to the languages that can be
+    mapped to a `Locale`. The underlying detector is only built on first use,
+    so processes that never detect a language never pay for loading models.
+    Results are memoized in the optional `cache`.
+    """
+
+    def __init__(
+        self,
+        low_accuracy: bool = False,
+        preload: bool = False,
+        cache: DetectionCache | None = None,
+    ):
+        self.low_accuracy = low_accuracy
+        self.preload = preload
+        self.cache = cache
+        self.detector: LanguageDetector | None = None
+
+    def __getstate__(self):
+        # The underlying detector is rebuilt by each process that uses it.
+        return {**self.__dict__, "detector": None}
+
+    def get_detector(self) -> LanguageDetector:
+        """The underlying lingua detector, building it if necessary."""
+        if self.detector is None:
+            builder = LanguageDetectorBuilder.from_languages(*lang_to_locale.keys())
+            if self.low_accuracy:
+                builder = builder.with_low_accuracy_mode()
+            if self.preload:
+                builder = builder.with_preloaded_language_models()
+            self.detector = builder.build()
+        return self.detector
+
+    def cache_key(self, text: str) -> str:
+        """Hash of `text` after normalizing whitespace.
+
+        Low accuracy mode can detect different languages than the default, so
+        the two modes do not share entries.
+        """
+        normalized = " ".join(text.split())
+        mode = "low" if self.low_accuracy else "high"
+        return hashlib.sha256(f"{mode}:{normalized}".encode()).hexdigest()
+
+    def detect(self, text: str) -> Locale | None:
+        if self.cache is None:
+            return self._detect(text)
+        key = self.cache_key(text)
+        cached = self.cache.get(key)
+        if cached is not _MISSING:
+            return cached
+        locale = self._detect(text)
+        self.cache.put(key, locale)
+        return locale
+
+    def _detect(self, text: str) -> Locale | None:
+        detected = self.get_detector().detect_language_of(text)
+        if detected is None:
+            return None
+        return lang_to_locale.get(detected)
@@ -1,233 +1,262 @@
-import asyncio
-import os
-import os.path
-from typing import List
+import functools
+import urllib.parse
+from typing import Dict, List
 
 import aiohttp
-from bs4 import BeautifulSoup, SoupStrainer, Tag
-from lingua import LanguageDetector
+import lxml.html
+from lxml import etree
 
+from coach_scraper.language import Detector
 from coach_scraper.locale import Locale, native_to_locale
 from coach_scraper.pipeline import Extractor as BaseExtractor
 from coach_scraper.pipeline import Fetcher as BaseFetcher
 from coach_scraper.pipeline import Pipeline as BasePipeline
+from coach_scraper.pipeline import (
+    compile_regions,
+    find_first,
+    has_class,
+    has_class_name,
+    iter_elements,
+    parse_html,
+)
+from coach_scraper.ratelimit import TokenBucket
+from coach_scraper.retry import RetryPolicy
+from coach_scraper.store import Store
 from coach_scraper.types import Site, Title
 
-# The number of pages we will at most iterate through. This number was
-# determined by going to https://lichess.org/coach/all/all/alphabetical
-# and traversing to the last page.
-MAX_PAGES = 162
-
-# How long to wait between each network request.
-SLEEP_SECS = 5
+# The sustained number of requests per second made to lichess.org, along with
+# how many requests can be made back-to-back. Equivalent to a batch of two
+# requests every five seconds.
+REQUESTS_PER_SEC = 2 / 5
+BURST = 2
 
 
 class Fetcher(BaseFetcher):
-    def __init__(self, session: aiohttp.ClientSession):
-        super().__init__(site=Site.LICHESS, session=session)
+    def __init__(
+        self,
+        session: aiohttp.ClientSession,
+        store: Store,
+        limiter: TokenBucket,
+        concurrency: int,
+        max_age: Dict[str, float] | None = None,
+        retry: RetryPolicy | None = None,
+    ):
+        super().__init__(
+            site=Site.LICHESS,
+            session=session,
+            store=store,
+            limiter=limiter,
+            concurrency=concurrency,
+            max_age=max_age,
+            retry=retry,
+        )
 
     async def scrape_usernames(self, page_no: int) -> List[str] | None:
-        if page_no > MAX_PAGES:
-            return []
+        print(f"{self.site.value}: Scraping page {page_no}")
 
-        print(f"{self.site.value}: Scraping page {page_no}/{MAX_PAGES}")
+        return await self.scrape_page(
+            page_no,
+            f"https://lichess.org/coach/all/all/alphabetical?page={page_no}",
+        )
 
-        filepath = self.path_page_file(page_no)
-        try:
-            with open(filepath, "r") as f:
-                return [line.strip() for line in f.readlines()]
-        except FileNotFoundError:
-            pass
-
-        if self.has_made_request:
-            await asyncio.sleep(SLEEP_SECS)
-
-        url = f"https://lichess.org/coach/all/all/alphabetical?page={page_no}"
-        response, status_code = await self.fetch(url)
-        if response is None:
-            return None  # Skips this page.
-
-        usernames = []
-        soup = BeautifulSoup(response, "lxml")
-        members = soup.find_all("article", class_="coach-widget")
-        for member in members:
-            a = member.find("a", class_="overlay")
-            if a:
-                href = a.get("href")
+    def parse_usernames(self, response: bytes) -> List[str]:
+        usernames: List[str] = []
+        # Coach widgets enclosing the last overlay taken. Only the first overlay
+        # of each widget is taken, and widgets are parsed in document order, so
+        # no other widget can have been taken from before.
+        taken: List[etree._Element] = []
+        for a in iter_elements(response, "a"):
+            if not has_class_name(a, "overlay"):
+                continue
+            widgets = [
+                article
+                for article in a.iterancestors("article")
+                if has_class_name(article, "coach-widget")
+            ]
+            untaken = [w for w in widgets if not any(w is t for t in taken)]
+            if not untaken:
+                continue
+            taken = widgets
+            href = a.get("href")
+            if href:
                 username = href[len("/coach/") :]
-                usernames.append(username)
-
-        with open(filepath, "w") as f:
-            for username in usernames:
-                f.write(f"{username}\n")
-
+                usernames.extend(username for _ in untaken)
         return usernames
 
-    async def download_user_files(self, username: str) -> None:
-        maybe_download = [
-            (
-                f"https://lichess.org/coach/{username}",
-                self.path_coach_file(username, f"{username}.html"),
-            ),
-            (
-                f"https://lichess.org/@/{username}",
-                self.path_coach_file(username, "stats.html"),
-            ),
-        ]
-
-        to_download = []
-        for d_url, d_filename in maybe_download:
-            if os.path.isfile(d_filename):
-                continue
-            to_download.append((d_url, d_filename))
-
-        if not to_download:
-            return
+    def user_files(self, username: str) -> Dict[str, str]:
+        return {
+            "profile": self.path_coach_file(username, f"{username}.html"),
+            "stats": self.path_coach_file(username, "stats.html"),
+        }
+
+    def user_urls(self, username: str) -> Dict[str, str]:
+        return {
+            "profile": f"https://lichess.org/coach/{username}",
+            "stats": f"https://lichess.org/@/{username}",
+        }
+
+
+# The regions of the coach page any information is extracted from.
+_PROFILE = compile_regions(["coach-widget"])
+
+# The regions of the stats page any information is extracted from.
+_STATS = compile_regions(["user-link", "profile-side", "sub-ratings"])
+
+_NAME = etree.XPath(
+    f"descendant-or-self::div[{has_class('profile-side')}][1]"
+    f"/descendant::div[{has_class('user-infos')}][1]"
+    f"/descendant::strong[{has_class('name')}][1]"
+)
+_IMAGE_URL = etree.XPath(f"descendant-or-self::img[{has_class('picture')}][1]/@src")
+_TITLE = etree.XPath(f"descendant-or-self::span[{has_class('utitle')}]")
+_LANGUAGES = etree.XPath(
+    f"descendant-or-self::tr[{has_class('languages')}][1]/descendant::td[1]"
+)
+_PERFS = etree.XPath(
+    f"descendant-or-self::div[{has_class('sub-ratings')}][1]/descendant::a[@href]"
+)
+_PERF_RATING = etree.XPath("descendant::rating[1]/descendant::strong[1]")
+
+
+def _perf_name(href: str) -> str | None:
+    """The perf a link of the `sub-ratings` section points to, if any.
+
+    Game perfs link to e.g. `/@/<username>/perf/blitz`, whereas the puzzle
+    rating links to the puzzle dashboard under `/training`.
+    """
+    path = urllib.parse.urlsplit(href).path
+    if "/perf/" in path:
+        return path.rpartition("/perf/")[2]
+    if path.startswith("/training"):
+        return "puzzle"
+    return None
+
+
+def _parse_rating(strong: lxml.html.HtmlElement) -> int | None:
+    value = strong.text_content()
+    # Provisional ratings are suffixed with a question mark.
+    if value[-1:] == "?":
+        value = value[:-1]
+    try:
+        return int(value)
+    except ValueError:
+        return None
 
-        if self.has_made_request:
-            await asyncio.sleep(SLEEP_SECS)
 
-        await asyncio.gather(
-            *[self._download_file(url=d[0], filename=d[1]) for d in to_download]
+class Extractor(BaseExtractor):
+    def __init__(
+        self, username: str, files: Dict[str, bytes | None], detector: Detector
+    ):
+        super().__init__(
+            site=Site.LICHESS,
+            username=username,
+            files=files,
+            detector=detector,
         )
 
-    async def _download_file(self, url: str, filename: str) -> None:
-        response, _unused_status = await self.fetch(url)
-        if response is not None:
-            with open(filename, "w") as f:
-                f.write(response)
-
-
-def _profile_filter(elem: Tag | str | None, attrs={}) -> bool:
-    if "coach-widget" in attrs.get("class", ""):
-        return True
-    return False
-
+    # Files are only parsed once a getter first needs them.
 
-def _stats_filter(elem: Tag | str | None, attrs={}) -> bool:
-    if "user-link" in attrs.get("class", ""):
-        return True
-    if "profile-side" in attrs.get("class", ""):
-        return True
-    if "sub-ratings" in attrs.get("class", ""):
-        return True
-    return False
+    @functools.cached_property
+    def profile(self) -> List[lxml.html.HtmlElement]:
+        profile = parse_html(self.files["profile"])
+        return [] if profile is None else _PROFILE(profile)
 
-
-class Extractor(BaseExtractor):
-    def __init__(self, fetcher: BaseFetcher, detector: LanguageDetector, username: str):
-        super().__init__(fetcher, detector, username)
-
-        self.profile_soup = None
-        try:
-            filename = self.fetcher.path_coach_file(username, f"{username}.html")
-            with open(filename, "r") as f:
-                self.profile_soup = BeautifulSoup(
-                    f.read(), "lxml", parse_only=SoupStrainer(_profile_filter)
-                )
-        except FileNotFoundError:
-            pass
-
-        self.stats_soup = None
-        try:
-            filename = self.fetcher.path_coach_file(username, "stats.html")
-            with open(filename, "r") as f:
-                self.stats_soup = BeautifulSoup(
-                    f.read(), "lxml", parse_only=SoupStrainer(_stats_filter)
-                )
-        except FileNotFoundError:
-            pass
+    @functools.cached_property
+    def stats(self) -> List[lxml.html.HtmlElement]:
+        stats = parse_html(self.files["stats"])
+        return [] if stats is None else _STATS(stats)
 
     def get_name(self) -> str | None:
-        if self.stats_soup is None:
+        name = find_first(self.stats, _NAME)
+        if name is None:
             return None
-        profile_side = self.stats_soup.find("div", class_="profile-side")
-        if not isinstance(profile_side, Tag):
-            return None
-        user_infos = profile_side.find("div", class_="user-infos")
-        if not isinstance(user_infos, Tag):
-            return None
-        name = user_infos.find("strong", class_="name")
-        if not isinstance(name, Tag):
-            return None
-        return name.get_text().strip()
+        return name.text_content().strip()
 
     def get_image_url(self) -> str | None:
-        if self.profile_soup is None:
-            return None
-        picture = self.profile_soup.find("img", class_="picture")
-        if not isinstance(picture, Tag):
-            return None
-        src = picture.get("src", "")
-        if not isinstance(src, str):
+        src = find_first(self.profile, _IMAGE_URL)
+        if src is None:
             return None
         if "image.lichess1.org" not in src:
             return None
-        return src
+        return str(src)
 
     def get_title(self) -> Title | None:
-        if self.stats_soup is None:
+        utitle = find_first(self.stats, _TITLE)
+        if utitle is None:
             return None
-        utitle = self.stats_soup.find("span", class_="utitle")
-        if not isinstance(utitle, Tag):
-            return None
-        title = utitle.get_text().strip()
+        title = utitle.text_content().strip()
         try:
             return Title(title)
         except ValueError:
             return None
 
     def get_languages(self) -> List[Locale] | None:
-        if self.profile_soup is None:
-            return None
-        tr = self.profile_soup.find("tr", class_="languages")
-        if not isinstance(tr, Tag):
-            return None
-        td = tr.find("td")
-        if not isinstance(td, Tag):
+        td = find_first(self.profile, _LANGUAGES)
+        if td is None:
             return None
 
         codes = []
-        for lang in [s.strip() for s in tr.get_text().split(",")]:
+        for lang in [s.strip() for s in td.text_content().split(",")]:
             if lang in native_to_locale:
                 codes.append(native_to_locale[lang])
         return codes
 
+    @functools.cached_property
+    def perfs(self) -> Dict[str, int]:
+        """The rating of each perf listed on the stats page, keyed by name.
+
+        Built in a single pass over the `sub-ratings` section, which every
+        rating getter is then answered from.
+        """
+        perfs: Dict[str, int] = {}
+        for region in self.stats:
+            for a in _PERFS(region):
+                name = _perf_name(a.get("href"))
+                strong = _PERF_RATING(a)
+                if name is None or name in perfs or not strong:
+                    continue
+                rating = _parse_rating(strong[0])
+                if rating is not None:
+                    perfs[name] = rating
+            if perfs:
+                break
+        return perfs
+
     def get_rapid(self) -> int | None:
-        return self._find_rating("rapid")
+        return self.perfs.get("rapid")
 
     def get_blitz(self) -> int | None:
-        return self._find_rating("blitz")
+        return self.perfs.get("blitz")
 
     def get_bullet(self) -> int | None:
-        return self._find_rating("bullet")
+        return self.perfs.get("bullet")
 
-    def _find_rating(self, name) -> int | None:
-        if self.stats_soup is None:
-            return None
-        a = self.stats_soup.find("a", href=f"/@/{self.username}/perf/{name}")
-        if not isinstance(a, Tag):
-            return None
-        rating = a.find("rating")
-        if not isinstance(rating, Tag):
-            return None
-        strong = rating.find("strong")
-        if not isinstance(strong, Tag):
-            return None
-        value = strong.get_text()
-        if value[-1] == "?":
-            value = value[:-1]
-        try:
-            return int(value)
-        except ValueError:
-            return None
+    def get_classical(self) -> int | None:
+        return self.perfs.get("classical")
+
+    def get_correspondence(self) -> int | None:
+        return self.perfs.get("correspondence")
+
+    def get_puzzle(self) -> int | None:
+        return self.perfs.get("puzzle")
 
 
 class Pipeline(BasePipeline):
     def get_fetcher(self, session: aiohttp.ClientSession):
-        return Fetcher(session)
+        limiter = TokenBucket(
+            rate=self.rate or REQUESTS_PER_SEC,
+            burst=self.burst or BURST,
+        )
+        return Fetcher(
+            session,
+            store=self.store,
+            limiter=limiter,
+            concurrency=self.concurrency,
+            max_age=self.max_age,
+            retry=self.retry,
+        )
 
     def get_extractor(
-        self, fetcher: BaseFetcher, detector: LanguageDetector, username: str
+        self, username: str, files: Dict[str, bytes | None], detector: Detector
     ):
-        return Extractor(fetcher, detector, username)
+        return Extractor(username, files, detector)
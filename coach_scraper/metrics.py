@@ -0,0 +1,318 @@
+"""Counters, gauges, and histograms describing where a run spends its time.
+
+All metrics are declared at the bottom of this module and updated from within
+the event loop. Each is keyed by the values of its labels, passed as keyword
+arguments, e.g.
+```python
+FETCH_SECONDS.observe(0.25, site="lichess", status="200")
+```
+Metrics can be scraped while a run is in progress in the Prometheus text
+format (refer to `serve`) and summarized as JSON once it finishes (refer to
+`write_json`).
+"""
+import contextlib
+import json
+import math
+import time
+from typing import Any, AsyncIterator, Dict, Iterator, List, Tuple
+
+from aiohttp import web
+
+LabelValues = Tuple[str, ...]
+
+# Every metric declared, in order of declaration.
+_METRICS: List["Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: List[str], values: LabelValues) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+    return f"{{{pairs}}}"
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """A named family of samples, one per combination of label values."""
+
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: List[str] | None = None):
+        self.name = name
+        self.help = help
+        self.labels = labels or []
+        _METRICS.append(self)
+
+    def key(self, labels: Dict[str, Any]) -> LabelValues:
+        if labels.keys() != set(self.labels):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labels}. "
+                f"Found {sorted(labels)}."
+            )
+        return tuple(str(labels[n]) for n in self.labels)
+
+    def render(self) -> List[str]:
+        """Lines of this metric in the Prometheus text format."""
+        raise NotImplementedError()
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        """A JSON-serializable summary of each sample of this metric."""
+        raise NotImplementedError()
+
+
+class Counter(Metric):
+    """A value that only ever increases, e.g. a number of requests."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: List[str] | None = None):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: Any):
+        key = self.key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}"
+            for k, v in self.values.items()
+        ]
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        return [
+            {"labels": dict(zip(self.labels, k)), "value": v}
+            for k, v in self.values.items()
+        ]
+
+
+class Gauge(Metric):
+    """A value that can go up and down, e.g. the length of a queue.
+
+    The largest value ever set is kept alongside the current one, since the
+    current value of most gauges says little once a run has finished.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: List[str] | None = None):
+        super().__init__(name, help, labels)
+        self.values: Dict[LabelValues, float] = {}
+        self.maxima: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels: Any):
+        key = self.key(labels)
+        self.values[key] = value
+        self.maxima[key] = max(self.maxima.get(key, value), value)
+
+    def render(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, k)} {_format_value(v)}"
+            for k, v in self.values.items()
+        ]
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        return [
+            {"labels": dict(zip(self.labels, k)), "value": v, "max": self.maxima[k]}
+            for k, v in self.values.items()
+        ]
+
+
+# Upper bounds (in seconds) of the buckets of latency histograms.
+LATENCY_BUCKETS = [
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+]
+
+
+class Observations:
+    """The values observed by a `Histogram` for a single set of labels."""
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.count = 0
+        self.sum = 0.0
+        self.max = -math.inf
+
+
+class Histogram(Metric):
+    """Counts of observed values falling into each of a fixed set of buckets.
+
+    Buckets are cumulative, i.e. each counts all values less than or equal to
+    its upper bound, and are followed by an implicit `+Inf` bucket.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: List[str] | None = None,
+        buckets: List[float] = LATENCY_BUCKETS,
+    ):
+        super().__init__(name, help, labels)
+        self.buckets = [*sorted(buckets), math.inf]
+        self.observations: Dict[LabelValues, Observations] = {}
+
+    def observe(self, value: float, **labels: Any):
+        key = self.key(labels)
+        observations = self.observations.get(key)
+        if observations is None:
+            observations = Observations(len(self.buckets))
+            self.observations[key] = observations
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                observations.counts[i] += 1
+        observations.count += 1
+        observations.sum += value
+        observations.max = max(observations.max, value)
+
+    @contextlib.contextmanager
+    def time(self, **labels: Any) -> Iterator[None]:
+        """Observe the number of seconds spent within the `with` block."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started_at, **labels)
+
+    def render(self) -> List[str]:
+        lines = []
+        for k, observations in self.observations.items():
+            for bound, count in zip(self.buckets, observations.counts):
+                labels = _format_labels(
+                    [*self.labels, "le"], (*k, _format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {count}")
+            labels = _format_labels(self.labels, k)
+            lines.append(f"{self.name}_sum{labels} {_format_value(observations.sum)}")
+            lines.append(f"{self.name}_count{labels} {observations.count}")
+        return lines
+
+    def summarize(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "labels": dict(zip(self.labels, k)),
+                "count": o.count,
+                "sum": o.sum,
+                "mean": o.sum / o.count,
+                "max": o.max,
+                "buckets": {
+                    _format_value(bound): count
+                    for bound, count in zip(self.buckets, o.counts)
+                },
+            }
+            for k, o in self.observations.items()
+        ]
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines = []
+    for metric in _METRICS:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def summarize() -> Dict[str, Any]:
+    """All metrics with at least one sample, keyed by name."""
+    return {
+        metric.name: {"type": metric.kind, "help": metric.help, "samples": samples}
+        for metric in _METRICS
+        if (samples := metric.summarize())
+    }
+
+
+def write_json(path: str):
+    """Write the summary of all metrics to `path`."""
+    with open(path, "w") as f:
+        json.dump(summarize(), f, indent=2)
+        f.write("\n")
+
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+@contextlib.asynccontextmanager
+async def serve(port: int | None) -> AsyncIterator[None]:
+    """Serve all metrics at `/metrics` on the loopback interface.
+
+    Does nothing if `port` is unset. The server is stopped on exiting the
+    `with` block.
+    """
+    if port is None:
+        yield
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        print(f"Serving metrics at http://127.0.0.1:{port}/metrics")
+        yield
+    finally:
+        await runner.cleanup()
+
+
+FETCH_SECONDS = Histogram(
+    "coach_scraper_fetch_seconds",
+    "Seconds taken by each request to a site, including reading its body. The "
+    "status is `error` if no response was received.",
+    ["site", "status"],
+)
+DOWNLOADED_BYTES = Counter(
+    "coach_scraper_downloaded_bytes_total",
+    "Bytes of response bodies received over the wire, before decoding.",
+    ["site"],
+)
+CACHE_LOOKUPS = Counter(
+    "coach_scraper_cache_lookups_total",
+    "Lookups of downloaded files in the store. The result is `hit` if a fresh "
+    "copy was cached, `stale` if a copy had to be revalidated, or `miss`.",
+    ["site", "resource", "result"],
+)
+EXTRACT_SECONDS = Histogram(
+    "coach_scraper_extract_seconds",
+    "Seconds spent on each step of extracting a coach within an extraction "
+    "process. Files are parsed by the first field that needs them.",
+    ["site", "field"],
+    buckets=[0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0],
+)
+QUEUE_DEPTH = Gauge(
+    "coach_scraper_queue_depth",
+    "Number of coaches waiting in each queue of a pipeline.",
+    ["site", "queue"],
+)
+UPSERT_SECONDS = Histogram(
+    "coach_scraper_upsert_seconds",
+    "Seconds taken by each batch upserted into the export table.",
+)
+UPSERTED_ROWS = Counter(
+    "coach_scraper_upserted_rows_total",
+    "Rows upserted into the export table.",
+)
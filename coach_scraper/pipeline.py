@@ -1,66 +1,293 @@
 import asyncio
+import hashlib
+import itertools
 import logging
+import math
 import os.path
-from typing import Any, List, Tuple
+import time
+import urllib.parse
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Iterator, List, Mapping, Set, Tuple
 
 import aiohttp
-from lingua import LanguageDetector
+import lxml.html
+from lxml import etree
 
-from coach_scraper.database import Row, RowKey, upsert_row
+from coach_scraper import metrics
+from coach_scraper.checkpoint import Checkpoint
+from coach_scraper.database import Row, RowKey, Writer
+from coach_scraper.language import Detector
 from coach_scraper.locale import Locale
+from coach_scraper.profiling import ExtractProfiler
+from coach_scraper.ratelimit import RateLimiter
+from coach_scraper.retry import (
+    RETRY_STATUSES,
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    parse_retry_after,
+)
+from coach_scraper.session import Decoder
+from coach_scraper.store import Store
 from coach_scraper.types import Site, Title
 
+# Number of bytes of a response body handled at a time.
+_CHUNK_SIZE = 1 << 16
+
 
 class Fetcher:
     """Download and cache files from the specified site.
 
-    Each implementation of this class is responsible for rate-limiting requests.
+    All requests are made through `fetch`, which waits on the supplied rate
+    limiter and bounds the number of requests in flight at any one time.
+    Failed requests are retried, and requests are paused altogether while the
+    site keeps failing (refer to `CircuitBreaker`).
+
+    Downloads are cached in the supplied `Store` along with metadata recording
+    when each was fetched and any validators (`ETag`, `Last-Modified`) the site
+    responded with. Files older than the maximum age of their resource (one of
+    `"pages"` or the keys of `user_files`) are revalidated with a conditional
+    request. Resources without a maximum age are cached indefinitely.
     """
 
-    def __init__(self, site: Site, session: aiohttp.ClientSession):
+    # Resources only downloaded if another resource could not be, keyed by the
+    # resource they stand in for. Refer to `download_user_files`.
+    fallbacks: Dict[str, str] = {}
+
+    def __init__(
+        self,
+        site: Site,
+        session: aiohttp.ClientSession,
+        store: Store,
+        limiter: RateLimiter,
+        concurrency: int,
+        max_age: Dict[str, float] | None = None,
+        retry: RetryPolicy | None = None,
+    ):
         self.site = site
         self.session = session
-        self.has_made_request = False
+        self.store = store
+        self.limiter = limiter
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.max_age = max_age or {}
+        self.retry = retry or RetryPolicy()
+        self.breaker = CircuitBreaker(site.value)
+        # Replaces the scheme and host of every URL requested if set, e.g. to
+        # replay a recorded site from a local server.
+        self.origin: str | None = None
+        # Transfer statistics, reported once the pipeline finishes.
+        self.requests = 0
+        self.wire_bytes = 0
+        self.body_bytes = 0
 
-        os.makedirs(self.path_coaches_dir(), exist_ok=True)
-        os.makedirs(self.path_pages_dir(), exist_ok=True)
+    # Paths are keys of the store rather than of the filesystem.
 
     def path_site_dir(self):
-        return os.path.join("data", self.site.value)
+        return self.site.value
 
     def path_site_file(self, filename: str):
-        return os.path.join(self.path_site_dir(), filename)
+        return f"{self.path_site_dir()}/{filename}"
 
     def path_coaches_dir(self):
-        return os.path.join(self.path_site_dir(), "coaches")
+        return f"{self.path_site_dir()}/coaches"
 
     def path_coach_dir(self, username: str):
-        return os.path.join(self.path_coaches_dir(), username)
+        return f"{self.path_coaches_dir()}/{username}"
 
     def path_coach_file(self, username: str, filename: str):
-        return os.path.join(self.path_coach_dir(username), filename)
+        return f"{self.path_coach_dir(username)}/{filename}"
 
     def path_pages_dir(self):
-        return os.path.join(self.path_site_dir(), "pages")
+        return f"{self.path_site_dir()}/pages"
 
     def path_page_file(self, page_no: int):
-        return os.path.join(self.path_pages_dir(), f"{page_no}.txt")
+        return f"{self.path_pages_dir()}/{page_no}.txt"
 
-    async def fetch(self, url: str) -> Tuple[str | None, int]:
+    async def fetch(
+        self,
+        url: str,
+        filename: str,
+        headers: Dict[str, str] | None = None,
+        transform: Callable[[bytes], bytes] | None = None,
+    ) -> Tuple[bool, int, Mapping[str, str]]:
         """Make network requests using the internal session.
 
+        Successful responses are streamed into the store in chunks, replacing
+        `filename` only once the whole body has been received. Connection
+        errors and responses with a status in `RETRY_STATUSES` are retried
+        according to the retry policy. A `429` additionally throttles the rate
+        limiter, while a `200` or `304` lets it recover.
+
         @param url
             The URL to make a GET request to.
+        @param filename
+            The key of the store the response body is written to.
+        @param headers
+            Additional headers to send along with the request.
+        @param transform
+            Converts the response body into the contents cached at `filename`.
+            The body is read in full if set.
         @return
-            Tuple containing the response body (if the request was successful)
-            and status code.
+            Tuple containing whether `filename` was written (i.e. the request
+            was successful), status code, and response headers.
+        @raise
+            The last connection error if retries are exhausted, or
+            `CircuitOpenError` if the site is considered down.
+        """
+        if self.origin is not None:
+            origin = urllib.parse.urlsplit(self.origin)
+            url = (
+                urllib.parse.urlsplit(url)
+                ._replace(scheme=origin.scheme, netloc=origin.netloc)
+                .geturl()
+            )
+        for retry in itertools.count():
+            await self.breaker.wait()
+            try:
+                written, status, response_headers = await self._fetch(
+                    url, filename, headers, transform
+                )
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                self.breaker.record_failure()
+                if retry >= self.retry.max_retries:
+                    raise
+                delay = self.retry.delay(retry)
+                logging.warning(f"Could not fetch URL {url}: {e!r}. Retrying.")
+                await asyncio.sleep(delay)
+                continue
+
+            if status not in RETRY_STATUSES:
+                self.breaker.record_success()
+                # A revalidated copy is as healthy a response as a new one.
+                if status in (200, 304):
+                    self.limiter.recover()
+                else:
+                    logging.error(f"Could not fetch URL {url}. Status code: {status}")
+                return written, status, response_headers
+
+            self.breaker.record_failure()
+            retry_after = parse_retry_after(response_headers.get("Retry-After"))
+            if status == 429:
+                self.limiter.throttle(retry_after)
+            if retry >= self.retry.max_retries:
+                logging.error(f"Could not fetch URL {url}. Status code: {status}")
+                return written, status, response_headers
+            await asyncio.sleep(self.retry.delay(retry, retry_after))
+
+        assert False, "Unreachable."
+
+    async def _fetch(
+        self,
+        url: str,
+        filename: str,
+        headers: Dict[str, str] | None,
+        transform: Callable[[bytes], bytes] | None,
+    ) -> Tuple[bool, int, Mapping[str, str]]:
+        """Make a single attempt at `fetch`."""
+        async with self.semaphore:
+            await self.limiter.acquire()
+            started_at = time.perf_counter()
+            status = "error"
+            try:
+                async with self.session.get(url, headers=headers) as response:
+                    self.requests += 1
+                    status = str(response.status)
+                    if response.status == 200:
+                        if transform is not None:
+                            chunks: List[bytes] = []
+                            await self._read_body(response, chunks.append)
+                            self.store.write(filename, transform(b"".join(chunks)))
+                        else:
+                            with self.store.write_stream(filename) as f:
+                                await self._read_body(response, f.write)
+                        return True, 200, response.headers
+            finally:
+                metrics.FETCH_SECONDS.observe(
+                    time.perf_counter() - started_at,
+                    site=self.site.value,
+                    status=status,
+                )
+        return False, response.status, response.headers
+
+    async def _read_body(
+        self, response: aiohttp.ClientResponse, write: Callable[[bytes], Any]
+    ):
+        """Decode the body of `response` chunk by chunk, passing it to `write`."""
+        decoder = Decoder(response.headers.get("Content-Encoding"))
+        async for chunk in response.content.iter_chunked(_CHUNK_SIZE):
+            self.wire_bytes += len(chunk)
+            metrics.DOWNLOADED_BYTES.inc(len(chunk), site=self.site.value)
+            decoded = decoder.decode(chunk)
+            self.body_bytes += len(decoded)
+            write(decoded)
+        decoded = decoder.flush()
+        self.body_bytes += len(decoded)
+        write(decoded)
+
+    def is_fresh(self, metadata: Dict[str, Any] | None, resource: str) -> bool:
+        if metadata is None:
+            return False
+        max_age = self.max_age.get(resource)
+        return max_age is None or time.time() - metadata["fetched_at"] < max_age
+
+    async def download(
+        self,
+        url: str,
+        filename: str,
+        resource: str,
+        transform: Callable[[bytes], bytes] | None = None,
+    ):
+        """Download `url` to `filename` unless a fresh copy is already cached.
+
+        Stale copies are revalidated with a conditional request and kept as is
+        if the site responds with `304 Not Modified`. If the request fails,
+        whether with an error status, a connection error, or because the site
+        is considered down, any stale copy is kept as well.
+
+        @param transform
+            Converts the response body into the contents cached at `filename`.
+            Defaults to caching the body verbatim.
+        @raise
+            The errors raised by `fetch`, unless a stale copy is cached.
         """
-        self.has_made_request = True
-        async with self.session.get(url) as response:
-            if response.status == 200:
-                return await response.text(), 200
-        logging.error(f"Could not fetch URL {url}. Status code: {response.status}")
-        return None, response.status
+        metadata = self.store.read_metadata(filename)
+        if self.is_fresh(metadata, resource):
+            result = "hit"
+        else:
+            result = "miss" if metadata is None else "stale"
+        metrics.CACHE_LOOKUPS.inc(
+            site=self.site.value, resource=resource, result=result
+        )
+        if result == "hit":
+            return
+
+        headers = {}
+        if metadata and "etag" in metadata:
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata and "last_modified" in metadata:
+            headers["If-Modified-Since"] = metadata["last_modified"]
+
+        try:
+            written, status, response_headers = await self.fetch(
+                url, filename, headers, transform
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError, CircuitOpenError) as e:
+            if metadata is None:
+                raise
+            logging.warning(f"Could not revalidate {filename}: {e!r}. Keeping it.")
+            return
+        if status == 304:
+            validators = {**(metadata or {})}
+        elif written:
+            validators = {}
+        else:
+            return
+
+        if "ETag" in response_headers:
+            validators["etag"] = response_headers["ETag"]
+        if "Last-Modified" in response_headers:
+            validators["last_modified"] = response_headers["Last-Modified"]
+        self.store.write_metadata(filename, {**validators, "fetched_at": time.time()})
 
     async def scrape_usernames(self, page_no: int) -> List[str] | None:
         """Source the specified site for all coach usernames.
@@ -69,27 +296,72 @@ class Fetcher:
         file should be a plain `.txt` file containing one username per-line.
 
         @param page_no:
-            How many times this function was invoked (1-indexed). Useful to
-            paginate responses back out to the `Pipeline` this `Downloader`
-            is embedded in.
+            The listing page to scrape (1-indexed). Pages are scraped
+            concurrently and so may be requested out of order.
         @return:
-            A list of usernames. Should return an empty list if no more
-            usernames are found. Can return `None` to indicate the specified
-            page should be skipped.
+            A list of usernames. Should return an empty list if the page lists
+            no coaches, i.e. it lies past the last page. Can return `None` to
+            indicate the specified page should be skipped.
+        """
+        raise NotImplementedError()
+
+    async def scrape_page(self, page_no: int, url: str) -> List[str] | None:
+        """Scrape the usernames listed on the page at `url`.
+
+        Usernames are parsed out by `self.parse_usernames()` and cached at
+        `self.path_page_file()`.
+        """
+        filename = self.path_page_file(page_no)
+
+        def transform(response: bytes) -> bytes:
+            return "".join(f"{u}\n" for u in self.parse_usernames(response)).encode()
+
+        await self.download(url, filename, "pages", transform)
+
+        contents = self.store.read(filename)
+        if contents is None:
+            return None  # Skips this page.
+        return [line.strip() for line in contents.decode().splitlines()]
+
+    def parse_usernames(self, response: bytes) -> List[str]:
+        """Parse all coach usernames out of a listing page."""
+        raise NotImplementedError()
+
+    def user_files(self, username: str) -> Dict[str, str]:
+        """Keys of the store each file downloaded for the specified user is at.
+
+        Keys name the downloaded resource (e.g. `"profile"`) and are shared
+        with the `Extractor` of the same site.
         """
         raise NotImplementedError()
 
-    async def _download_user_files(self, username: str) -> None:
-        os.makedirs(self.path_coach_dir(username), exist_ok=True)
-        await self.download_user_files(username)
+    def user_urls(self, username: str) -> Dict[str, str]:
+        """URLs of each of the files downloaded for the specified user.
+
+        Keys match those of `self.user_files()`.
+        """
+        raise NotImplementedError()
 
     async def download_user_files(self, username: str) -> None:
         """Source the specified site for all user-specific files.
 
-        What files are downloaded depends on the `Downloader` implementation.
-        All files should be downloaded at `self.path_coach_file()`.
+        Each URL of `self.user_urls()` is downloaded to the corresponding path
+        of `self.user_files()`. Resources that are fallbacks of another (refer
+        to `fallbacks`) are only downloaded if that resource ends up missing
+        from the store.
         """
-        raise NotImplementedError()
+        files = self.user_files(username)
+        urls = self.user_urls(username)
+        standins = set(self.fallbacks.values())
+        await asyncio.gather(
+            *[self.download(urls[k], files[k], k) for k in urls if k not in standins]
+        )
+        missing = [
+            self.fallbacks[k]
+            for k in urls
+            if k in self.fallbacks and self.store.read_metadata(files[k]) is None
+        ]
+        await asyncio.gather(*[self.download(urls[k], files[k], k) for k in missing])
 
 
 def _insert(row: Row, key: RowKey, value: Any):
@@ -97,11 +369,104 @@ def _insert(row: Row, key: RowKey, value: Any):
         row[key] = value
 
 
+# Downloaded pages are always UTF-8 encoded. Parsers are not thread-safe but
+# each extraction process only ever runs one extraction at a time.
+_HTML_PARSER = lxml.html.HTMLParser(encoding="utf-8")
+
+
+def parse_html(contents: bytes | None) -> lxml.html.HtmlElement | None:
+    """Parse the specified HTML file, returning `None` if missing or empty."""
+    if not contents:
+        return None
+    try:
+        return lxml.html.document_fromstring(contents, parser=_HTML_PARSER)
+    except etree.ParserError:
+        return None
+
+
+def _drain(parser: etree.HTMLPullParser) -> Iterator[etree._Element]:
+    for _, elem in parser.read_events():
+        yield elem
+        # Discard the element along with everything parsed before it. Only the
+        # chain of open ancestors of the next element is kept around.
+        elem.clear()
+        for node in [elem, *elem.iterancestors()]:
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+
+def iter_elements(response: bytes, tag: str) -> Iterator[etree._Element]:
+    """Stream the `tag` elements of an HTML document as each is fully parsed.
+
+    Unlike `parse_html`, the whole document is never held in memory as a tree.
+    Each element is discarded once the consumer moves on to the next, so any
+    data needed from it must be read right away. Ancestors of each element are
+    still available, though previously parsed siblings are not.
+    """
+    parser = etree.HTMLPullParser(events=("end",), tag=tag, encoding="utf-8")
+    for i in range(0, len(response), _CHUNK_SIZE):
+        parser.feed(response[i : i + _CHUNK_SIZE])
+        yield from _drain(parser)
+    parser.close()
+    yield from _drain(parser)
+
+
+def has_class_name(elem: etree._Element, name: str) -> bool:
+    """Whether `elem` has `name` as one of its classes."""
+    return name in (elem.get("class") or "").split()
+
+
+def has_class(name: str) -> str:
+    """An XPath predicate matching elements with `name` as one of its classes."""
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+
+def compile_regions(class_names: List[str]) -> etree.XPath:
+    """Compile an XPath to all elements whose class contains any `class_names`.
+
+    Matching substrings of the raw `class` attribute is far cheaper than
+    matching individual classes across a whole document. Extractors use this
+    to narrow a document down to the few regions they actually read from.
+    """
+    predicate = " or ".join(f"contains(., '{name}')" for name in class_names)
+    return etree.XPath(f"//@class[{predicate}]/..")
+
+
+def find_first(regions: List[lxml.html.HtmlElement], xpath: etree.XPath, **kwargs):
+    """The first result of `xpath` evaluated relative to each region in turn.
+
+    Any keyword arguments are passed along as XPath variables.
+    """
+    for region in regions:
+        result = xpath(region, **kwargs)
+        if result:
+            return result[0]
+    return None
+
+
 class Extractor:
-    def __init__(self, fetcher: Fetcher, detector: LanguageDetector, username: str):
-        self.fetcher = fetcher
-        self.detector = detector
+    """Parse the files downloaded by a `Fetcher` into a `Row`.
+
+    Extraction is CPU-bound and run within an extraction process (refer to
+    `extract_row`). Implementations must therefore only depend on the files
+    passed to them. Files are passed by contents, keyed like `user_files`, and
+    are `None` if missing.
+    """
+
+    def __init__(
+        self,
+        site: Site,
+        username: str,
+        files: Dict[str, bytes | None],
+        detector: Detector,
+    ):
+        self.site = site
         self.username = username
+        self.files = files
+        self.detector = detector
+        # Seconds spent on each field by `extract`. Files are parsed lazily, so
+        # parsing counts towards the first field that needs each file.
+        self.timings: Dict[str, float] = {}
 
     def get_name(self) -> str | None:
         raise NotImplementedError()
@@ -124,76 +489,534 @@ class Extractor:
     def get_bullet(self) -> int | None:
         raise NotImplementedError()
 
+    # Ratings not every site offers.
+
+    def get_classical(self) -> int | None:
+        return None
+
+    def get_correspondence(self) -> int | None:
+        return None
+
+    def get_puzzle(self) -> int | None:
+        return None
+
     def extract(self) -> Row:
         """Extract a table row from the coach-specific downloads."""
         row: Row = {}
 
-        _insert(row, "site", self.fetcher.site)
+        _insert(row, "site", self.site)
         _insert(row, "username", self.username)
 
-        _insert(row, "name", self.get_name())
-        _insert(row, "image_url", self.get_image_url())
-        _insert(row, "title", self.get_title())
-        _insert(row, "languages", self.get_languages())
-        _insert(row, "rapid", self.get_rapid())
-        _insert(row, "blitz", self.get_blitz())
-        _insert(row, "bullet", self.get_bullet())
+        getters: List[Tuple[RowKey, Callable[[], Any]]] = [
+            ("name", self.get_name),
+            ("image_url", self.get_image_url),
+            ("title", self.get_title),
+            ("languages", self.get_languages),
+            ("rapid", self.get_rapid),
+            ("blitz", self.get_blitz),
+            ("bullet", self.get_bullet),
+            ("classical", self.get_classical),
+            ("correspondence", self.get_correspondence),
+            ("puzzle", self.get_puzzle),
+        ]
+        for key, getter in getters:
+            started_at = time.perf_counter()
+            value = getter()
+            self.timings[key] = time.perf_counter() - started_at
+            _insert(row, key, value)
 
         return row
 
 
-async def task_worker(name, queue):
-    while True:
-        conn, extractor = await queue.get()
-        upsert_row(conn, extractor.extract())
-        queue.task_done()
+# The language detector, store, and profiler of the current extraction
+# process. Created once per process by `init_extraction_process`.
+_detector: Detector | None = None
+_store: Store | None = None
+_profiler: ExtractProfiler | None = None
+
+
+def init_extraction_process(
+    detector: Detector, store: Store, profiler: ExtractProfiler | None = None
+):
+    """Initializer of each process of the extraction `ProcessPoolExecutor`.
+
+    Each process receives its own copy of `detector`, `store`, and `profiler`.
+    The underlying language detector is built lazily unless `detector.preload`
+    is set, in which case it is built immediately with all of its language
+    models loaded. If `profiler` is set, every `Extractor.extract` call of the
+    process is profiled.
+    """
+    global _detector, _store, _profiler
+    _detector = detector
+    _store = store
+    _profiler = profiler
+    if detector.preload:
+        detector.get_detector()
+    if profiler is not None:
+        profiler.start()
+
+
+# Bump whenever the extracted data changes for the same downloaded files, e.g.
+# when fixing an `Extractor`. Rows extracted by a prior version are then
+# considered stale and re-extracted.
+EXTRACTION_VERSION = 2
+
+
+def fingerprint_files(files: Dict[str, bytes | None]) -> str:
+    """Compute a SHA-256 digest over the contents of the specified files.
+
+    Files are hashed in order of their keys. Missing files contribute a marker
+    distinct from any file contents so that a file disappearing (or appearing)
+    changes the fingerprint.
+    """
+    digest = hashlib.sha256(f"v{EXTRACTION_VERSION}".encode())
+    for key in sorted(files):
+        digest.update(b"\0" + key.encode() + b"\0")
+        contents = files[key]
+        if contents is None:
+            digest.update(b"-")
+        else:
+            digest.update(b"+")
+            digest.update(contents)
+    return digest.hexdigest()
+
+
+def extract_row(
+    pipeline: "Pipeline",
+    username: str,
+    files: Dict[str, str],
+    fingerprint: str | None = None,
+) -> Tuple[Row | None, Dict[str, float]]:
+    """Extract a table row from the specified coach's downloaded files.
+
+    Runs within an extraction process. The `pipeline` is pickled across the
+    process boundary and is only used to construct the `Extractor`. Files are
+    read from the store of the process.
+
+    @param fingerprint
+        The fingerprint recorded when the coach was last exported, if any.
+    @return
+        Tuple containing the row, and the seconds spent on each step of the
+        extraction (reading the files, fingerprinting them, and each field).
+        The row is None if the files still match `fingerprint` and the coach
+        therefore does not need to be extracted again.
+    """
+    assert _detector is not None, "Extraction process was not initialized."
+    assert _store is not None, "Extraction process was not initialized."
+    timings: Dict[str, float] = {}
+    started_at = time.perf_counter()
+    contents = {k: _store.read(v) for k, v in files.items()}
+    timings["read"] = time.perf_counter() - started_at
+    started_at = time.perf_counter()
+    current = fingerprint_files(contents)
+    timings["fingerprint"] = time.perf_counter() - started_at
+    if current == fingerprint:
+        return None, timings
+    extractor = pipeline.get_extractor(username, contents, _detector)
+    if _profiler is None:
+        row = extractor.extract()
+    else:
+        with _profiler.profile(extractor.site.value):
+            row = extractor.extract()
+    _insert(row, "fingerprint", current)
+    return row, {**timings, **extractor.timings}
+
+
+def record_extraction(site: Site, timings: Dict[str, float]):
+    """Record the timings returned by `extract_row` in the metrics."""
+    for field, secs in timings.items():
+        metrics.EXTRACT_SECONDS.observe(secs, site=site.value, field=field)
 
 
 class Pipeline:
     """Site specific download and extraction pipeline.
 
-    Performs downloads serially but processes data extraction from downloaded
-    files concurrently.
+    Coach usernames are discovered by scraping listing pages concurrently.
+    Coach files are downloaded concurrently by a batch of download workers,
+    throttled by the fetcher's rate limiter. Each coach is queued for data
+    extraction as soon as its files are downloaded, so extraction overlaps with
+    the remaining downloads. Extraction itself is offloaded to a process pool
+    to keep the event loop free for network I/O.
+
+    Queues between stages hold at most `queue_size` coaches each. Only
+    usernames and the store keys of their files are queued; files are read and
+    parsed within the extraction process. Producers wait whenever a later
+    stage falls behind, so memory use is independent of the number of coaches
+    a site lists.
     """
 
-    def __init__(self, worker_count):
+    # Number of listing pages in a row that can fail to be scraped before
+    # discovery gives up on the remaining pages.
+    MAX_FAILED_PAGES = 8
+
+    # Seconds between samples of the length of each queue.
+    QUEUE_SAMPLE_SECS = 1.0
+
+    def __init__(
+        self,
+        store: Store,
+        worker_count: int,
+        concurrency: int,
+        rate: float | None = None,
+        burst: int | None = None,
+        max_age: Dict[str, float] | None = None,
+        queue_size: int = 64,
+        retry: RetryPolicy | None = None,
+        resume: bool = False,
+    ):
+        # Cache of downloaded files. Refer to `Fetcher`.
+        self.store = store
         self.worker_count = worker_count
+        self.concurrency = concurrency
+        # Overrides of the site-specific rate limits, if set.
+        self.rate = rate
+        self.burst = burst
+        # Maximum age in seconds of each cached resource. Refer to `Fetcher`.
+        self.max_age = max_age
+        self.queue_size = queue_size
+        # Retry policy of failed requests. Refer to `Fetcher`.
+        self.retry = retry
+        # Whether to continue from the checkpoint of an interrupted run.
+        self.resume = resume
+        # Number of coaches written out, and skipped because their files were
+        # left unchanged.
+        self.exported = 0
+        self.unchanged = 0
 
     def get_fetcher(self, session: aiohttp.ClientSession) -> Fetcher:
         raise NotImplementedError()
 
     def get_extractor(
-        self, fetcher: Fetcher, detector: LanguageDetector, username: str
+        self, username: str, files: Dict[str, bytes | None], detector: Detector
     ) -> Extractor:
         raise NotImplementedError()
 
+    async def download_worker(
+        self,
+        name: str,
+        fetcher: Fetcher,
+        downloads: asyncio.Queue,
+        extractions: asyncio.Queue,
+        checkpoint: Checkpoint,
+    ):
+        while True:
+            username = await downloads.get()
+            try:
+                await fetcher.download_user_files(username)
+                checkpoint.complete_download(username)
+                await extractions.put((username, fetcher.user_files(username)))
+            except CircuitOpenError as e:
+                logging.error(f"{name}: Could not download files of {username}. {e}")
+            except Exception:
+                logging.exception(f"{name}: Could not download files of {username}.")
+            finally:
+                downloads.task_done()
+
+    async def discover(
+        self, fetcher: Fetcher, downloads: asyncio.Queue, checkpoint: Checkpoint
+    ):
+        """Queue the username of every coach listed by the site for download.
+
+        Up to `concurrency` listing pages are scraped at once, sharing the
+        fetcher's rate limit with the download workers. Usernames are queued as
+        soon as their page is scraped. Discovery ends at the first page listing
+        no coaches, or only coaches already listed on other pages (as happens
+        with sites serving the last page for any page past it), or once
+        `MAX_FAILED_PAGES` pages in a row could not be scraped.
+
+        Pages already scraped according to `checkpoint` are skipped. Their
+        usernames are queued separately (refer to `requeue`).
+        """
+        page_nos = itertools.count(checkpoint.last_page() + 1)
+        # An empty page recorded by an interrupted run already marks the end.
+        end = min(
+            (
+                page_no
+                for page_no, usernames in checkpoint.pages.items()
+                if not usernames
+            ),
+            default=math.inf,
+        )
+        failures = 0
+        seen: Set[str] = {
+            u for usernames in checkpoint.pages.values() for u in usernames
+        }
+
+        async def worker():
+            nonlocal end, failures
+            for page_no in page_nos:
+                if page_no >= end:
+                    return
+                if page_no in checkpoint.pages:
+                    continue
+                usernames: List[str] | None = None
+                try:
+                    usernames = await fetcher.scrape_usernames(page_no)
+                except CircuitOpenError as e:
+                    logging.error(f"{fetcher.site.value}: Could not scrape page. {e}")
+                except Exception:
+                    logging.exception(
+                        f"{fetcher.site.value}: Could not scrape page {page_no}."
+                    )
+                if usernames is None:
+                    # Skips this page, unless the site seems to be failing
+                    # every page. There is no other way to tell when to stop.
+                    failures += 1
+                    if failures >= self.MAX_FAILED_PAGES:
+                        end = min(end, page_no)
+                    continue
+                failures = 0
+                checkpoint.complete_page(page_no, usernames)
+                if all(username in seen for username in usernames):
+                    end = min(end, page_no)
+                if page_no >= end:
+                    return
+                for username in usernames:
+                    if username not in seen:
+                        seen.add(username)
+                        await downloads.put(username)
+
+        await asyncio.gather(*[worker() for _ in range(self.concurrency)])
+
+    async def requeue(
+        self,
+        fetcher: Fetcher,
+        downloads: asyncio.Queue,
+        extractions: asyncio.Queue,
+        checkpoint: Checkpoint,
+    ):
+        """Queue the coaches an interrupted run discovered but did not commit.
+
+        Coaches whose files were all downloaded go straight to extraction.
+        """
+        pending = checkpoint.pending()
+        if pending:
+            print(
+                f"{fetcher.site.value}: Resuming after page {checkpoint.last_page()} "
+                f"with {len(pending)} coaches pending"
+            )
+        for username in pending:
+            if username in checkpoint.downloaded:
+                await extractions.put((username, fetcher.user_files(username)))
+            else:
+                await downloads.put(username)
+
+    async def extract_worker(
+        self,
+        name: str,
+        site: Site,
+        writer: Writer,
+        executor: Executor,
+        extractions: asyncio.Queue,
+        fingerprints: Dict[str, str],
+        checkpoint: Checkpoint,
+    ):
+        loop = asyncio.get_running_loop()
+        while True:
+            username, files = await extractions.get()
+            try:
+                row, timings = await loop.run_in_executor(
+                    executor,
+                    extract_row,
+                    self,
+                    username,
+                    files,
+                    fingerprints.get(username),
+                )
+                record_extraction(site, timings)
+                if row is None:
+                    self.unchanged += 1
+                    checkpoint.commit([username])
+                else:
+                    committed = await writer.write(row)
+                    checkpoint.commit(r["username"] for r in committed)
+                    self.exported += 1
+            except Exception:
+                logging.exception(f"{name}: Could not extract {username}.")
+            finally:
+                extractions.task_done()
+
+    async def flush_worker(
+        self,
+        name: str,
+        writer: Writer,
+        checkpoint: Checkpoint,
+        done: asyncio.Event,
+    ):
+        """Flush rows buffered by `writer` once stale until `done` is set.
+
+        Extraction workers only flush on writing a row, which may not happen
+        for a while if downloads stall.
+        """
+        while await writer.wait_due(done):
+            try:
+                committed = await writer.flush()
+                checkpoint.commit(r["username"] for r in committed)
+            except Exception:
+                logging.exception(f"{name}: Could not flush buffered rows.")
+
+    async def sample_queues(self, site: Site, queues: Dict[str, asyncio.Queue]):
+        """Record the length of each of `queues` in the metrics until cancelled."""
+
+        def sample():
+            for name, queue in queues.items():
+                metrics.QUEUE_DEPTH.set(queue.qsize(), site=site.value, queue=name)
+
+        try:
+            while True:
+                sample()
+                await asyncio.sleep(self.QUEUE_SAMPLE_SECS)
+        finally:
+            sample()
+
+    async def reextract(
+        self, executor: Executor, session: aiohttp.ClientSession
+    ) -> List[Row]:
+        """Extract every coach whose files are cached in the store.
+
+        Unlike `process`, no listing pages are scraped and no requests are
+        made. Coaches are enumerated from the store directly and extracted
+        regardless of their fingerprints, e.g. to roll out a fixed `Extractor`.
+
+        @return
+            The row of each coach that could be extracted.
+        """
+        fetcher = self.get_fetcher(session)
+        prefix = f"{fetcher.path_coaches_dir()}/"
+        usernames = iter(
+            dict.fromkeys(
+                key[len(prefix) :].split("/", 1)[0] for key in self.store.keys(prefix)
+            )
+        )
+        rows: List[Row] = []
+        loop = asyncio.get_running_loop()
+
+        async def worker():
+            for username in usernames:
+                try:
+                    row, timings = await loop.run_in_executor(
+                        executor,
+                        extract_row,
+                        self,
+                        username,
+                        fetcher.user_files(username),
+                    )
+                    record_extraction(fetcher.site, timings)
+                    assert row is not None, "Coach was not extracted."
+                    rows.append(row)
+                except Exception:
+                    logging.exception(
+                        f"{fetcher.site.value}: Could not extract {username}."
+                    )
+
+        # Keep a second coach queued for each extraction process so none sit
+        # idle while results are sent back.
+        await asyncio.gather(*[worker() for _ in range(2 * self.worker_count)])
+        return rows
+
+    def report(self, fetcher: Fetcher, elapsed: float):
+        """Print the throughput of a finished run."""
+        site = fetcher.site.value
+        print(
+            f"{site}: Exported {self.exported} coaches in {elapsed:.1f}s "
+            f"({self.exported / elapsed:.2f}/s)"
+        )
+        if self.unchanged:
+            print(f"{site}: Skipped {self.unchanged} unchanged coaches")
+        wire = fetcher.wire_bytes / 2**20
+        body = fetcher.body_bytes / 2**20
+        print(
+            f"{site}: Made {fetcher.requests} requests "
+            f"({fetcher.requests / elapsed:.2f}/s), received {wire:.1f} MiB "
+            f"over the wire ({wire / elapsed:.2f} MiB/s), {body:.1f} MiB decoded"
+        )
+
     async def process(
-        self, conn, detector: LanguageDetector, session: aiohttp.ClientSession
+        self,
+        writer: Writer,
+        executor: Executor,
+        session: aiohttp.ClientSession,
     ):
+        started_at = time.monotonic()
         fetcher = self.get_fetcher(session)
 
-        queue: asyncio.Queue = asyncio.Queue()
+        # Coaches whose downloaded files still match the fingerprint of their
+        # exported row are neither extracted nor written again.
+        fingerprints = await writer.fingerprints(fetcher.site)
+
+        # Progress is recorded as it is made. Unless resuming, any progress of
+        # a previous run is discarded.
+        checkpoint = Checkpoint(
+            os.path.join(
+                self.store.path_state("checkpoints"), f"{fetcher.site.value}.jsonl"
+            )
+        )
+        if self.resume:
+            checkpoint.load()
+        else:
+            checkpoint.clear()
+
+        downloads: asyncio.Queue = asyncio.Queue(self.queue_size)
+        extractions: asyncio.Queue = asyncio.Queue(self.queue_size)
 
-        # Create a batch of workers to process the jobs put into the queue.
+        # Create a batch of workers to process the jobs put into the queues.
         workers = []
         for i in range(self.worker_count):
-            worker = asyncio.create_task(task_worker(f"worker-{i}", queue))
+            worker = asyncio.create_task(
+                self.extract_worker(
+                    f"{fetcher.site.value}-extract-{i}",
+                    fetcher.site,
+                    writer,
+                    executor,
+                    extractions,
+                    fingerprints,
+                    checkpoint,
+                )
+            )
             workers.append(worker)
+        for i in range(self.concurrency):
+            worker = asyncio.create_task(
+                self.download_worker(
+                    f"{fetcher.site.value}-download-{i}",
+                    fetcher,
+                    downloads,
+                    extractions,
+                    checkpoint,
+                )
+            )
+            workers.append(worker)
+        workers.append(
+            asyncio.create_task(
+                self.sample_queues(
+                    fetcher.site, {"downloads": downloads, "extractions": extractions}
+                )
+            )
+        )
+        # Stopped rather than cancelled so that no flush is interrupted.
+        done = asyncio.Event()
+        flusher = asyncio.create_task(
+            self.flush_worker(f"{fetcher.site.value}-flush", writer, checkpoint, done)
+        )
+
+        # Begin discovering all coach usernames. The download workers fetch
+        # each coach's files concurrently, subject to the fetcher's rate limit,
+        # and hand them off to the extraction workers to write out.
+        await asyncio.gather(
+            self.requeue(fetcher, downloads, extractions, checkpoint),
+            self.discover(fetcher, downloads, checkpoint),
+        )
+
+        # Wait until the queues are fully processed.
+        await downloads.join()
+        await extractions.join()
+        done.set()
+        await flusher
+        committed = await writer.flush()
+        checkpoint.commit(r["username"] for r in committed)
+        self.report(fetcher, time.monotonic() - started_at)
 
-        # Begin downloading all coach usernames and files. The workers will
-        # run concurrently to extract all the relvant information and write
-        page_no = 1
-        usernames: List[str] | None = [""]
-        while usernames is None or len(usernames):
-            usernames = await fetcher.scrape_usernames(page_no)
-            page_no += 1
-            for username in usernames or []:
-                await fetcher._download_user_files(username)
-                extractor = self.get_extractor(fetcher, detector, username)
-                queue.put_nowait((conn, extractor))
-
-        # Wait until the queue is fully processed.
-        await queue.join()
+        # The run is complete. There is nothing left to resume.
+        checkpoint.clear()
 
         # We can now turn down the workers.
         for worker in workers:
@@ -0,0 +1,179 @@
+"""Opt-in profiling of the extraction stage.
+
+Extraction runs within the processes of the extraction pool (refer to
+`extract_row`). Each process profiles the extractions it runs and writes its
+results to a file of its own once it exits. These files are then merged into a
+single profile by the main process.
+"""
+import contextlib
+import cProfile
+import glob
+import multiprocessing.util
+import os
+import pstats
+import sys
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List, Tuple
+
+from coach_scraper import metrics
+
+PROFILE_FORMATS = ["pstats", "collapsed"]
+
+
+class StackProfiler:
+    """Deterministic profiler recording the time spent in each full call stack.
+
+    `cProfile` only relates callers to their immediate callees, which is not
+    enough to draw a flame graph. Instead, this records the self time of the
+    innermost frame of every distinct stack.
+    """
+
+    def __init__(self):
+        self.stacks: Dict[Tuple[str, ...], float] = defaultdict(float)
+        self.path: List[str] = []
+        self.last = 0.0
+
+    def _callback(self, frame, event, arg):
+        now = time.perf_counter()
+        self.stacks[tuple(self.path)] += now - self.last
+        if event == "call":
+            code = frame.f_code
+            filename = os.path.basename(code.co_filename)
+            self.path.append(f"{code.co_qualname} ({filename}:{code.co_firstlineno})")
+        elif event == "c_call":
+            self.path.append(getattr(arg, "__qualname__", None) or repr(arg))
+        elif len(self.path) > 1:
+            # Never pop the root, e.g. on returning from the function that
+            # enabled the profiler.
+            self.path.pop()
+        self.last = time.perf_counter()
+
+    @contextlib.contextmanager
+    def profile(self, root: str) -> Iterator[None]:
+        """Profile the `with` block, nesting all of its stacks under `root`."""
+        self.path = [root]
+        self.last = time.perf_counter()
+        sys.setprofile(self._callback)
+        try:
+            yield
+        finally:
+            sys.setprofile(None)
+
+    def lines(self) -> Iterator[str]:
+        """The recorded stacks in the collapsed stack format, in microseconds."""
+        for stack, secs in self.stacks.items():
+            micros = round(secs * 1_000_000)
+            if micros > 0:
+                yield f"{';'.join(stack)} {micros}\n"
+
+
+class ExtractProfiler:
+    """Profiles every extraction of the processes it is passed to.
+
+    @param path
+        The file the merged profile is written to.
+    @param format
+        One of `PROFILE_FORMATS`. Either `pstats` statistics of `cProfile`
+        (e.g. for `python3 -m pstats`), or collapsed stacks (e.g. for
+        `flamegraph.pl`) with the self time of each stack in microseconds.
+    """
+
+    def __init__(self, path: str, format: str = "pstats"):
+        if format not in PROFILE_FORMATS:
+            raise ValueError(f"Unknown profile format: {format}.")
+        self.path = os.path.abspath(path)
+        self.format = format
+        # The profiler of the current extraction process, once started.
+        self.profiler: cProfile.Profile | StackProfiler | None = None
+        # Discard anything left behind by an interrupted run.
+        for part in self.parts():
+            os.remove(part)
+
+    def parts(self) -> List[str]:
+        """Files written by each extraction process that has exited."""
+        return glob.glob(f"{glob.escape(self.path)}.*.part")
+
+    def start(self):
+        """Start profiling the current extraction process.
+
+        Results are written once the process exits.
+        """
+        if self.format == "pstats":
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = StackProfiler()
+        multiprocessing.util.Finalize(None, self.dump, exitpriority=10)
+
+    @contextlib.contextmanager
+    def profile(self, root: str) -> Iterator[None]:
+        """Profile the `with` block, attributing it to `root` where possible."""
+        profiler = self.profiler
+        assert profiler is not None, "Profiler was not started."
+        if isinstance(profiler, StackProfiler):
+            with profiler.profile(root):
+                yield
+            return
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+
+    def dump(self):
+        """Write the results of the current extraction process."""
+        part = f"{self.path}.{os.getpid()}.part"
+        if isinstance(self.profiler, cProfile.Profile):
+            self.profiler.dump_stats(part)
+        elif isinstance(self.profiler, StackProfiler):
+            with open(part, "w") as f:
+                f.writelines(self.profiler.lines())
+
+    def merge(self):
+        """Merge the results of all extraction processes into `path`.
+
+        Call once the extraction pool has shut down.
+        """
+        parts = self.parts()
+        if not parts:
+            print("No extractions were profiled.", file=sys.stderr)
+            return
+        if self.format == "pstats":
+            pstats.Stats(*parts).dump_stats(self.path)
+        else:
+            stacks: Dict[str, int] = defaultdict(int)
+            for part in parts:
+                with open(part, "r") as f:
+                    for line in f:
+                        stack, _, micros = line.rstrip("\n").rpartition(" ")
+                        stacks[stack] += int(micros)
+            with open(self.path, "w") as f:
+                f.writelines(f"{s} {m}\n" for s, m in sorted(stacks.items()))
+        for part in parts:
+            os.remove(part)
+        print(f"Wrote extraction profile of {len(parts)} processes to {self.path}")
+
+
+def print_extract_timings():
+    """Print the time spent on each step of extraction per site.
+
+    Steps are taken from `metrics.EXTRACT_SECONDS`, and so cover every
+    extraction of the current process' pipelines. Each site's steps are listed
+    from most to least time spent.
+    """
+    sites: Dict[str, List[Tuple[str, metrics.Observations]]] = defaultdict(list)
+    for (site, field), observations in metrics.EXTRACT_SECONDS.observations.items():
+        sites[site].append((field, observations))
+    for site, fields in sorted(sites.items()):
+        total = sum(o.sum for _, o in fields)
+        print(f"{site}: Spent {total:.2f}s extracting")
+        print(
+            f"  {'step':<14} {'count':>7} {'total':>9} {'share':>7} "
+            f"{'mean':>10} {'max':>10}"
+        )
+        for field, o in sorted(fields, key=lambda f: f[1].sum, reverse=True):
+            share = o.sum / total * 100 if total else 0.0
+            print(
+                f"  {field:<14} {o.count:>7} {o.sum:>8.3f}s {share:>6.1f}% "
+                f"{o.sum / o.count * 1000:>8.3f}ms {o.max * 1000:>8.3f}ms"
+            )
@@ -0,0 +1,83 @@
+import asyncio
+import time
+from typing import Protocol
+
+
+class RateLimiter(Protocol):
+    """Interface of the rate limiters a `Fetcher` accepts."""
+
+    async def acquire(self):
+        ...
+
+    def throttle(self, pause: float | None = None):
+        ...
+
+    def recover(self):
+        ...
+
+
+class TokenBucket:
+    """Token bucket rate limiter.
+
+    Tokens accumulate at a rate of `rate` per second, up to a maximum of
+    `burst` tokens. Each request consumes a single token, waiting until one is
+    available if the bucket is empty. Waiters are served in FIFO order.
+
+    The rate adapts to the site: it is halved whenever the site asks us to slow
+    down (refer to `throttle`), down to `min_rate`, and recovers gradually back
+    up to the configured rate as requests succeed (refer to `recover`).
+    """
+
+    # Fraction of the configured rate regained per successful request.
+    RECOVERY_STEP = 1 / 16
+
+    def __init__(self, rate: float, burst: int, min_rate: float | None = None):
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive. Found {rate}.")
+        if burst < 1:
+            raise ValueError(f"Burst must be at least 1. Found {burst}.")
+        self.max_rate = rate
+        self.min_rate = min(rate, min_rate or rate / 16)
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self.updated_at = max(self.updated_at, now)
+
+    async def acquire(self):
+        """Wait until a token is available and consume it."""
+        async with self.lock:
+            self._refill()
+            while self.tokens < 1:
+                delay = max(0.0, self.updated_at - time.monotonic())
+                await asyncio.sleep(delay + (1 - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= 1
+
+    def throttle(self, pause: float | None = None):
+        """Halve the rate, e.g. after the site responds with `429`.
+
+        @param pause
+            Number of seconds to wait before handing out any more tokens, e.g.
+            as requested by a `Retry-After` header.
+        """
+        self._refill()
+        self.rate = max(self.min_rate, self.rate / 2)
+        if pause:
+            # Tokens only start accumulating again once the pause is over.
+            self.tokens = 0.0
+            self.updated_at = max(self.updated_at, time.monotonic() + pause)
+
+    def recover(self):
+        """Increase the rate back towards its configured value after a success."""
+        if self.rate < self.max_rate:
+            self._refill()
+            self.rate = min(
+                self.max_rate, self.rate + self.max_rate * self.RECOVERY_STEP
+            )
@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# Statuses indicating the request may succeed if retried later.
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """The number of seconds a `Retry-After` header asks clients to wait.
+
+    The header holds either a number of seconds or an HTTP date.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+class RetryPolicy:
+    """Exponential backoff with full jitter.
+
+    The `n`th retry (0-indexed) waits a random duration of up to
+    `base_delay * 2**n` seconds, capped at `max_delay`. A `Retry-After` sent by
+    the site takes precedence whenever it asks for a longer wait.
+    """
+
+    def __init__(
+        self,
+        max_retries: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        if max_retries < 0:
+            raise ValueError(f"Retries must be non-negative. Found {max_retries}.")
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, retry: int, retry_after: float | None = None) -> float:
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * 2**retry))
+        if retry_after is not None:
+            return max(backoff, retry_after)
+        return backoff
+
+
+class CircuitOpenError(Exception):
+    """Raised when a request is made to a site considered down."""
+
+
+class CircuitBreaker:
+    """Pauses all requests to a site after repeated failures.
+
+    The breaker opens once `threshold` requests in a row fail, pausing further
+    requests for `cooldown` seconds. Requests then resume, and the first
+    success closes the breaker again. A site that keeps failing is considered
+    down once the breaker opens `max_trips` times without a success in
+    between, after which requests fail immediately with `CircuitOpenError`.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        threshold: int = 10,
+        cooldown: float = 60.0,
+        max_trips: int = 5,
+    ):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_trips = max_trips
+        self.failures = 0
+        self.trips = 0
+        self.open_until = 0.0
+
+    async def wait(self):
+        """Wait until the breaker allows requests to be made."""
+        if self.trips >= self.max_trips:
+            raise CircuitOpenError(f"{self.name}: Site is considered down.")
+        delay = self.open_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def record_success(self):
+        self.failures = 0
+        self.trips = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures < self.threshold:
+            return
+        self.failures = 0
+        self.trips += 1
+        self.open_until = time.monotonic() + self.cooldown
+        if self.trips >= self.max_trips:
+            logging.error(f"{self.name}: Giving up after {self.trips} pauses.")
+        else:
+            logging.warning(
+                f"{self.name}: Pausing requests for {self.cooldown:.0f}s after "
+                f"{self.threshold} failures in a row."
+            )
@@ -0,0 +1,91 @@
+import zlib
+from dataclasses import dataclass
+from typing import List
+
+import aiohttp
+import brotli
+
+# Content codings we are able to decode, in order of preference.
+ACCEPT_ENCODING = "br, gzip, deflate"
+
+
+@dataclass
+class SessionOptions:
+    """Connection settings of the client session made for each site."""
+
+    user_agent: str
+    # Maximum number of pooled connections to each host.
+    connections_per_host: int
+    # Seconds an idle connection is kept alive for reuse.
+    keepalive: float
+    # Seconds resolved host names are cached for.
+    dns_ttl: int
+    # Seconds a whole request (including reading the body) may take.
+    timeout: float
+    # Seconds acquiring a connection may take.
+    connect_timeout: float
+    # Seconds we may wait between reading chunks of the body.
+    read_timeout: float
+
+
+def create_session(
+    options: SessionOptions,
+    trace_configs: List[aiohttp.TraceConfig] | None = None,
+) -> aiohttp.ClientSession:
+    """Create a client session backed by its own connection pool.
+
+    Response bodies are not decompressed by the session. This allows the
+    `Fetcher` to count the bytes actually sent over the wire before decoding
+    them with a `Decoder`.
+
+    @param trace_configs
+        Hooks into the lifecycle of each request, e.g. for benchmarking.
+    """
+    connector = aiohttp.TCPConnector(
+        limit_per_host=options.connections_per_host,
+        keepalive_timeout=options.keepalive,
+        ttl_dns_cache=options.dns_ttl,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(
+            total=options.timeout,
+            connect=options.connect_timeout,
+            sock_read=options.read_timeout,
+        ),
+        headers={
+            "User-Agent": f"BoardWise coach-scraper ({options.user_agent})",
+            "Accept-Encoding": ACCEPT_ENCODING,
+        },
+        auto_decompress=False,
+        trace_configs=trace_configs,
+    )
+
+
+class Decoder:
+    """Incrementally decodes a response body of the given `Content-Encoding`."""
+
+    def __init__(self, encoding: str | None):
+        self.encoding = (encoding or "identity").strip().lower()
+        self.zlib = None
+        self.brotli = None
+        if self.encoding in ["gzip", "x-gzip"]:
+            self.zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        elif self.encoding == "deflate":
+            self.zlib = zlib.decompressobj()
+        elif self.encoding == "br":
+            self.brotli = brotli.Decompressor()
+        elif self.encoding != "identity":
+            raise ValueError(f"Encountered unknown encoding: {self.encoding}.")
+
+    def decode(self, chunk: bytes) -> bytes:
+        if self.zlib is not None:
+            return self.zlib.decompress(chunk)
+        if self.brotli is not None:
+            return self.brotli.process(chunk)
+        return chunk
+
+    def flush(self) -> bytes:
+        if self.zlib is not None:
+            return self.zlib.flush()
+        return b""
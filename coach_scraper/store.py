@@ -0,0 +1,300 @@
+import contextlib
+import io
+import json
+import os
+import secrets
+import sqlite3
+from typing import IO, Any, Dict, Iterator, List
+
+import zstandard
+
+# Backends selectable from the command line.
+STORE_KINDS = ["directory", "sqlite"]
+
+
+class Store:
+    """Cache of downloaded files along with the metadata of their requests.
+
+    Files are keyed by a `/`-separated path relative to the store, e.g.
+    `"chesscom/pages/1.txt"`. Stores are pickled into each extraction process
+    and must therefore only open underlying resources lazily.
+    """
+
+    def read(self, key: str) -> bytes | None:
+        """The contents of `key`, or `None` if not cached."""
+        raise NotImplementedError()
+
+    def write(self, key: str, data: bytes):
+        with self.write_stream(key) as f:
+            f.write(data)
+
+    def write_stream(self, key: str) -> contextlib.AbstractContextManager[IO[bytes]]:
+        """Open a binary file whose contents replace `key` once closed.
+
+        The replacement is atomic. If an exception is raised before the file is
+        closed, `key` is left untouched.
+        """
+        raise NotImplementedError()
+
+    def read_metadata(self, key: str) -> Dict[str, Any] | None:
+        """Metadata recorded when `key` was last fetched.
+
+        @return
+            `None` if `key` is not cached.
+        """
+        raise NotImplementedError()
+
+    def write_metadata(self, key: str, metadata: Dict[str, Any]):
+        raise NotImplementedError()
+
+    def keys(self, prefix: str) -> Iterator[str]:
+        """All cached keys starting with `prefix`, in no particular order."""
+        raise NotImplementedError()
+
+    def path_state(self, name: str) -> str:
+        """Filesystem path of `name` kept alongside the store.
+
+        Holds state of the runs using the store, e.g. their checkpoints, which
+        is therefore never shared between stores at different locations.
+        """
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class DirectoryStore(Store):
+    """A `Store` keeping each file at its key beneath the `root` directory.
+
+    Metadata is kept in a `.meta.json` sidecar next to each file. Files are
+    written to a hidden temporary file in the same directory first and renamed
+    into place once complete.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def path_state(self, name: str) -> str:
+        # Keys start with the name of a site, so never clash with `name`.
+        return os.path.join(self.root, name)
+
+    def path_metadata(self, key: str) -> str:
+        return f"{self.path(key)}.meta.json"
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            with open(self.path(key), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    @contextlib.contextmanager
+    def _replace(self, path: str) -> Iterator[IO[bytes]]:
+        dirname, basename = os.path.split(path)
+        os.makedirs(dirname, exist_ok=True)
+        tmp = os.path.join(dirname, f".{basename}.{secrets.token_hex(4)}.tmp")
+        try:
+            with open(tmp, "xb") as f:
+                yield f
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, path)
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(tmp)
+            raise
+
+    def write_stream(self, key: str) -> contextlib.AbstractContextManager[IO[bytes]]:
+        return self._replace(self.path(key))
+
+    def read_metadata(self, key: str) -> Dict[str, Any] | None:
+        path = self.path(key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(self.path_metadata(key), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            # Files cached before metadata was recorded alongside them.
+            return {"fetched_at": os.path.getmtime(path)}
+
+    def write_metadata(self, key: str, metadata: Dict[str, Any]):
+        with self._replace(self.path_metadata(key)) as f:
+            f.write(json.dumps(metadata).encode())
+
+    def keys(self, prefix: str) -> Iterator[str]:
+        for dirpath, _, filenames in os.walk(self.path(prefix)):
+            relpath = os.path.relpath(dirpath, self.root)
+            for filename in filenames:
+                if filename.endswith(".meta.json") or filename.endswith(".tmp"):
+                    continue
+                yield "/".join([*relpath.split(os.sep), filename])
+
+
+class SqliteStore(Store):
+    """A `Store` packing all files into a single SQLite database.
+
+    Files are compressed with zstd at the given compression `level` and stored
+    alongside their metadata in the same row. Writes are committed immediately
+    so that extraction processes reading from the database see them. A single
+    upsert replaces a file, so replacements are atomic.
+    """
+
+    def __init__(self, path: str, level: int = 3):
+        self.path = path
+        self.level = level
+        self.conn: sqlite3.Connection | None = None
+        self.compressor: zstandard.ZstdCompressor | None = None
+        self.decompressor: zstandard.ZstdDecompressor | None = None
+
+    def __getstate__(self):
+        # Neither connections nor (de)compression contexts can be shared across
+        # processes. Each process recreates them on first use.
+        return {
+            **self.__dict__,
+            "conn": None,
+            "compressor": None,
+            "decompressor": None,
+        }
+
+    def connect(self) -> sqlite3.Connection:
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS files
+                  ( key TEXT PRIMARY KEY
+                  , data BLOB NOT NULL
+                  , metadata TEXT
+                  ) WITHOUT ROWID
+                """
+            )
+        return self.conn
+
+    def compress(self, data: bytes) -> bytes:
+        if self.compressor is None:
+            self.compressor = zstandard.ZstdCompressor(level=self.level)
+        return self.compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        if self.decompressor is None:
+            self.decompressor = zstandard.ZstdDecompressor()
+        # Streamed files do not record their decompressed size upfront.
+        return self.decompressor.decompressobj().decompress(data)
+
+    def read(self, key: str) -> bytes | None:
+        result = (
+            self.connect()
+            .execute("SELECT data FROM files WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if result is None:
+            return None
+        return self.decompress(result[0])
+
+    def _upsert(self, key: str, compressed: bytes):
+        self.connect().execute(
+            """
+            INSERT INTO files (key, data) VALUES (?, ?)
+            ON CONFLICT (key) DO UPDATE SET data = EXCLUDED.data
+            """,
+            (key, compressed),
+        )
+
+    def write(self, key: str, data: bytes):
+        self._upsert(key, self.compress(data))
+
+    @contextlib.contextmanager
+    def write_stream(self, key: str) -> Iterator[IO[bytes]]:
+        # Only the compressed file is buffered. Streams may be interleaved, so
+        # each gets its own compression context.
+        buffer = io.BytesIO()
+        compressor = zstandard.ZstdCompressor(level=self.level)
+        with compressor.stream_writer(buffer, closefd=False) as f:
+            yield f
+        self._upsert(key, buffer.getvalue())
+
+    def read_metadata(self, key: str) -> Dict[str, Any] | None:
+        result = (
+            self.connect()
+            .execute("SELECT metadata FROM files WHERE key = ?", (key,))
+            .fetchone()
+        )
+        if result is None:
+            return None
+        if result[0] is None:
+            # The file was written but its metadata never was. Treat the file
+            # as if it were fetched long ago.
+            return {"fetched_at": 0.0}
+        return json.loads(result[0])
+
+    def write_metadata(self, key: str, metadata: Dict[str, Any]):
+        self.connect().execute(
+            "UPDATE files SET metadata = ? WHERE key = ?",
+            (json.dumps(metadata), key),
+        )
+
+    def keys(self, prefix: str) -> Iterator[str]:
+        # Range scan over the primary key rather than a `LIKE` pattern, which
+        # would require escaping `prefix`.
+        cursor = self.connect().execute(
+            "SELECT key FROM files WHERE key >= ? AND key < ?",
+            (prefix, prefix + "\U0010ffff"),
+        )
+        for (key,) in cursor:
+            yield key
+
+    def path_state(self, name: str) -> str:
+        # Prefixed with the name of the database, e.g. `data/store-checkpoints`,
+        # so that databases within the same directory do not clash.
+        root, _ = os.path.splitext(self.path)
+        return f"{root}-{name}"
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+def open_store(kind: str, path: str | None = None) -> Store:
+    """Create a store of the given `kind` (one of `STORE_KINDS`).
+
+    @param path
+        Location of the store. Defaults to the `data` directory, or a database
+        within it for packed stores.
+    """
+    if kind == "directory":
+        return DirectoryStore(path or "data")
+    if kind == "sqlite":
+        return SqliteStore(path or os.path.join("data", "store.sqlite"))
+    raise ValueError(f"Encountered unknown store: {kind}.")
+
+
+def migrate_store(source: Store, target: Store, prefixes: List[str]) -> int:
+    """Copy every file beneath `prefixes` from `source` into `target`.
+
+    Files are copied along with their metadata, overwriting any file of the
+    same key already in `target`.
+
+    @return
+        The number of files copied.
+    """
+    count = 0
+    for prefix in prefixes:
+        for key in source.keys(prefix):
+            data = source.read(key)
+            metadata = source.read_metadata(key)
+            if data is None or metadata is None:
+                continue
+            target.write(key, data)
+            target.write_metadata(key, metadata)
+            count += 1
+            if count % 1000 == 0:
+                print(f"Migrated {count} files")
+    return count
@@ -1,8 +1,10 @@
+-- Safe to run against an existing database. Tables are only created if
+-- missing, and columns added since a table was first created are added to it,
+-- so re-running this script upgrades a database without losing any scraped
+-- data.
 CREATE SCHEMA IF NOT EXISTS coach_scraper;
 
-DROP TABLE IF EXISTS coach_scraper.export;
-
-CREATE TABLE coach_scraper.export
+CREATE TABLE IF NOT EXISTS coach_scraper.export
   ( id SERIAL PRIMARY KEY
   , site VARCHAR(16) NOT NULL
   , username VARCHAR(255) NOT NULL
@@ -13,9 +15,19 @@ CREATE TABLE coach_scraper.export
   , rapid INT
   , blitz INT
   , bullet INT
+  , classical INT
+  , correspondence INT
+  , puzzle INT
   , position INT
+  , fingerprint CHAR(64)
   );
 
+ALTER TABLE coach_scraper.export
+  ADD COLUMN IF NOT EXISTS classical INT,
+  ADD COLUMN IF NOT EXISTS correspondence INT,
+  ADD COLUMN IF NOT EXISTS puzzle INT,
+  ADD COLUMN IF NOT EXISTS fingerprint CHAR(64);
+
 CREATE UNIQUE INDEX IF NOT EXISTS
   site_username_unique
 ON
@@ -38,3 +50,87 @@ ON
   coach_scraper.languages
 USING
   BTREE (code);
+
+CREATE TABLE IF NOT EXISTS coach_scraper.runs
+  ( id SERIAL PRIMARY KEY
+  , started_at TIMESTAMPTZ NOT NULL DEFAULT now()
+  , finished_at TIMESTAMPTZ
+  );
+
+-- Every version of each row of the export table, keyed by the run that wrote
+-- it. Versions are only recorded when a row changes. Rows removed from the
+-- export table (e.g. by a restore) are recorded as `deleted` versions.
+CREATE TABLE IF NOT EXISTS coach_scraper.export_history
+  ( run_id INT NOT NULL
+  , site VARCHAR(16) NOT NULL
+  , username VARCHAR(255) NOT NULL
+  , name VARCHAR(255)
+  , image_url TEXT
+  , languages TEXT[]
+  , title VARCHAR(3)
+  , rapid INT
+  , blitz INT
+  , bullet INT
+  , classical INT
+  , correspondence INT
+  , puzzle INT
+  , deleted BOOLEAN NOT NULL DEFAULT FALSE
+  , PRIMARY KEY (site, username, run_id)
+  );
+
+ALTER TABLE coach_scraper.export_history
+  ADD COLUMN IF NOT EXISTS classical INT,
+  ADD COLUMN IF NOT EXISTS correspondence INT,
+  ADD COLUMN IF NOT EXISTS puzzle INT,
+  ADD COLUMN IF NOT EXISTS deleted BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS
+  export_history_run_id
+ON
+  coach_scraper.export_history
+USING
+  BTREE (run_id);
+
+CREATE TABLE IF NOT EXISTS coach_scraper.work
+  ( id BIGSERIAL PRIMARY KEY
+  , run_id INT NOT NULL
+  , site VARCHAR(16) NOT NULL
+  , page INT
+  , username VARCHAR(255)
+  , state VARCHAR(8) NOT NULL DEFAULT 'pending'
+  , claimed_by TEXT
+  , claimed_at TIMESTAMPTZ
+  , attempts INT NOT NULL DEFAULT 0
+  );
+
+CREATE UNIQUE INDEX IF NOT EXISTS
+  work_page_unique
+ON
+  coach_scraper.work
+USING
+  BTREE (run_id, site, page);
+
+CREATE UNIQUE INDEX IF NOT EXISTS
+  work_username_unique
+ON
+  coach_scraper.work
+USING
+  BTREE (run_id, site, username);
+
+CREATE INDEX IF NOT EXISTS
+  work_unfinished
+ON
+  coach_scraper.work
+USING
+  BTREE (run_id, site, id)
+WHERE
+  state IN ('pending', 'claimed');
+
+CREATE TABLE IF NOT EXISTS coach_scraper.rate_limits
+  ( site VARCHAR(16) PRIMARY KEY
+  , rate DOUBLE PRECISION NOT NULL
+  , max_rate DOUBLE PRECISION NOT NULL
+  , burst INT NOT NULL
+  , tokens DOUBLE PRECISION NOT NULL
+  , updated_at TIMESTAMPTZ NOT NULL
+  );
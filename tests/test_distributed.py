@@ -0,0 +1,202 @@
+"""Tests of the work queue and shared rate limits of distributed runs.
+
+These run against a live database, whose schema is dropped and recreated
+using `sql/init.sql` before each test. Set `COACH_SCRAPER_TEST_DSN` to the
+connection string of a disposable database to run them, e.g.
+```bash
+$ COACH_SCRAPER_TEST_DSN="host=/tmp/pgdata dbname=test" python3 -m unittest
+```
+"""
+import asyncio
+import os
+import unittest
+from typing import Dict, List
+
+import psycopg2
+from psycopg_pool import AsyncConnectionPool
+
+from coach_scraper.distributed import (
+    SharedTokenBucket,
+    WorkItem,
+    WorkQueue,
+    publish_run,
+)
+from coach_scraper.pipeline import Pipeline
+from coach_scraper.ratelimit import TokenBucket
+from coach_scraper.types import Site
+
+DSN = os.environ.get("COACH_SCRAPER_TEST_DSN")
+INIT_SQL = os.path.join(os.path.dirname(__file__), "..", "sql", "init.sql")
+
+
+@unittest.skipUnless(DSN, "COACH_SCRAPER_TEST_DSN is not set.")
+class WorkQueueTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        assert DSN is not None
+        self.conn = psycopg2.connect(DSN)
+        with open(INIT_SQL, "r") as f, self.conn.cursor() as cursor:
+            cursor.execute("DROP SCHEMA IF EXISTS coach_scraper CASCADE;")
+            cursor.execute(f.read())
+        self.conn.commit()
+        self.pool = AsyncConnectionPool(DSN, min_size=1, open=False)
+        await self.pool.open()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+        self.conn.close()
+
+    def _queue(self, concurrency: int, claim_timeout: float = 600.0) -> WorkQueue:
+        run_id = publish_run(self.conn, [Site.LICHESS], concurrency, keep_runs=30)
+        return WorkQueue(self.pool, run_id, claim_timeout=claim_timeout)
+
+    async def _states(self, queue: WorkQueue) -> Dict[str, str]:
+        """The state of each item of `queue`, keyed by its page or username."""
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                """
+                SELECT coalesce(page::TEXT, username), state
+                FROM coach_scraper.work
+                WHERE run_id = %s;
+                """,
+                [queue.run_id],
+            )
+            return dict(await cursor.fetchall())
+
+    async def _claim(self, queue: WorkQueue) -> WorkItem:
+        item = await queue.claim(Site.LICHESS, "worker")
+        assert item is not None, "Queue ran dry."
+        return item
+
+    async def _give_up(self, queue: WorkQueue) -> WorkItem:
+        """Claim the next item and fail it until out of attempts."""
+        while True:
+            item = await self._claim(queue)
+            await queue.fail(item)
+            if item.attempts >= queue.MAX_ATTEMPTS:
+                return item
+
+    async def test_claim_and_complete(self):
+        queue = self._queue(concurrency=2)
+        page1 = await self._claim(queue)
+        page2 = await self._claim(queue)
+        self.assertEqual((page1.page, page2.page), (1, 2))
+        self.assertIsNone(await queue.claim(Site.LICHESS, "worker"))
+
+        # Pages listing new coaches publish the next page, which is handed out
+        # before any coach.
+        await queue.complete_page(page1, ["a", "b"])
+        page3 = await self._claim(queue)
+        self.assertEqual(page3.page, 3)
+
+        # Pages listing no new coaches mark the end of the listing.
+        await queue.complete_page(page2, ["a"])
+        await queue.complete_page(page3, [])
+        coaches: List[WorkItem] = []
+        while (item := await queue.claim(Site.LICHESS, "worker")) is not None:
+            coaches.append(item)
+        self.assertEqual(sorted(c.username or "" for c in coaches), ["a", "b"])
+        self.assertFalse(await queue.drained(Site.LICHESS))
+
+        await queue.complete(c.id for c in coaches)
+        self.assertTrue(await queue.drained(Site.LICHESS))
+        self.assertEqual(
+            await self._states(queue),
+            {"1": "done", "2": "done", "3": "done", "a": "done", "b": "done"},
+        )
+
+    async def test_concurrent_claims(self):
+        queue = self._queue(concurrency=8)
+        items = await asyncio.gather(
+            *[queue.claim(Site.LICHESS, f"worker-{i}") for i in range(10)]
+        )
+        pages = [item.page for item in items if item is not None]
+        self.assertEqual(sorted(pages), list(range(1, 9)))
+
+    async def test_reclaim_stale(self):
+        queue = self._queue(concurrency=2)
+        page1 = await self._claim(queue)
+        self.assertEqual(page1.attempts, 1)
+
+        # Page 1 is still claimed, so is not handed out again yet.
+        page2 = await self._claim(queue)
+        self.assertEqual(page2.page, 2)
+
+        stale = WorkQueue(self.pool, queue.run_id, claim_timeout=0.0)
+        reclaimed = await stale.claim(Site.LICHESS, "other")
+        assert reclaimed is not None
+        self.assertEqual((reclaimed.id, reclaimed.attempts), (page1.id, 2))
+
+    async def test_failed_page_publishes_next(self):
+        queue = self._queue(concurrency=2)
+        await self._give_up(queue)
+        await self._give_up(queue)
+        states = await self._states(queue)
+        self.assertEqual(states["1"], "failed")
+        self.assertEqual(states["2"], "failed")
+        self.assertEqual(states["3"], "pending")
+        self.assertEqual(states["4"], "pending")
+
+        # Discovery carries on once the site recovers.
+        await queue.complete_page(await self._claim(queue), ["a"])
+        self.assertEqual((await self._claim(queue)).page, 4)
+
+    async def test_discovery_ends_after_failed_pages(self):
+        queue = self._queue(concurrency=1)
+        await queue.complete_page(await self._claim(queue), ["a"])
+        failed = []
+        while not await queue.drained(Site.LICHESS):
+            item = await self._give_up(queue)
+            if item.page is None:
+                await queue.complete([item.id])
+            else:
+                failed.append(item.page)
+        self.assertEqual(failed, list(range(2, 2 + Pipeline.MAX_FAILED_PAGES)))
+
+
+@unittest.skipUnless(DSN, "COACH_SCRAPER_TEST_DSN is not set.")
+class SharedTokenBucketTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        assert DSN is not None
+        conn = psycopg2.connect(DSN)
+        with open(INIT_SQL, "r") as f, conn.cursor() as cursor:
+            cursor.execute("DROP SCHEMA IF EXISTS coach_scraper CASCADE;")
+            cursor.execute(f.read())
+        conn.commit()
+        conn.close()
+        self.pool = AsyncConnectionPool(DSN, min_size=1, open=False)
+        await self.pool.open()
+
+    async def asyncTearDown(self):
+        await self.pool.close()
+
+    async def _rate(self) -> float:
+        async with self.pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT rate FROM coach_scraper.rate_limits WHERE site = %s;",
+                [Site.LICHESS.value],
+            )
+            result = await cursor.fetchone()
+        assert result is not None
+        return result[0]
+
+    async def test_matches_token_bucket(self):
+        local = TokenBucket(16.0, burst=4)
+        shared = SharedTokenBucket(self.pool, Site.LICHESS, rate=16.0, burst=4)
+        await shared.register()
+
+        for adapt in ["throttle", "throttle", "recover", "recover", "recover"]:
+            getattr(local, adapt)()
+            getattr(shared, adapt)()
+            await asyncio.gather(*shared.updates)
+            self.assertAlmostEqual(shared.rate, local.rate)
+            self.assertAlmostEqual(await self._rate(), local.rate)
+
+        # Other workers see the bucket through the database alone.
+        other = SharedTokenBucket(self.pool, Site.LICHESS, rate=16.0, burst=4)
+        await other.register()
+        await other.acquire()
+        self.assertAlmostEqual(other.rate, local.rate)
+
+
+if __name__ == "__main__":
+    unittest.main()
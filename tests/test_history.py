@@ -0,0 +1,144 @@
+"""Tests of the run history of the export table.
+
+These run against a live database, whose schema is dropped and recreated
+using `sql/init.sql` before each test. Set `COACH_SCRAPER_TEST_DSN` to the
+connection string of a disposable database to run them, e.g.
+```bash
+$ COACH_SCRAPER_TEST_DSN="host=/tmp/pgdata dbname=test" python3 -m unittest
+```
+"""
+import asyncio
+import os
+import unittest
+from typing import Any, Dict, List
+
+import psycopg2
+
+from coach_scraper.database import (
+    Row,
+    SyncWriter,
+    diff_runs,
+    finish_run,
+    prune_runs,
+    restore_run,
+    start_run,
+)
+from coach_scraper.types import Site
+
+DSN = os.environ.get("COACH_SCRAPER_TEST_DSN")
+INIT_SQL = os.path.join(os.path.dirname(__file__), "..", "sql", "init.sql")
+
+
+def _row(username: str, rapid: int) -> Row:
+    return {"site": Site.LICHESS, "username": username, "rapid": rapid}
+
+
+async def _write(writer: SyncWriter, rows: List[Row]):
+    for row in rows:
+        await writer.write(row)
+    await writer.flush()
+
+
+@unittest.skipUnless(DSN, "COACH_SCRAPER_TEST_DSN is not set.")
+class HistoryTest(unittest.TestCase):
+    def setUp(self):
+        self.conn = psycopg2.connect(DSN)
+        with open(INIT_SQL, "r") as f, self.conn.cursor() as cursor:
+            cursor.execute("DROP SCHEMA IF EXISTS coach_scraper CASCADE;")
+            cursor.execute(f.read())
+        self.conn.commit()
+
+    def tearDown(self):
+        self.conn.close()
+
+    def _run(self, rows: List[Row]) -> int:
+        run_id = start_run(self.conn)
+        asyncio.run(_write(SyncWriter(self.conn, run_id), rows))
+        finish_run(self.conn, run_id)
+        return run_id
+
+    def _export(self) -> Dict[str, Any]:
+        with self.conn.cursor() as cursor:
+            cursor.execute("SELECT username, rapid FROM coach_scraper.export;")
+            result = dict(cursor.fetchall())
+        self.conn.commit()
+        return result
+
+    def _history(self, run_id: int) -> List[str]:
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT username
+                FROM coach_scraper.export_history
+                WHERE run_id = %s
+                ORDER BY username;
+                """,
+                [run_id],
+            )
+            result = [r[0] for r in cursor.fetchall()]
+        self.conn.commit()
+        return result
+
+    def test_only_changes_recorded(self):
+        run1 = self._run([_row("a", 1), _row("b", 1)])
+        run2 = self._run([_row("a", 1), _row("b", 2)])
+        self.assertEqual(self._history(run1), ["a", "b"])
+        self.assertEqual(self._history(run2), ["b"])
+
+    def test_diff_and_restore(self):
+        run1 = self._run([_row("a", 1), _row("b", 1)])
+        run2 = self._run([_row("a", 2), _row("c", 1)])
+        diff = {u: c for _, u, c in diff_runs(self.conn, run1, run2)}
+        self.assertEqual(diff.keys(), {"a", "c"})
+        self.assertEqual(diff["a"]["rapid"], (1, 2))
+        self.assertEqual(diff["c"]["rapid"], (None, 1))
+
+        _, count = restore_run(self.conn, run1)
+        self.assertEqual(count, 2)
+        self.assertEqual(self._export(), {"a": 1, "b": 1})
+        restore_run(self.conn, run2)
+        self.assertEqual(self._export(), {"a": 2, "b": 1, "c": 1})
+
+    def test_run_after_restore(self):
+        run1 = self._run([_row("a", 1), _row("b", 1)])
+        run2 = self._run([_row("a", 2), _row("c", 1)])
+        restore_id, _ = restore_run(self.conn, run1)
+        self.assertEqual(self._history(restore_id), ["a", "c"])
+
+        # The next run finds `a` as restored, so records nothing new.
+        run3 = self._run([_row("a", 1)])
+        self.assertGreater(run3, restore_id)
+        self.assertEqual(self._history(run3), [])
+        diff = {u: c for _, u, c in diff_runs(self.conn, run2, run3)}
+        self.assertEqual(diff.keys(), {"a", "c"})
+        self.assertEqual(diff["a"]["rapid"], (2, 1))
+        self.assertEqual(diff["c"]["rapid"], (1, None))
+
+        restore_run(self.conn, run2)
+        self.assertEqual(self._export(), {"a": 2, "b": 1, "c": 1})
+        restore_run(self.conn, run3)
+        self.assertEqual(self._export(), {"a": 1, "b": 1})
+
+    def test_rerun_after_restore(self):
+        run1 = self._run([_row("a", 1)])
+        self._run([_row("c", 1)])
+        restore_run(self.conn, run1)
+
+        # Coaches deleted by a restore are recorded again once re-exported.
+        run4 = self._run([_row("c", 2)])
+        restore_run(self.conn, run1)
+        restore_run(self.conn, run4)
+        self.assertEqual(self._export(), {"a": 1, "c": 2})
+
+    def test_prune_keeps_restorable_runs(self):
+        run1 = self._run([_row("a", 1), _row("b", 1)])
+        self._run([_row("a", 2)])
+        run3 = self._run([_row("a", 3)])
+        self.assertEqual(prune_runs(self.conn, 2), 1)
+        self.assertEqual(self._history(run1), ["b"])
+        restore_run(self.conn, run3 - 1)
+        self.assertEqual(self._export(), {"a": 2, "b": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()